@@ -0,0 +1,65 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the NetworkIndex lookup with parsing and scanning each block."""
+
+import argparse
+import timeit
+
+import ipaddress
+
+from github_webhook_handler import cidr
+
+HOOK_BLOCKS = ['192.30.252.0/22',
+               '185.199.108.0/22',
+               '140.82.112.0/20',
+               '143.55.64.0/20',
+               '2a0a:a440::/29',
+               '2606:50c0::/32']
+
+
+def linear_scan(blocks, address):
+    request_ip = ipaddress.ip_address(address)
+
+    for block in blocks:
+        if request_ip in ipaddress.ip_network(block):
+            return True
+
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=20000)
+    parser.add_argument('--extra', type=int, default=0,
+                        help='Number of extra /24 networks to add')
+    args = parser.parse_args(argv)
+
+    blocks = HOOK_BLOCKS + ['10.%d.%d.0/24' % (i // 256, i % 256)
+                            for i in range(args.extra)]
+    index = cidr.NetworkIndex(blocks)
+
+    # the worst case for the scan is an address that matches nothing
+    for address in ('140.82.115.1', '8.8.8.8', '2606:50c0::1'):
+        scan = timeit.timeit(lambda: linear_scan(blocks, address),
+                             number=args.number)
+        lookup = timeit.timeit(lambda: address in index, number=args.number)
+
+        print('%-16s blocks=%-5d scan=%7.2fus index=%6.2fus speedup=%.1fx' % (
+            address, len(blocks),
+            scan / args.number * 1e6,
+            lookup / args.number * 1e6,
+            scan / lookup))
+
+
+if __name__ == '__main__':
+    main()
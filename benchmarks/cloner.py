@@ -0,0 +1,152 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare the cached clone with fetching into the clone a second time.
+
+The remote is a local repository reached over file:// and the bytes sent by
+its upload-pack are counted, as they would be sent over the network.
+"""
+
+import argparse
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+import git
+
+from github_webhook_handler import cloner
+
+UPLOAD_PACK = '''#!/bin/sh
+git upload-pack "$@" | tee -a "%s"
+'''
+
+
+def legacy_clone(event, output_dir, cache_dir):
+    """The cached clone as it was, fetching into the clone again."""
+    full_name = event['repository']['full_name']
+    clone_url = event['repository']['clone_url']
+    refspec = event.get('ref')
+
+    cache_git_repo = git.Repo.init(os.path.join(cache_dir, full_name + '.git'),
+                                   bare=True, mkdir=True)
+
+    try:
+        cache_git_repo.delete_remote('origin')
+    except git.GitCommandError:
+        pass
+
+    cache_git_repo.create_remote('origin', clone_url).fetch(refspec=refspec)
+
+    working_git_repo = cache_git_repo.clone(output_dir)
+    working_git_repo.delete_remote('origin')
+    working_git_repo.create_remote('origin', clone_url).fetch(refspec=refspec)
+    working_git_repo.head.commit = event['after']
+    working_git_repo.head.reset(index=True, working_tree=True)
+
+
+def make_upstream(path, files, size):
+    repo = git.Repo.init(path)
+
+    for i in range(files):
+        name = os.path.join(path, 'file%d' % i)
+
+        with open(name, 'wb') as f:
+            f.write(os.urandom(size))
+
+        repo.index.add([name])
+
+    repo.index.commit('initial')
+    return repo
+
+
+def push(repo):
+    """Change a file upstream and return the event for it."""
+    name = os.path.join(repo.working_dir, 'file0')
+
+    with open(name, 'ab') as f:
+        f.write(os.urandom(64))
+
+    repo.index.add([name])
+    sha = repo.index.commit('change').hexsha
+
+    return {'ref': 'refs/heads/master',
+            'after': sha,
+            'repository': {'full_name': 'bench/repo',
+                           'clone_url': 'file://' + repo.working_dir}}
+
+
+def measure(func, event, tmpdir, cache_dir, counter):
+    output_dir = tempfile.mkdtemp(dir=tmpdir)
+    shutil.rmtree(output_dir)
+    open(counter, 'w').close()
+
+    start = time.time()
+    func(event, output_dir, cache_dir)
+    elapsed = time.time() - start
+
+    shutil.rmtree(output_dir)
+    return os.path.getsize(counter), elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=64 * 1024,
+                        help='Size of each file in bytes')
+    parser.add_argument('-n', '--number', type=int, default=5,
+                        help='Pushes to clone after the first')
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        counter = os.path.join(tmpdir, 'bytes')
+        upload_pack = os.path.join(tmpdir, 'upload-pack')
+
+        with open(upload_pack, 'w') as f:
+            f.write(UPLOAD_PACK % counter)
+
+        os.chmod(upload_pack, stat.S_IRWXU)
+
+        # every remote is called origin, so count what each one sends
+        os.environ['GIT_CONFIG_COUNT'] = '1'
+        os.environ['GIT_CONFIG_KEY_0'] = 'remote.origin.uploadpack'
+        os.environ['GIT_CONFIG_VALUE_0'] = upload_pack
+
+        upstream = make_upstream(os.path.join(tmpdir, 'upstream'),
+                                 args.files, args.size)
+
+        paths = [('legacy', legacy_clone),
+                 ('cached', lambda e, o, c: cloner.clone(e, o, cache_dir=c)),
+                 ('shared', lambda e, o, c: cloner.clone(e, o, cache_dir=c,
+                                                         shared=True))]
+
+        for name, func in paths:
+            cache_dir = os.path.join(tmpdir, 'cache-' + name)
+
+            first = measure(func, push(upstream), tmpdir, cache_dir, counter)
+            later = [measure(func, push(upstream), tmpdir, cache_dir, counter)
+                     for _ in range(args.number)]
+
+            print('%-6s first=%10dB %7.2fs  later=%10dB %7.2fs' % (
+                name,
+                first[0], first[1],
+                sum(b for b, _ in later) // len(later),
+                sum(t for _, t in later) / len(later)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare indexed handler dispatch with filtering every handler."""
+
+import argparse
+import timeit
+
+from github_webhook_handler import dispatch
+from github_webhook_handler import handler
+
+
+class FakeRequest(object):
+
+    def __init__(self, event_type, event_data):
+        self.event_type = event_type
+        self.event_data = event_data
+
+
+def make_handlers(count):
+    handlers = []
+
+    for i in range(count):
+        handlers.append({'repo': 'org%d/repo%d' % (i % 50, i),
+                         'type': ['push', 'pull_request'],
+                         'filter': {'ref': 'refs/heads/master'}})
+
+    # a handful of organisation wide handlers
+    for i in range(5):
+        handlers.append({'repo': 'org%d/*' % i, 'type': 'push'})
+
+    return handlers
+
+
+def linear(config, request, handlers):
+    return [h for h in handlers
+            if handler.filter_handler(config, request, h)]
+
+
+def indexed(config, request, handlers):
+    return handlers.match(request.event_type, request.event_data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=200)
+    parser.add_argument('--counts', type=int, nargs='+',
+                        default=[10, 100, 1000, 10000])
+    args = parser.parse_args(argv)
+
+    request = FakeRequest('push', {'ref': 'refs/heads/master',
+                                   'repository': {'full_name': 'org3/repo3'}})
+
+    for count in args.counts:
+        handlers = make_handlers(count)
+        handler_set = dispatch.HandlerSet(handlers)
+
+        assert linear({}, request, handlers) == indexed({}, request,
+                                                        handler_set)
+
+        scan = timeit.timeit(lambda: linear({}, request, handlers),
+                             number=args.number)
+        lookup = timeit.timeit(lambda: indexed({}, request, handler_set),
+                               number=args.number)
+
+        print('handlers=%-6d linear=%10.2fus indexed=%6.2fus' % (
+            count,
+            scan / args.number * 1e6,
+            lookup / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare parsing a whole push with looking up what the filters need."""
+
+import argparse
+import functools
+import json
+import timeit
+import tracemalloc
+
+from github_webhook_handler import filters
+from github_webhook_handler import lazyjson
+
+PATHS = (('ref',), ('repository', 'full_name'), ('pusher', 'name'))
+
+# however small the push, to measure the scan against decoding
+lazy_loads = functools.partial(lazyjson.loads, min_size=0)
+
+
+def make_push(sample, commits):
+    """Scale up a sample push to the given number of commits."""
+    with open(sample) as f:
+        event = json.load(f)
+
+    commit = event['head_commit']
+    event['commits'] = [dict(commit, id='%040x' % i) for i in range(commits)]
+
+    return json.dumps(event)
+
+
+def lookup(loads, text):
+    data = loads(text)
+    return [filters.get_path(data, path) for path in PATHS]
+
+
+def memory(loads, text):
+    """Return the memory held for the parsed event and the peak."""
+    tracemalloc.start()
+    data = loads(text)
+    [filters.get_path(data, path) for path in PATHS]
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=20)
+    parser.add_argument('--sample', default='samples/push1.json')
+    parser.add_argument('--commits', type=int, nargs='+',
+                        default=[1, 20, 200, 2000])
+    args = parser.parse_args(argv)
+
+    for commits in args.commits:
+        text = make_push(args.sample, commits)
+
+        assert lookup(json.loads, text) == lookup(lazy_loads, text)
+
+        full = timeit.timeit(lambda: lookup(json.loads, text),
+                             number=args.number)
+        lazy = timeit.timeit(lambda: lookup(lazy_loads, text),
+                             number=args.number)
+
+        full_held, full_peak = memory(json.loads, text)
+        lazy_held, lazy_peak = memory(lazy_loads, text)
+
+        print('commits=%-5d size=%6dkB full=%9.2fus lazy=%9.2fus '
+              'held=%6dkB/%-6dkB peak=%6dkB/%-6dkB' % (
+                  commits, len(text) // 1024,
+                  full / args.number * 1e6,
+                  lazy / args.number * 1e6,
+                  full_held // 1024, lazy_held // 1024,
+                  full_peak // 1024, lazy_peak // 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compare spawning an interpreter per event with the warm runner."""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from github_webhook_handler import runner
+
+ENTRY_POINT = 'benchmarks.runner:noop'
+
+
+def noop():
+    """Import what the cloner imports and do nothing else."""
+    from github_webhook_handler import cloner  # noqa
+
+
+def spawn(cwd, env):
+    return subprocess.call([sys.executable, '-c',
+                            'from benchmarks.runner import noop; noop()'],
+                           cwd=cwd,
+                           env=env)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    # run from the source tree so the benchmarks package can be imported
+    cwd = os.getcwd()
+    env = os.environ.copy()
+    env['PYTHONPATH'] = cwd
+    warm = runner.WarmRunner()
+
+    # the fork server is started by the first run
+    warm.run(ENTRY_POINT, [], env, cwd)
+
+    start = time.time()
+    for _ in range(args.number):
+        spawn(cwd, env)
+    spawned = (time.time() - start) / args.number
+
+    start = time.time()
+    for _ in range(args.number):
+        warm.run(ENTRY_POINT, [], env, cwd)
+    forked = (time.time() - start) / args.number
+
+    print('spawn=%8.2fms warm=%8.2fms' % (spawned * 1e3, forked * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Measure the request path end to end and the parts of it on their own.
+
+Sample events, scaled up in commits and in the number of handlers, are
+posted to the WSGI app from initialize_application with the meta endpoint
+and Popen mocked out. The results are written as JSON so that runs can be
+compared:
+
+    python -m benchmarks.suite -o before.json
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+
+import fixtures
+import requests_mock
+import yaml
+
+from benchmarks import cloner as cloner_benchmark
+from benchmarks import lazyjson as lazyjson_benchmark
+from github_webhook_handler import application
+from github_webhook_handler import cloner
+from github_webhook_handler import dispatch
+from github_webhook_handler import handler
+from github_webhook_handler import loader
+from github_webhook_handler import utils
+
+REPO_NAME = 'bench/repo'
+KEY = 'benchmark-key'
+HOOKS = ['192.30.252.0/22']
+REMOTE_ADDR = '192.30.252.88'
+
+
+def percentile(samples, p):
+    """The nearest rank percentile of sorted samples."""
+    rank = int(round(p / 100.0 * (len(samples) - 1)))
+    return samples[rank]
+
+
+def summarise(samples):
+    """Throughput and latency in milliseconds of timings in seconds."""
+    samples = sorted(samples)
+    total = sum(samples)
+
+    return {'count': len(samples),
+            'throughput': len(samples) / total if total else None,
+            'mean_ms': total / len(samples) * 1e3,
+            'p50_ms': percentile(samples, 50) * 1e3,
+            'p99_ms': percentile(samples, 99) * 1e3}
+
+
+def repeat(func, number):
+    """Time each of number calls of func."""
+    samples = []
+
+    for _ in range(number):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return samples
+
+
+def micro(func, number):
+    """The mean time of func in microseconds, for those too quick to time."""
+    return {'count': number,
+            'mean_us': timeit.timeit(func, number=number) / number * 1e6}
+
+
+def load_sample(name, commits=None):
+    path = os.path.join('samples', name)
+
+    if commits is not None:
+        return lazyjson_benchmark.make_push(path, commits).encode('utf-8')
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def make_handlers(count):
+    """One handler for the event and count - 1 for other repositories."""
+    handlers = [{'repo': REPO_NAME,
+                 'type': ['push', 'ping'],
+                 'key': KEY,
+                 'filter': {'ref': 'refs/heads/master'},
+                 'action': 'true'}]
+
+    for i in range(count - 1):
+        handlers.append({'repo': 'org%d/repo%d' % (i % 50, i),
+                         'type': ['push', 'pull_request'],
+                         'key': KEY,
+                         'filter': {'ref': 'refs/heads/master'},
+                         'action': 'true'})
+
+    return handlers
+
+
+def with_repository(body):
+    """Point the event at the benchmark repository."""
+    event = json.loads(body.decode('utf-8'))
+    event.setdefault('repository', {})['full_name'] = REPO_NAME
+    event['ref'] = 'refs/heads/master'
+    return json.dumps(event).encode('utf-8')
+
+
+def make_request(event_type, body):
+    digest = hmac.new(KEY.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+    return application.Request.blank(
+        '/',
+        method='POST',
+        body=body,
+        headers={'Content-Type': 'application/json',
+                 'X-Github-Event': event_type,
+                 'X-GitHub-Delivery': str(uuid.uuid4()),
+                 'X-Hub-Signature-256': 'sha256=' + digest},
+        remote_addr=REMOTE_ADDR)
+
+
+def bench_requests(tmpdir, event_type, body, handler_count, number):
+    """Post the event number times to a fresh app and time each."""
+    handlers_file = os.path.join(tmpdir, 'handlers-%d.yaml' % handler_count)
+    config_file = os.path.join(tmpdir, 'config.yaml')
+
+    with open(handlers_file, 'w') as f:
+        yaml.safe_dump(make_handlers(handler_count), f)
+
+    with open(config_file, 'w') as f:
+        yaml.safe_dump({'handlers': handlers_file}, f)
+
+    with requests_mock.Mocker() as m, fixtures.FakePopen():
+        m.get(application.GITHUB_META_URL, json={'hooks': HOOKS})
+        app = application.initialize_application(['-c', config_file])
+
+        def post():
+            response = make_request(event_type, body).get_response(app)
+            assert response.status_int == 200, response.status
+
+        # the first request loads the handlers and meta
+        post()
+
+        return summarise(repeat(post, number))
+
+
+def bench_filter_handler(number):
+    request = application.Request.blank('/')
+    request.headers['X-Github-Event'] = 'push'
+    request.body = with_repository(load_sample('push1.json'))
+    request.event_data
+    h = make_handlers(1)[0]
+
+    return micro(lambda: handler.filter_handler({}, request, h), number)
+
+
+def bench_get_dotted_key(number):
+    data = json.loads(load_sample('push1.json').decode('utf-8'))
+
+    return micro(lambda: utils.get_dotted_key(data, 'repository.owner.name'),
+                 number)
+
+
+def bench_validate_signature(body, number):
+    h = make_handlers(1)[0]
+
+    def validate():
+        # a new request each time, as the digest is cached on the request
+        handler.validate_signature({}, make_request('push', body), h)
+
+    return micro(validate, number)
+
+
+def bench_load_handlers(tmpdir, count, number):
+    path = os.path.join(tmpdir, 'load-%d.yaml' % count)
+
+    with open(path, 'w') as f:
+        yaml.safe_dump(make_handlers(count), f)
+
+    return summarise(repeat(
+        lambda: dispatch.HandlerSet(loader.load_handlers(path)), number))
+
+
+def bench_clone(tmpdir, number):
+    upstream = cloner_benchmark.make_upstream(os.path.join(tmpdir, 'upstream'),
+                                              50, 16 * 1024)
+    cache_dir = os.path.join(tmpdir, 'cache')
+
+    def clone():
+        output_dir = os.path.join(tmpdir, 'out')
+        cloner.clone(cloner_benchmark.push(upstream), output_dir,
+                     cache_dir=cache_dir)
+        shutil.rmtree(output_dir)
+
+    # the first clone fills the cache
+    clone()
+
+    return summarise(repeat(clone, number))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=200,
+                        help='Requests to post in each scenario')
+    parser.add_argument('--micro-number', type=int, default=10000)
+    parser.add_argument('--clone-number', type=int, default=10)
+    parser.add_argument('--commits', type=int, nargs='+',
+                        default=[1, 200, 2000])
+    parser.add_argument('--handlers', type=int, nargs='+',
+                        default=[1, 100, 1000])
+    parser.add_argument('--skip-clone', action='store_true')
+    parser.add_argument('-o', '--output',
+                        help='Write the results here rather than to stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    tmpdir = tempfile.mkdtemp()
+
+    def record(name, params, stats):
+        results.append(dict(stats, name=name, params=params))
+        sys.stderr.write('%-20s %s\n' % (name, json.dumps(params)))
+
+    try:
+        ping = with_repository(load_sample('ping1.json'))
+
+        for handler_count in args.handlers:
+            record('request', {'event': 'ping', 'handlers': handler_count},
+                   bench_requests(tmpdir, 'ping', ping, handler_count,
+                                  args.number))
+
+            for commits in args.commits:
+                body = with_repository(load_sample('push1.json', commits))
+                record('request',
+                       {'event': 'push', 'commits': commits,
+                        'handlers': handler_count, 'bytes': len(body)},
+                       bench_requests(tmpdir, 'push', body, handler_count,
+                                      args.number))
+
+        record('filter_handler', {},
+               bench_filter_handler(args.micro_number))
+        record('get_dotted_key', {},
+               bench_get_dotted_key(args.micro_number))
+
+        for commits in args.commits:
+            body = with_repository(load_sample('push1.json', commits))
+            record('validate_signature', {'bytes': len(body)},
+                   bench_validate_signature(body, args.micro_number // 10))
+
+        for handler_count in args.handlers:
+            record('load_handlers', {'handlers': handler_count},
+                   bench_load_handlers(tmpdir, handler_count,
+                                       max(1, args.number // 10)))
+
+        if not args.skip_clone:
+            record('clone', {'files': 50}, bench_clone(tmpdir,
+                                                       args.clone_number))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = {'python': platform.python_version(),
+              'platform': platform.platform(),
+              'time': time.time(),
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -11,24 +11,38 @@
 # under the License.
 
 import argparse
+import hmac
 import os
 import sys
+import time
 
-import ipaddress
-import requests
 import webob
 import webob.dec
 import webob.exc
 import yaml
 
+from github_webhook_handler import executor
 from github_webhook_handler import handler
+from github_webhook_handler import lazyjson
+from github_webhook_handler import meta
+from github_webhook_handler import metrics
+from github_webhook_handler import payload as event_payload
+from github_webhook_handler import prefetch
+from github_webhook_handler import profiling
+from github_webhook_handler import repocache
 
-GITHUB_META_URL = 'https://api.github.com/meta'
+GITHUB_META_URL = meta.GITHUB_META_URL
 
 
-class Request(webob.Request):
+class EventMixin(object):
+    """The parts of a delivery the handlers need from a request.
+
+    The request class must provide headers and body.
+    """
 
     _event_data = None
+    _digests = None
+    _payload = None
 
     @property
     def event_type(self):
@@ -36,37 +50,115 @@ class Request(webob.Request):
 
     @property
     def event_data(self):
-        """Cache the JSON body so as not to interpret it multiple times."""
+        """The JSON body, parsed once and only as far as it is looked at."""
         if self._event_data is None:
-            self._event_data = self.json_body
+            self._event_data = lazyjson.loads(self.body.decode('utf-8'))
 
         return self._event_data
 
+    @property
+    def payload(self):
+        """The body as a file shared by the actions run for the request."""
+        if self._payload is None:
+            self._payload = event_payload.Payload(self.body)
+
+        return self._payload
+
+    @property
+    def delivery(self):
+        return self.headers.get('X-GitHub-Delivery')
+
     @property
     def signature(self):
-        return self.headers.get('X-Hub-Signature')
+        """The strongest signature header sent with the request."""
+        for header in handler.SIGNATURE_HEADERS:
+            signature = self.headers.get(header)
+
+            if signature:
+                return signature
+
+        return None
+
+    def hexdigest(self, key, algorithm):
+        """Cache the HMAC of the body so it is computed once for each key."""
+        if self._digests is None:
+            self._digests = {}
+
+        try:
+            return self._digests[(key, algorithm)]
+        except KeyError:
+            mac = hmac.new(key,
+                           msg=self.body,
+                           digestmod=handler.DIGESTS[algorithm])
+            digest = self._digests[(key, algorithm)] = mac.hexdigest()
+            return digest
+
+
+class Request(EventMixin, webob.Request):
+    pass
 
 
 def application(request, config):
+    if metrics.is_metrics_request(config, request):
+        return metrics_response(request, config)
+
     if request.path != '/':
         raise webob.exc.HTTPNotFound()
 
     if request.method != 'POST':
         raise webob.exc.HTTPMethodNotAllowed()
 
-    request_ip = ipaddress.ip_address(request.client_addr.decode('utf-8'))
-    hook_blocks = requests.get(GITHUB_META_URL).json()['hooks']
+    stats = metrics.get_metrics(config)
+    start = time.time()
+
+    try:
+        if profiling.enabled(config):
+            response = profiling.get_profiler(config).run(
+                request, _delivery, request, config, stats)
+        else:
+            response = _delivery(request, config, stats)
+    except webob.exc.HTTPException as e:
+        stats.requests.observe(time.time() - start, (str(e.code),))
+        raise
+
+    stats.requests.observe(time.time() - start, (str(response.status_int),))
+    return response
+
+
+def _delivery(request, config, stats):
+    with stats.stage('meta'):
+        networks = meta.get_cache(config).networks()
+
+    if networks is None:
+        raise webob.exc.HTTPServiceUnavailable()
 
-    for block in hook_blocks:
-        if request_ip in ipaddress.ip_network(block):
-            break
-    else:
+    if request.client_addr not in networks:
         raise webob.exc.HTTPForbidden()
 
     return handler.handle(config, request)
 
 
-def initialize_application(argv=None):
+def metrics_response(request, config):
+    if request.method not in ('GET', 'HEAD'):
+        raise webob.exc.HTTPMethodNotAllowed()
+
+    response = webob.Response(
+        status=200,
+        body=metrics.get_metrics(config).render().encode('utf-8'))
+    response.headers['Content-Type'] = metrics.CONTENT_TYPE
+    return response
+
+
+def load_config(path):
+    if not path:
+        return {}
+
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def configure(argv=None):
+    """Load the config named on the command line and warm the caches."""
     parser = argparse.ArgumentParser()
     parser.add_argument('-c', '--config',
                         dest='config',
@@ -75,10 +167,34 @@ def initialize_application(argv=None):
 
     args = parser.parse_args(sys.argv[1:] if argv is None else argv)
 
-    config = {}
+    config = load_config(args.config)
+
+    # warm the cache before the first delivery arrives
+    meta.get_cache(config).refresh_async()
 
-    if args.config:
-        with open(args.config, 'r') as f:
-            config = yaml.safe_load(f) or {}
+    start_background(config)
+
+    return config
+
+
+def start_background(config):
+    """Start the cache maintenance and prefetching the config asks for."""
+    if repocache.enabled(config):
+        repocache.get_manager(config).start()
+
+    if prefetch.enabled(config):
+        prefetch.get_prefetcher(config).start()
+
+
+def make_application(config, resume=True):
+    """Wrap the application for a config, resuming spooled jobs first."""
+    if resume and config.get('execution') == 'async':
+        executor.get_executor(config).resume(
+            retention=config.get('spool_retention',
+                                 executor.DEFAULT_SPOOL_RETENTION))
 
     return webob.dec.wsgify(application, args=(config,), RequestClass=Request)
+
+
+def initialize_application(argv=None):
+    return make_application(configure(argv))
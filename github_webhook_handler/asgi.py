@@ -0,0 +1,410 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""An ASGI version of the application for running on an asyncio loop.
+
+Deliveries are handled the same way as by the WSGI application but nothing
+blocks the event loop while waiting: the first fetch of the GitHub meta data
+and the removal of working directories happen in the default thread pool and
+actions are run with asyncio subprocesses, so one process can be handling
+many deliveries and running many actions at once.
+"""
+
+import asyncio
+import json
+import logging
+import shlex
+import shutil
+import tempfile
+import time
+
+import webob.exc
+import webob.headers
+
+from github_webhook_handler import application
+from github_webhook_handler import dedup
+from github_webhook_handler import dispatch
+from github_webhook_handler import executor
+from github_webhook_handler import handler
+from github_webhook_handler import meta
+from github_webhook_handler import metrics
+from github_webhook_handler import spool
+from github_webhook_handler import utils
+
+LOG = logging.getLogger(__name__)
+
+
+class Request(application.EventMixin):
+    """A delivery received over ASGI."""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+
+        self.method = scope['method']
+        self.path = scope.get('root_path', '') + scope['path']
+        self.headers = webob.headers.ResponseHeaders(
+            [(name.decode('latin-1'), value.decode('latin-1'))
+             for name, value in scope.get('headers', [])])
+
+    @property
+    def client_addr(self):
+        # the same rules as webob so both applications trust the same peers
+        forwarded_for = self.headers.get('X-Forwarded-For')
+
+        if forwarded_for is not None:
+            return forwarded_for.split(',')[0].strip()
+
+        client = self.scope.get('client')
+        return client[0] if client else None
+
+
+async def execute(config, job):
+    """Run the action of a job and return its exit code."""
+    if not job.action:
+        return None
+
+    limit = executor.get_node_limit(config)
+    slot = None
+
+    if limit is not None:
+        # poll on the loop rather than waiting in a thread, the threads of
+        # the default pool are needed by running jobs to release their slots
+        slot = limit.try_acquire()
+
+        while slot is None:
+            await asyncio.sleep(limit.poll)
+            slot = limit.try_acquire()
+
+    stats = metrics.get_metrics(config)
+    start = time.time()
+    returncode = None
+
+    try:
+        returncode = await _execute(config, job, stats)
+    finally:
+        stats.record_action(job.handler, returncode, time.time() - start)
+
+        if slot is not None:
+            limit.release(slot)
+
+    return returncode
+
+
+async def _execute(config, job, stats):
+    env = executor.action_env(config, job)
+    loop = asyncio.get_event_loop()
+
+    # working dir is a temporary directory the scripts are executed from, the
+    # event file is shared by every action for the event
+    working_dir = tempfile.mkdtemp()
+
+    try:
+        with job.payload.held() as event_file:
+            env['GWH_EVENT_FILE'] = event_file
+
+            if job.entry_point:
+                # the warm runner waits on the process so give it a thread
+                return await loop.run_in_executor(None,
+                                                  executor.run_entry_point,
+                                                  config, job, env,
+                                                  working_dir)
+
+            stdin = open(event_file, 'rb') if job.event_stdin else None
+
+            try:
+                with stats.stage('spawn'):
+                    process = await asyncio.create_subprocess_exec(
+                        *shlex.split(job.action),
+                        cwd=working_dir,
+                        env=env,
+                        stdin=stdin)
+            finally:
+                if stdin:
+                    stdin.close()
+
+            return await process.wait()
+    finally:
+        # an action can leave a large checkout behind
+        await loop.run_in_executor(None, shutil.rmtree, working_dir)
+
+
+class AsyncExecutor(object):
+    """Run jobs in the background as tasks on the event loop.
+
+    The same queueing rules as executor.Executor apply, with workers limiting
+    how many actions are run at once. The actions are waited on by the event
+    loop rather than by a thread each so the limit can be much higher.
+    """
+
+    def __init__(self, config, workers=executor.DEFAULT_WORKERS,
+                 queue_size=executor.DEFAULT_QUEUE_SIZE, spool=None):
+        self.config = config
+        self.workers = workers
+        self.spool = spool
+
+        self._queue = executor.JobQueue(queue_size=queue_size)
+        self._tasks = set()
+        self._stopped = False
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config,
+                   workers=config.get('action_workers',
+                                      executor.DEFAULT_WORKERS),
+                   queue_size=config.get('action_queue_size',
+                                         executor.DEFAULT_QUEUE_SIZE),
+                   spool=(spool.Spool.from_config(config)
+                          if config.get('spool') else None))
+
+    def submit(self, jobs):
+        """Queue jobs to be run. Either all of the jobs are queued or none."""
+        if self._stopped:
+            raise executor.QueueFull()
+
+        self._queue.check(jobs)
+        spool_ids = executor.record_jobs(self.spool, jobs)
+
+        try:
+            self._queue.add(jobs)
+        except Exception:
+            executor.discard_jobs(self.spool, spool_ids)
+            raise
+
+        self._dispatch()
+
+    def resume(self, retention=executor.DEFAULT_SPOOL_RETENTION):
+        """Queue the jobs in the spool that have not been completed."""
+        jobs = executor.pending_jobs(self.spool, retention)
+        self._queue.extend(jobs)
+        self._dispatch()
+        return len(jobs)
+
+    async def join(self):
+        """Wait for every queued job to finish."""
+        # a finishing job starts the next before its task is done
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+
+    async def stop(self):
+        """Drop any queued jobs and wait for the running ones to finish."""
+        self._stopped = True
+        self._queue.clear()
+        await self.join()
+
+    def stats(self):
+        return self._queue.stats()
+
+    def _dispatch(self):
+        while not self._stopped and self._queue.running < self.workers:
+            job = self._queue.take()
+
+            if job is None:
+                break
+
+            task = asyncio.ensure_future(self._run(job))
+            task.add_done_callback(self._tasks.discard)
+            self._tasks.add(task)
+
+    async def _run(self, job):
+        try:
+            returncode = await execute(self.config, job)
+        except Exception:
+            LOG.exception('Failed to run action %s', job.action)
+        else:
+            if returncode:
+                LOG.warning('Action %s exited with %d', job.action, returncode)
+        finally:
+            executor.complete_jobs(self.spool, job)
+            self._queue.done(job)
+            self._dispatch()
+
+
+def get_executor(config):
+    """Fetch the executor for the application with this config."""
+    return utils.config_state(config, 'async_executor',
+                              AsyncExecutor.from_config)
+
+
+class Application(object):
+    """The ASGI application. Handles lifespan and http scopes."""
+
+    def __init__(self, config):
+        self.config = config
+        self._started = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    def startup(self):
+        """Resume spooled jobs. Run on startup or by the first request."""
+        if self._started:
+            return
+
+        self._started = True
+
+        if self.config.get('execution') == 'async':
+            get_executor(self.config).resume(
+                retention=self.config.get('spool_retention',
+                                          executor.DEFAULT_SPOOL_RETENTION))
+
+    async def shutdown(self):
+        if self.config.get('execution') == 'async':
+            await get_executor(self.config).stop()
+
+    async def application(self, request):
+        if request.path != '/':
+            raise webob.exc.HTTPNotFound()
+
+        if request.method != 'POST':
+            raise webob.exc.HTTPMethodNotAllowed()
+
+        with metrics.get_metrics(self.config).stage('meta'):
+            networks = await self._networks()
+
+        if networks is None:
+            raise webob.exc.HTTPServiceUnavailable()
+
+        if request.client_addr not in networks:
+            raise webob.exc.HTTPForbidden()
+
+        return await self.handle(request)
+
+    async def handle(self, request):
+        """Run or queue the actions for a request like handler.handle."""
+        config = self.config
+        handlers = dispatch.handler_set(handler._handlers_from_file(config))
+
+        with metrics.get_metrics(config).stage('hmac'):
+            handler.verify_request(config, request, handlers)
+
+        with dedup.track(config, request.delivery) as new:
+            if not new:
+                return 200, {'duplicate': True}
+
+            jobs = [executor.Job.from_request(request, h)
+                    for h in handler.match_handlers(config, request, handlers)
+                    if executor.has_action(h)]
+
+            if config.get('execution') == 'async':
+                if not jobs:
+                    return 200, {}
+
+                try:
+                    get_executor(config).submit(jobs)
+                except executor.QueueFull:
+                    raise webob.exc.HTTPServiceUnavailable(
+                        comment='Action queue is full.')
+
+                return 202, {'queued': len(jobs)}
+
+            if jobs:
+                # hold the event file so every action reads the same copy
+                with request.payload.held():
+                    for job in jobs:
+                        await execute(config, job)
+
+            return 200, {}
+
+    async def _networks(self):
+        cache = meta.get_cache(self.config)
+
+        # only the first fetch blocks, after that expired data is returned
+        # while a refresh happens in the background
+        if cache.loaded:
+            return cache.networks()
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, cache.networks)
+
+    async def _delivery(self, request):
+        stats = metrics.get_metrics(self.config)
+        start = time.time()
+
+        try:
+            status, data = await self.application(request)
+        except webob.exc.HTTPException as e:
+            status = e.code
+            content_type = 'text/plain'
+            body = e.status.encode('utf-8')
+        except Exception:
+            LOG.exception('Failed to handle request')
+            status = 500
+            content_type = 'text/plain'
+            body = b'500 Internal Server Error'
+        else:
+            content_type = 'application/json'
+            body = json.dumps(data).encode('utf-8')
+
+        # only deliveries to the hook are timed, as in the WSGI application
+        if request.path == '/' and request.method == 'POST':
+            stats.requests.observe(time.time() - start, (str(status),))
+
+        return status, content_type, body
+
+    def _metrics(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return 405, 'text/plain', b'405 Method Not Allowed'
+
+        return (200, metrics.CONTENT_TYPE,
+                metrics.get_metrics(self.config).render().encode('utf-8'))
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        self.startup()
+
+        body = []
+
+        while True:
+            message = await receive()
+
+            if message['type'] == 'http.disconnect':
+                return
+
+            body.append(message.get('body', b''))
+
+            if not message.get('more_body'):
+                break
+
+        request = Request(scope, b''.join(body))
+
+        if metrics.is_metrics_request(self.config, request):
+            status, content_type, body = self._metrics(request)
+        else:
+            status, content_type, body = await self._delivery(request)
+
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(b'content-type', content_type.encode()),
+                                (b'content-length', str(len(body)).encode())]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def initialize_application(argv=None):
+    # the ASGI server owns the command line so unless arguments are passed
+    # the config file is named by GWH_CONFIG_FILE
+    return Application(application.configure([] if argv is None else argv))
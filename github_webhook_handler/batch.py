@@ -0,0 +1,239 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Clone the repositories of many events at once.
+
+The events are grouped by repository and each repository is fetched into
+the cache once, with the refs of all of its events. Then every event is
+checked out from the cache. Both are spread over a pool of processes.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from github_webhook_handler import cloner
+from github_webhook_handler import mirror
+
+LOG = logging.getLogger(__name__)
+
+
+def load_events(path):
+    """Read events from a JSON lines file or a directory of JSON files."""
+    if os.path.isdir(path):
+        events = []
+
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.json'):
+                with open(os.path.join(path, name)) as f:
+                    events.append(json.load(f))
+
+        return events
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def group_events(events):
+    """Return the indexes of the events of each repository."""
+    groups = {}
+
+    for i, event in enumerate(events):
+        full_name, _ = cloner.event_repository(event)
+        groups.setdefault(full_name, []).append(i)
+
+    return groups
+
+
+def output_path(output_dir, index, event):
+    full_name, _ = cloner.event_repository(event)
+    name = '%d-%s' % (index, (event.get('after') or 'head')[:12])
+    return os.path.join(output_dir, full_name, name)
+
+
+def _fetch(args):
+    """Fetch the refs of the events of one repository into its mirror.
+
+    Returns the commit each ref was fetched at, or the error if the fetch
+    failed.
+    """
+    cache_dir, full_name, events, options = args
+    clone_url = cloner.event_repository(events[0])[1]
+
+    refspecs = set()
+    for event in events:
+        refspecs.update(cloner.mirror_refspecs(event))
+
+    try:
+        cache = mirror.Mirror(cache_dir, full_name)
+        repo = cache.fetch(clone_url,
+                           refspec=sorted(refspecs),
+                           depth=options.get('depth'),
+                           filter_spec=options.get('filter_spec'))
+
+        refs = {}
+        for refspec in refspecs:
+            ref = refspec.split(':')[1]
+            refs[ref] = repo.commit(ref).hexsha
+    except Exception as e:
+        LOG.exception('Failed to fetch %s', full_name)
+        return full_name, str(e) or e.__class__.__name__
+
+    return full_name, refs
+
+
+def _checkout(args):
+    """Check out one event and return its result."""
+    index, event, output_dir, cache_dir, options, error = args
+    start = time.time()
+    result = {'index': index,
+              'full_name': event['repository']['full_name'],
+              'after': event.get('after'),
+              'output_dir': output_dir}
+
+    if error:
+        # the fetch of the repository failed
+        result['error'] = error
+        result['seconds'] = 0.0
+        return result
+
+    try:
+        if options.get('worktree'):
+            cloner.clone_worktree(event, output_dir, cache_dir,
+                                  depth=options.get('depth'),
+                                  filter_spec=options.get('filter_spec'),
+                                  sparse=options.get('sparse'))
+        else:
+            cloner.clone(event, output_dir,
+                         cache_dir=cache_dir,
+                         shared=options.get('shared', False),
+                         depth=options.get('depth'),
+                         filter_spec=options.get('filter_spec'),
+                         sparse=options.get('sparse'))
+    except Exception as e:
+        LOG.exception('Failed to check out event %d', index)
+        result['error'] = str(e) or e.__class__.__name__
+
+    result['seconds'] = time.time() - start
+    return result
+
+
+def run(events, output_dir, cache_dir, jobs=None, **options):
+    """Clone every event and return a result for each, in order.
+
+    Each result has the index of the event, full_name, after, output_dir,
+    seconds and, if the checkout failed, error.
+    """
+    groups = group_events(events)
+    pool = multiprocessing.Pool(jobs)
+
+    try:
+        fetches = [(cache_dir, full_name, [events[i] for i in indexes],
+                    options)
+                   for full_name, indexes in groups.items()]
+        heads = dict(pool.map(_fetch, fetches))
+
+        checkouts = []
+
+        for i, event in enumerate(events):
+            full_name, _ = cloner.event_repository(event)
+            refs = heads[full_name]
+            error = refs if not isinstance(refs, dict) else None
+
+            if not error and not event.get('after'):
+                # check out what was fetched rather than fetching again
+                ref = event.get('ref') or cloner.default_ref(event)
+                event = dict(event, after=refs[ref])
+
+            checkouts.append((i, event, output_path(output_dir, i, event),
+                              cache_dir, options, error))
+
+        return pool.map(_checkout, checkouts)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def print_summary(results, elapsed, out=sys.stdout):
+    for result in results:
+        status = 'error: %s' % result['error'] if 'error' in result else 'ok'
+        out.write('%4d %-40s %-12s %7.2fs %s\n' % (
+            result['index'],
+            result['full_name'],
+            (result['after'] or '')[:12],
+            result['seconds'],
+            status))
+
+    failed = sum(1 for result in results if 'error' in result)
+    out.write('%d events, %d failed, %.2fs\n' % (len(results),
+                                                 failed,
+                                                 elapsed))
+
+
+def main(argv=None):
+    """Clone the repositories of a batch of events."""
+    parser = argparse.ArgumentParser(prog='github-webhook-cloner batch')
+
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        default=os.environ.get('GWH_CACHE_DIR'),
+                        help='The cache to fetch into, by default .cache in '
+                             'the output directory')
+
+    parser.add_argument('-o', '--output-dir',
+                        dest='output_dir',
+                        default=os.path.abspath('repos'),
+                        help='The directory to check out into, each event '
+                             'is checked out into <full_name>/<index>-<sha>')
+
+    parser.add_argument('-j', '--jobs',
+                        type=int,
+                        default=None,
+                        help='How many processes to run, by default one for '
+                             'each CPU')
+
+    # the same as for cloning a single event
+    parser.add_argument('--depth', type=int)
+    parser.add_argument('--filter', dest='filter_spec')
+    parser.add_argument('--sparse', action='append')
+    parser.add_argument('--shared', action='store_true')
+    parser.add_argument('--worktree', action='store_true')
+
+    parser.add_argument('events',
+                        help='A file of events, one JSON object per line, '
+                             'or a directory of JSON event files')
+
+    logging.basicConfig(level=logging.INFO)
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    events = load_events(args.events)
+
+    # kept, as clones can borrow objects from it
+    cache_dir = args.cache_dir or os.path.join(args.output_dir, '.cache')
+    start = time.time()
+
+    results = run(events, args.output_dir, cache_dir,
+                  jobs=args.jobs,
+                  depth=args.depth,
+                  filter_spec=args.filter_spec,
+                  sparse=args.sparse,
+                  shared=args.shared,
+                  worktree=args.worktree)
+
+    print_summary(results, time.time() - start)
+
+    return 1 if any('error' in result for result in results) else 0
@@ -0,0 +1,75 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+
+import ipaddress
+
+
+def _text(value):
+    # ipaddress requires unicode strings on python 2
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+
+    return value
+
+
+class NetworkIndex(object):
+    """A set of IPv4 and IPv6 networks compiled for fast membership tests.
+
+    Each network is converted to an interval of integer addresses and
+    overlapping or adjacent intervals are merged. Membership is then a binary
+    search over the interval start addresses.
+    """
+
+    def __init__(self, networks=()):
+        intervals = {4: [], 6: []}
+
+        for network in networks:
+            network = ipaddress.ip_network(_text(network), strict=False)
+            intervals[network.version].append(
+                (int(network.network_address),
+                 int(network.broadcast_address)))
+
+        self._starts = {}
+        self._ends = {}
+
+        for version, ranges in intervals.items():
+            starts = []
+            ends = []
+
+            for start, end in sorted(ranges):
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+
+            self._starts[version] = tuple(starts)
+            self._ends[version] = tuple(ends)
+
+    def __len__(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def __contains__(self, address):
+        if not isinstance(address, (ipaddress.IPv4Address,
+                                    ipaddress.IPv6Address)):
+            address = ipaddress.ip_address(_text(address))
+
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        value = int(address)
+        starts = self._starts[address.version]
+        i = bisect.bisect_right(starts, value) - 1
+
+        return i >= 0 and value <= self._ends[address.version][i]
@@ -14,44 +14,185 @@ import argparse
 import json
 import logging
 import os
+import shutil
 import sys
 
 import git
 
+from github_webhook_handler import mirror
+from github_webhook_handler import prefetch
+from github_webhook_handler import repocache
+from github_webhook_handler import worktree
 
-def clone(event, output_dir, cache_dir=None):
+
+def event_repository(event):
+    """Return the full_name and clone_url of the repository of an event."""
     try:
         full_name = event.get('repository', {})['full_name']
         clone_url = event.get('repository', {})['clone_url']
     except KeyError:
         raise RuntimeError("Bad event payload")
 
-    refspec = event.get('ref')
+    return full_name, clone_url
+
+
+def default_ref(event):
+    """The ref of the default branch of the repository of an event."""
+    branch = event.get('repository', {}).get('default_branch', 'master')
+    return 'refs/heads/' + branch
+
+
+def mirror_refspecs(event):
+    """The refs of the event to update in the mirror."""
+    refs = [event.get('ref') or default_ref(event)]
+
+    # without a commit the clone is of the default branch
+    if not event.get('after') and default_ref(event) not in refs:
+        refs.append(default_ref(event))
+
+    return ['+%s:%s' % (ref, ref) for ref in refs]
+
+
+def _remote_refspecs(event):
+    """The refs of the event to fetch into a clone without a mirror."""
+    refspecs = []
+
+    for refspec in mirror_refspecs(event):
+        src = refspec.split(':')[0]
+
+        if src.startswith('+refs/heads/'):
+            dst = 'refs/remotes/origin/' + src[len('+refs/heads/'):]
+        else:
+            dst = src[1:]
+
+        refspecs.append('%s:%s' % (src, dst))
+
+    return refspecs
+
+
+def clone_worktree(event, output_dir, cache_dir,
+                   pool_size=worktree.DEFAULT_POOL_SIZE,
+                   depth=None, filter_spec=None, sparse=None):
+    """Check out the event into a worktree of the cache mirror.
+
+    Only the mirror is fetched into, and output_dir is a worktree that is
+    reset to the commit of the event so only changed files are written.
+    """
+    full_name, clone_url = event_repository(event)
+    ref = event.get('ref') or default_ref(event)
+
+    cache = mirror.Mirror(cache_dir, full_name)
+    cache_git_repo = cache.fetch(clone_url,
+                                 refspec=mirror_refspecs(event),
+                                 commit=event.get('after'),
+                                 depth=depth,
+                                 filter_spec=filter_spec)
+
+    commit = event.get('after') or cache_git_repo.commit(ref).hexsha
+
+    pool = worktree.WorktreePool.for_mirror(cache, size=pool_size)
+    pool.prune()
+    return pool.checkout(output_dir, commit, sparse=sparse)
+
+
+def release_worktree(event, output_dir, cache_dir,
+                     pool_size=worktree.DEFAULT_POOL_SIZE):
+    """Give a worktree from clone_worktree back to the pool of its mirror."""
+    full_name, _ = event_repository(event)
+    cache = mirror.Mirror(cache_dir, full_name)
+
+    pool = worktree.WorktreePool.for_mirror(cache, size=pool_size)
+    pool.release(output_dir)
+
+
+def _borrow(cache_git_repo, output_dir, clone_url):
+    """Make a clone of a shallow or partial mirror that borrows its objects.
+
+    Such a mirror can't be cloned locally, as it only sends what is
+    reachable from its refs and can't send the objects it is missing. So the
+    clone uses the objects of the mirror through alternates and takes its
+    branches. A partial clone fetches what is missing from clone_url as it
+    is needed.
+    """
+    working_git_repo = git.Repo.init(output_dir)
+
+    with open(os.path.join(working_git_repo.git_dir,
+                           'objects', 'info', 'alternates'), 'w') as f:
+        f.write(os.path.join(cache_git_repo.git_dir, 'objects') + '\n')
+
+    if mirror.is_shallow(cache_git_repo):
+        shutil.copy(os.path.join(cache_git_repo.git_dir, 'shallow'),
+                    os.path.join(working_git_repo.git_dir, 'shallow'))
+
+    working_git_repo.create_remote('origin', clone_url)
+    filter_spec = mirror.partial_filter(cache_git_repo)
+
+    if filter_spec:
+        with working_git_repo.config_writer() as config:
+            config.set_value('core', 'repositoryformatversion', 1)
+            config.set_value('extensions', 'partialClone', 'origin')
+            config.set_value('remote "origin"', 'promisor', True)
+            config.set_value('remote "origin"', 'partialclonefilter',
+                             filter_spec)
+
+    for head in cache_git_repo.heads:
+        working_git_repo.git.update_ref('refs/remotes/origin/' + head.name,
+                                        head.commit.hexsha)
+
+    return working_git_repo
+
+
+def clone(event, output_dir, cache_dir=None, shared=False,
+          depth=None, filter_spec=None, sparse=None):
+    """Clone the repository of the event and check out its commit.
+
+    With a cache_dir only the mirror is fetched into and the clone is made
+    from it. Its objects are hardlinked, or with shared borrowed through
+    alternates, so nothing is copied or fetched a second time.
+
+    depth and filter_spec limit the history and objects that are fetched,
+    and sparse limits the checkout to a list of directories.
+    """
+    full_name, clone_url = event_repository(event)
+
     commit = event.get('after')
 
     if cache_dir:
-        cache_git_dir = os.path.join(cache_dir, full_name + '.git')
-        cache_git_repo = git.Repo.init(cache_git_dir, bare=True, mkdir=True)
+        cache = mirror.Mirror(cache_dir, full_name)
+        cache_git_repo = cache.fetch(clone_url,
+                                     refspec=mirror_refspecs(event),
+                                     commit=commit,
+                                     depth=depth,
+                                     filter_spec=filter_spec)
 
-        try:
-            cache_git_repo.delete_remote('origin')
-        except git.GitCommandError:
-            pass
+        with cache.lock():
+            shallow = mirror.is_shallow(cache_git_repo)
 
-        origin = cache_git_repo.create_remote('origin', clone_url)
-        origin.fetch(refspec=refspec)
+            if shallow or mirror.partial_filter(cache_git_repo):
+                working_git_repo = _borrow(cache_git_repo, output_dir,
+                                           clone_url)
+            else:
+                working_git_repo = cache_git_repo.clone(output_dir,
+                                                        shared=shared,
+                                                        no_checkout=True)
 
-        working_git_repo = cache_git_repo.clone(output_dir)
+                # the branches of the mirror are the remote branches
+                working_git_repo.git.remote('set-url', 'origin', clone_url)
 
-        try:
-            working_git_repo.delete_remote('origin')
-        except git.GitCommandError:
-            pass
+    elif depth or filter_spec:
+        working_git_repo = git.Repo.init(output_dir)
+        working_git_repo.create_remote('origin', clone_url)
+        mirror.fetch(working_git_repo,
+                     refspec=_remote_refspecs(event),
+                     commit=commit,
+                     depth=depth,
+                     filter_spec=filter_spec)
 
-        origin = working_git_repo.create_remote('origin', clone_url)
-        origin.fetch(refspec=refspec)
     else:
-        working_git_repo = git.Repo.clone_from(clone_url, output_dir)
+        working_git_repo = git.Repo.clone_from(clone_url, output_dir,
+                                               no_checkout=True)
+
+    worktree.sparse_checkout(working_git_repo, sparse)
 
     if commit:
         try:
@@ -77,7 +218,25 @@ def clone(event, output_dir, cache_dir=None):
     working_git_repo.head.reset(index=True, working_tree=True)
 
 
+def _env_list(name):
+    value = os.environ.get(name)
+    return value.split(os.pathsep) if value else None
+
+
 def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv[:1] == ['maintain']:
+        return repocache.main(argv[1:])
+
+    if argv[:1] == ['batch']:
+        # imported here as the batch module uses this one
+        from github_webhook_handler import batch
+        return batch.main(argv[1:])
+
+    if argv[:1] == ['prefetch']:
+        return prefetch.main(argv[1:])
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--cache-dir',
@@ -90,6 +249,47 @@ def main(argv=None):
                         default=os.path.abspath('repo'),
                         help='The directory to clone into')
 
+    parser.add_argument('--depth',
+                        type=int,
+                        default=os.environ.get('GWH_CLONE_DEPTH'),
+                        help='Only fetch this many commits of history')
+
+    parser.add_argument('--filter',
+                        dest='filter_spec',
+                        default=os.environ.get('GWH_CLONE_FILTER'),
+                        help='Make a partial clone, such as blob:none to '
+                             'fetch file contents only when checked out or '
+                             'tree:0 to also fetch trees as needed')
+
+    parser.add_argument('--sparse',
+                        action='append',
+                        default=_env_list('GWH_CLONE_SPARSE'),
+                        help='Only check out this directory, may be given '
+                             'more than once')
+
+    parser.add_argument('--shared',
+                        action='store_true',
+                        help='Borrow the objects of the cache mirror instead '
+                             'of hardlinking them. The clone breaks if the '
+                             'mirror is removed.')
+
+    parser.add_argument('--worktree',
+                        action='store_true',
+                        default=bool(os.environ.get('GWH_CLONE_WORKTREE')),
+                        help='Check out a worktree of the cache mirror '
+                             'instead of cloning it, needs --cache-dir')
+
+    parser.add_argument('--pool-size',
+                        dest='pool_size',
+                        type=int,
+                        default=worktree.DEFAULT_POOL_SIZE,
+                        help='How many released worktrees to keep for reuse')
+
+    parser.add_argument('--release',
+                        action='store_true',
+                        help='Give the worktree in the output directory back '
+                             'to the pool instead of checking one out')
+
     parser.add_argument('event',
                         type=argparse.FileType('r'),
                         default=os.environ.get('GWH_EVENT_FILE',
@@ -99,11 +299,29 @@ def main(argv=None):
 
     logging.basicConfig(level=logging.INFO)
 
-    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    args = parser.parse_args(argv)
 
     event_data = json.load(args.event)
 
-    clone(event_data, args.output_dir, cache_dir=args.cache_dir)
+    if (args.worktree or args.release) and not args.cache_dir:
+        parser.error('--worktree and --release need --cache-dir')
+
+    if args.release:
+        release_worktree(event_data, args.output_dir, args.cache_dir,
+                         pool_size=args.pool_size)
+    elif args.worktree:
+        clone_worktree(event_data, args.output_dir, args.cache_dir,
+                       pool_size=args.pool_size,
+                       depth=args.depth,
+                       filter_spec=args.filter_spec,
+                       sparse=args.sparse)
+    else:
+        clone(event_data, args.output_dir,
+              cache_dir=args.cache_dir,
+              shared=args.shared,
+              depth=args.depth,
+              filter_spec=args.filter_spec,
+              sparse=args.sparse)
 
 
 if __name__ == '__main__':
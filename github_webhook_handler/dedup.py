@@ -0,0 +1,199 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import contextlib
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from github_webhook_handler import utils
+
+DEFAULT_SIZE = 10000
+DEFAULT_TTL = 3600
+
+
+class DeliveryCache(object):
+    """Remember recently seen delivery ids in memory.
+
+    At most maxsize ids are kept, the oldest being forgotten first, and an id
+    is forgotten once it is older than ttl seconds.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SIZE, ttl=DEFAULT_TTL, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._seen = collections.OrderedDict()
+
+    def add(self, delivery_id):
+        """Record a delivery. Returns False if it has already been seen."""
+        now = self._clock()
+
+        with self._lock:
+            # ids are never refreshed so the oldest is always at the front
+            while self._seen:
+                oldest, seen_at = next(iter(self._seen.items()))
+
+                if now - seen_at < self.ttl:
+                    break
+
+                del self._seen[oldest]
+
+            if delivery_id in self._seen:
+                return False
+
+            self._seen[delivery_id] = now
+
+            if len(self._seen) > self.maxsize:
+                self._seen.popitem(last=False)
+
+            return True
+
+    def discard(self, delivery_id):
+        """Forget a delivery so that a retry of it is accepted."""
+        with self._lock:
+            self._seen.pop(delivery_id, None)
+
+
+class FileDeliveryCache(object):
+    """Remember recently seen delivery ids in a file shared by processes.
+
+    The file is a fixed size hash table of slots, each holding a hash of a
+    delivery id and when it was seen, and is mapped into memory by every
+    process using it. An id is stored in the first free or expired slot
+    within a few slots of its hash, replacing the oldest of them if they are
+    all in use. Access is serialised with a lock on the file.
+    """
+
+    SLOT = struct.Struct('=Qd')
+    PROBES = 8
+
+    def __init__(self, path, slots=DEFAULT_SIZE * 4, ttl=DEFAULT_TTL,
+                 clock=time.time):
+        self.path = path
+        self.slots = slots
+        self.ttl = ttl
+
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        with self._flock():
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, size)
+
+        self._map = mmap.mmap(self._fd, size)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def _flock(self):
+        return utils.flock(self._fd)
+
+    def _hash(self, delivery_id):
+        digest = hashlib.sha1(delivery_id.encode('utf-8')).digest()
+        # 0 marks an empty slot
+        return struct.unpack('=Q', digest[:8])[0] or 1
+
+    def _slots(self, key):
+        start = key % self.slots
+
+        for i in range(min(self.PROBES, self.slots)):
+            offset = ((start + i) % self.slots) * self.SLOT.size
+            yield offset, self.SLOT.unpack_from(self._map, offset)
+
+    def add(self, delivery_id):
+        """Record a delivery. Returns False if it has already been seen."""
+        key = self._hash(delivery_id)
+        now = self._clock()
+
+        with self._lock, self._flock():
+            target = None
+            target_seen_at = None
+
+            for offset, (slot_key, seen_at) in self._slots(key):
+                expired = now - seen_at >= self.ttl
+
+                if slot_key == key and not expired:
+                    return False
+
+                if not slot_key or expired:
+                    seen_at = 0
+
+                if target is None or seen_at < target_seen_at:
+                    target = offset
+                    target_seen_at = seen_at
+
+            self.SLOT.pack_into(self._map, target, key, now)
+            return True
+
+    def discard(self, delivery_id):
+        """Forget a delivery so that a retry of it is accepted."""
+        key = self._hash(delivery_id)
+
+        with self._lock, self._flock():
+            for offset, (slot_key, _) in self._slots(key):
+                if slot_key == key:
+                    self.SLOT.pack_into(self._map, offset, 0, 0)
+
+
+def _from_config(config):
+    ttl = config.get('delivery_ttl', DEFAULT_TTL)
+    size = config.get('delivery_cache_size', DEFAULT_SIZE)
+    path = config.get('delivery_cache_file')
+
+    if not size:
+        return None
+
+    if path:
+        return FileDeliveryCache(path, slots=size * 4, ttl=ttl)
+
+    return DeliveryCache(maxsize=size, ttl=ttl)
+
+
+def get_cache(config):
+    """Fetch the delivery cache for the application, or None if disabled."""
+    return utils.config_state(config, 'deliveries', _from_config)
+
+
+@contextlib.contextmanager
+def track(config, delivery_id):
+    """Record a delivery while it is processed.
+
+    Yields False if the delivery has already been seen and should be skipped.
+    If processing fails the delivery is forgotten again so that a retry of it
+    is accepted.
+    """
+    deliveries = get_cache(config)
+
+    if deliveries is None or not delivery_id:
+        yield True
+        return
+
+    if not deliveries.add(delivery_id):
+        yield False
+        return
+
+    try:
+        yield True
+    except Exception:
+        deliveries.discard(delivery_id)
+        raise
@@ -0,0 +1,164 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from github_webhook_handler import filters
+from github_webhook_handler import utils
+
+DEFAULT_TYPES = ['push']
+WILDCARD = '*'
+FULL_NAME_PATH = ('repository', 'full_name')
+
+
+def handler_types(handler):
+    return utils.as_list(handler.get('type', DEFAULT_TYPES))
+
+
+def handler_repos(handler):
+    return utils.as_list(handler.get('repo'))
+
+
+def key_bytes(key):
+    """Return a handler key in the form used to compute signatures."""
+    if not isinstance(key, bytes):
+        key = str(key).encode('utf-8')
+
+    return key
+
+
+def repo_matches(pattern, full_name):
+    """Check a repo from a handler, which may end in a wildcard, matches."""
+    if full_name is None:
+        return False
+
+    if pattern.endswith(WILDCARD):
+        return full_name.startswith(pattern[:-1])
+
+    return pattern == full_name
+
+
+class HandlerSet(object):
+    """A list of handlers indexed by event type and repository.
+
+    Handlers are looked up by the exact (type, repo) pair they list. A repo
+    ending in a * such as myorg/* is stored by its prefix and found by looking
+    up the leading part of the repository name for each distinct prefix
+    length. The filters of each handler are compiled once here so matching
+    an event does not need to parse them. The handlers returned for an event
+    are always in the order they appear in the handlers file.
+
+    The signing key of each handler is converted to bytes once here, so the
+    keys that could sign an event are found with its candidates.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = list(handlers)
+
+        self._keys = {}
+        self._exact = {}
+        self._prefixes = {}
+
+        for position, handler in enumerate(self.handlers):
+            entry = (handler, filters.compile_filters(handler))
+            key = handler.get('key')
+            self._keys[id(handler)] = key_bytes(key) if key else None
+
+            for event_type in handler_types(handler):
+                for repo in handler_repos(handler):
+                    if repo.endswith(WILDCARD):
+                        bucket = self._prefixes.setdefault(event_type, {})
+                        key = repo[:-1]
+                    else:
+                        bucket = self._exact
+                        key = (event_type, repo)
+
+                    entries = bucket.setdefault(key, [])
+
+                    # a handler may list the same repo twice
+                    if not entries or entries[-1][0] != position:
+                        entries.append((position, entry))
+
+        # the distinct prefix lengths for each type, longest first
+        self._prefix_lengths = dict(
+            (event_type, sorted(set(len(p) for p in prefixes), reverse=True))
+            for event_type, prefixes in self._prefixes.items())
+
+    def __iter__(self):
+        return iter(self.handlers)
+
+    def __len__(self):
+        return len(self.handlers)
+
+    def candidates(self, event_type, full_name):
+        """Return the handlers whose type and repo match the event."""
+        return [handler for handler, _ in self._entries(event_type, full_name)]
+
+    def signers(self, event_type, full_name):
+        """Return the keys of the candidates for an event, and keyless.
+
+        The keys are distinct and keyless is True if any candidate has no
+        key and so accepts unsigned requests.
+        """
+        keys = []
+        keyless = False
+
+        for handler, _ in self._entries(event_type, full_name):
+            key = self._keys[id(handler)]
+
+            if key is None:
+                keyless = True
+            elif key not in keys:
+                keys.append(key)
+
+        return keys, keyless
+
+    def match(self, event_type, event_data):
+        """Return the handlers whose type, repo and filters match the event."""
+        full_name = filters.get_path(event_data, FULL_NAME_PATH)
+
+        return [handler
+                for handler, compiled in self._entries(event_type, full_name)
+                if filters.match_all(compiled, event_data)]
+
+    def _entries(self, event_type, full_name):
+        if full_name is None:
+            return []
+
+        entries = self._exact.get((event_type, full_name))
+        prefixes = self._prefixes.get(event_type)
+
+        if prefixes:
+            matches = []
+
+            for length in self._prefix_lengths[event_type]:
+                if length <= len(full_name):
+                    matches.extend(prefixes.get(full_name[:length], ()))
+
+            if matches:
+                if entries:
+                    matches.extend(entries)
+
+                # a handler can be reached by more than one of its repos so
+                # dedupe on its position, which also restores file order
+                entries = sorted(dict(matches).items())
+
+        if not entries:
+            return []
+
+        return [entry for _, entry in entries]
+
+
+def handler_set(handlers):
+    """Return handlers as a HandlerSet, compiling them if required."""
+    if isinstance(handlers, HandlerSet):
+        return handlers
+
+    return HandlerSet(handlers or [])
@@ -0,0 +1,656 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import contextlib
+import errno
+import fcntl
+import json
+import logging
+import os
+import os.path
+import shlex
+import subprocess
+import tempfile
+import threading
+import time
+
+from github_webhook_handler import filters
+from github_webhook_handler import metrics
+from github_webhook_handler import payload as event_payload
+from github_webhook_handler import runner
+from github_webhook_handler import spool
+from github_webhook_handler import utils
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_SPOOL_RETENTION = 7 * 24 * 3600
+FULL_NAME_PATH = ('repository', 'full_name')
+DEFAULT_LIMIT_DIR = os.path.join(tempfile.gettempdir(),
+                                 'github-webhook-handler-actions')
+
+CLONE_ENV = (('depth', 'GWH_CLONE_DEPTH'),
+             ('filter', 'GWH_CLONE_FILTER'),
+             ('sparse', 'GWH_CLONE_SPARSE'),
+             ('worktree', 'GWH_CLONE_WORKTREE'))
+
+
+class QueueFull(Exception):
+    """The executor can't accept any more jobs."""
+
+
+def has_action(handler):
+    """Whether a handler has anything to run."""
+    return bool(handler.get('action') or handler.get('entry_point'))
+
+
+class Job(object):
+    """The action of a handler to be run for an event."""
+
+    def __init__(self, handler, event_type, body, full_name=None, ref=None,
+                 payload=None):
+        self.handler = handler
+        self.event_type = event_type
+        self.body = body
+        self.full_name = full_name
+        self.ref = ref
+        self.payload = payload or event_payload.Payload(body)
+
+        # the spool records this job has taken the place of
+        self.spool_ids = []
+
+    @classmethod
+    def from_request(cls, request, handler):
+        return cls(handler,
+                   request.event_type,
+                   request.body,
+                   full_name=filters.get_path(request.event_data,
+                                              FULL_NAME_PATH),
+                   ref=request.event_data.get('ref'),
+                   payload=request.payload)
+
+    @classmethod
+    def from_spool(cls, spooled):
+        try:
+            event_data = json.loads(spooled.body.decode('utf-8'))
+        except ValueError:
+            event_data = {}
+
+        job = cls(spooled.handler,
+                  spooled.event_type,
+                  spooled.body,
+                  full_name=filters.get_path(event_data, FULL_NAME_PATH),
+                  ref=filters.get_path(event_data, ('ref',)))
+        job.spool_ids.append(spooled.job_id)
+        return job
+
+    @property
+    def action(self):
+        return self.handler.get('action') or self.handler.get('entry_point')
+
+    @property
+    def entry_point(self):
+        """The entry point and its arguments if the action is Python."""
+        entry_point = self.handler.get('entry_point')
+        return shlex.split(entry_point) if entry_point else None
+
+    @property
+    def event_stdin(self):
+        return bool(self.handler.get('event_stdin'))
+
+    @property
+    def coalesce_key(self):
+        """Jobs with the same key can be collapsed into the latest one."""
+        if not self.handler.get('coalesce') or self.event_type != 'push':
+            return None
+
+        # the handler is compared by its config rather than as an object,
+        # so a job still matches after the handlers are reloaded or when it
+        # was resumed from the spool, which doesn't keep the key
+        handler = dict((name, value) for name, value in self.handler.items()
+                       if name != 'key')
+        return (json.dumps(handler, sort_keys=True), self.full_name, self.ref)
+
+    @property
+    def max_in_flight(self):
+        return self.handler.get('max_in_flight')
+
+    def replace(self, job):
+        """Take the event of a newer job for the same handler."""
+        self.event_type = job.event_type
+        self.body = job.body
+        self.payload = job.payload
+        self.full_name = job.full_name
+        self.ref = job.ref
+        self.spool_ids.extend(job.spool_ids)
+
+
+def action_env(config, job):
+    """Build the environment an action is run with, apart from the event."""
+    env = os.environ.copy()
+    env['GWH_EVENT_TYPE'] = job.event_type
+
+    cache_dir = config.get('cache_dir')
+    if cache_dir:
+        env['GWH_CACHE_DIR'] = cache_dir
+
+    # how the cloner should check out the repository for this handler
+    clone = job.handler.get('clone') or {}
+
+    for key, name in CLONE_ENV:
+        value = clone.get(key)
+
+        if isinstance(value, list):
+            value = os.pathsep.join(value)
+
+        if value:
+            env[name] = str(value)
+
+    return env
+
+
+class NodeLimit(object):
+    """Limit how many actions run at once across every process on a node.
+
+    A running action holds an exclusive lock on one of limit slot files in
+    directory. Every process using the same directory shares the limit, so
+    it holds whichever worker of a server accepted the delivery.
+    """
+
+    def __init__(self, directory, limit, poll=0.05):
+        self.directory = directory
+        self.limit = limit
+        self.poll = poll
+
+    @classmethod
+    def from_config(cls, config):
+        limit = config.get('action_limit')
+
+        if not limit:
+            return None
+
+        return cls(config.get('action_limit_dir', DEFAULT_LIMIT_DIR), limit)
+
+    def _try(self, slot):
+        path = os.path.join(self.directory, 'slot-%d' % slot)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError) as e:
+            os.close(fd)
+
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+            return None
+
+        return fd
+
+    def try_acquire(self):
+        """Take a free slot and return the descriptor holding it, or None.
+
+        This never blocks, so it can be called from an event loop.
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # created by another process at the same time
+                if not os.path.isdir(self.directory):
+                    raise
+
+        # start at a different slot in each process to spread them out
+        first = os.getpid() % self.limit
+
+        for i in range(self.limit):
+            fd = self._try((first + i) % self.limit)
+
+            if fd is not None:
+                return fd
+
+        return None
+
+    def acquire(self):
+        """Wait for a free slot and return the descriptor holding it."""
+        while True:
+            fd = self.try_acquire()
+
+            if fd is not None:
+                return fd
+
+            time.sleep(self.poll)
+
+    def release(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    @contextlib.contextmanager
+    def held(self):
+        fd = self.acquire()
+
+        try:
+            yield
+        finally:
+            self.release(fd)
+
+
+def get_node_limit(config):
+    """Fetch the node wide action limit, or None if there isn't one."""
+    return utils.config_state(config, 'node_limit', NodeLimit.from_config)
+
+
+def execute(config, job):
+    """Run the action of a job and return its exit code."""
+    if not job.action:
+        return
+
+    limit = get_node_limit(config)
+
+    if limit is None:
+        return _measured(config, job)
+
+    with limit.held():
+        return _measured(config, job)
+
+
+def _measured(config, job):
+    stats = metrics.get_metrics(config)
+    start = time.time()
+    returncode = None
+
+    try:
+        returncode = _execute(config, job, stats)
+    finally:
+        # an action that couldn't be run is recorded as an error
+        stats.record_action(job.handler, returncode, time.time() - start)
+
+    return returncode
+
+
+def _execute(config, job, stats):
+    env = action_env(config, job)
+
+    # working dir is a temporary directory the scripts are executed from, the
+    # event file is shared by every action for the event
+    with job.payload.held() as event_file, utils.mkdtemp() as working_dir:
+        env['GWH_EVENT_FILE'] = event_file
+
+        if job.entry_point:
+            return run_entry_point(config, job, env, working_dir)
+
+        stdin = open(event_file, 'rb') if job.event_stdin else None
+
+        try:
+            with stats.stage('spawn'):
+                p = subprocess.Popen(shlex.split(job.action),
+                                     cwd=working_dir,
+                                     env=env,
+                                     stdin=stdin)
+            p.communicate()
+        finally:
+            if stdin:
+                stdin.close()
+
+        return p.returncode
+
+
+def run_entry_point(config, job, env, working_dir):
+    """Run a Python entry point action in a warm forked process."""
+    entry_point = job.entry_point
+    stdin = env['GWH_EVENT_FILE'] if job.event_stdin else None
+
+    return runner.get_runner(config).run(entry_point[0],
+                                         entry_point[1:],
+                                         env,
+                                         working_dir,
+                                         stdin=stdin)
+
+
+class JobQueue(object):
+    """The jobs waiting to be run and the bookkeeping of those running.
+
+    This holds the queueing rules shared by the executors, see Executor. It
+    does no locking of its own, the executor using it must serialise access.
+    Nor does it write to the spool, so that the executor can do that without
+    holding its lock, see record_jobs and complete_jobs.
+
+    A queued job holds a reference to its payload so that the event file is
+    written once for all of the jobs of an event, rather than by each job
+    as it runs.
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+
+        self.running = 0
+        self.coalesced = 0
+
+        self._pending = collections.deque()
+        self._queued = {}
+        self._in_flight = collections.Counter()
+
+    @property
+    def idle(self):
+        return not self._pending and not self.running
+
+    def check(self, jobs):
+        """Raise QueueFull if there isn't space to queue jobs.
+
+        Returns the queued jobs they would be coalesced into, or None.
+        """
+        queued = [self._queued.get(job.coalesce_key) for job in jobs]
+
+        # coalesced jobs don't take up any more space in the queue
+        if len(self._pending) + queued.count(None) > self.queue_size:
+            raise QueueFull()
+
+        return queued
+
+    def add(self, jobs):
+        """Queue jobs to be run. Either all of the jobs are queued or none."""
+        queued = self.check(jobs)
+        held = []
+
+        try:
+            for job in jobs:
+                job.payload.acquire()
+                held.append(job)
+        except Exception:
+            for job in held:
+                job.payload.release()
+
+            raise
+
+        for job, existing in zip(jobs, queued):
+            if existing:
+                LOG.info('Coalescing push to %s %s into a queued job',
+                         job.full_name, job.ref)
+                existing.payload.release()
+                existing.replace(job)
+                self.coalesced += 1
+            else:
+                self._pending.append(job)
+
+                if job.coalesce_key:
+                    self._queued[job.coalesce_key] = job
+
+    def extend(self, jobs):
+        """Queue jobs that were accepted before, regardless of the limit."""
+        for job in jobs:
+            job.payload.acquire()
+            self._pending.append(job)
+
+    def take(self):
+        """Return the next job that can run now and mark it running.
+
+        Returns None if every waiting job is held back by max_in_flight.
+        """
+        for i, job in enumerate(self._pending):
+            limit = job.max_in_flight
+
+            if not limit or self._in_flight[job.full_name] < limit:
+                del self._pending[i]
+                break
+        else:
+            return None
+
+        if job.coalesce_key:
+            del self._queued[job.coalesce_key]
+
+        self._in_flight[job.full_name] += 1
+        self.running += 1
+        return job
+
+    def done(self, job):
+        """Mark a job taken from the queue as finished."""
+        job.payload.release()
+        self._in_flight[job.full_name] -= 1
+
+        if not self._in_flight[job.full_name]:
+            del self._in_flight[job.full_name]
+
+        self.running -= 1
+
+    def clear(self):
+        for job in self._pending:
+            job.payload.release()
+
+        self._pending.clear()
+        self._queued.clear()
+
+    def stats(self):
+        return {'pending': len(self._pending),
+                'running': self.running,
+                'coalesced': self.coalesced}
+
+
+class Executor(object):
+    """Run jobs in the background on a bounded pool of threads.
+
+    At most queue_size jobs can be waiting to run, after which submit raises
+    QueueFull. The threads only wait on the action subprocesses so threads
+    rather than processes are enough to run them concurrently.
+
+    A push job for a handler with coalesce set replaces the event of a job
+    for the same handler, repository and ref that is still waiting, so only
+    the newest push is run. A handler with max_in_flight set will only have
+    that many jobs running at once for a repository, further jobs wait in
+    the queue while jobs for other repositories run.
+
+    If a spool is given every job is recorded in it before submit returns and
+    marked complete once it has run. Jobs that were recorded but never
+    completed, because the process stopped, are queued again by resume. The
+    spool is written to without holding the lock on the queue, so the other
+    threads aren't held up by its commits.
+    """
+
+    def __init__(self, config, workers=DEFAULT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, spool=None):
+        self.config = config
+        self.workers = workers
+
+        self.spool = spool
+
+        self._cond = threading.Condition()
+        self._queue = JobQueue(queue_size=queue_size)
+        self._threads = []
+        self._stopped = False
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config,
+                   workers=config.get('action_workers', DEFAULT_WORKERS),
+                   queue_size=config.get('action_queue_size',
+                                         DEFAULT_QUEUE_SIZE),
+                   spool=(spool.Spool.from_config(config)
+                          if config.get('spool') else None))
+
+    def submit(self, jobs):
+        """Queue jobs to be run. Either all of the jobs are queued or none."""
+        with self._cond:
+            if self._stopped:
+                raise QueueFull()
+
+            # fail early rather than recording jobs that can't be queued
+            self._queue.check(jobs)
+
+        spool_ids = record_jobs(self.spool, jobs)
+
+        try:
+            with self._cond:
+                # the queue may have filled or stopped while recording
+                if self._stopped:
+                    raise QueueFull()
+
+                self._queue.add(jobs)
+                self._start()
+                self._cond.notify_all()
+        except Exception:
+            discard_jobs(self.spool, spool_ids)
+            raise
+
+    def resume(self, retention=DEFAULT_SPOOL_RETENTION):
+        """Queue the jobs in the spool that have not been completed.
+
+        Completed jobs older than retention seconds are removed from the
+        spool. Returns the number of jobs resumed.
+        """
+        jobs = pending_jobs(self.spool, retention)
+        self.requeue(jobs)
+        return len(jobs)
+
+    def requeue(self, jobs):
+        """Queue jobs that were accepted before, such as from the spool."""
+        with self._cond:
+            # these were accepted before so they aren't subject to the limit
+            self._queue.extend(jobs)
+            self._start()
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait for every queued job to finish. Returns True if they did."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._queue.idle, timeout)
+
+    def stop(self, timeout=None):
+        """Drop any queued jobs and wait for the running ones to finish."""
+        with self._cond:
+            self._stopped = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return self._queue.stats()
+
+    def _start(self):
+        # threads are started when first needed so that an application that
+        # never uses the executor doesn't leave them running
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run,
+                                      name='action-%d' % len(self._threads))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+
+                job = self._queue.take()
+
+                if job:
+                    return job
+
+                self._cond.wait()
+
+    def _done(self, job):
+        # before the job is done so that join waits for the spool
+        complete_jobs(self.spool, job)
+
+        with self._cond:
+            self._queue.done(job)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            job = self._next()
+
+            if job is None:
+                return
+
+            try:
+                returncode = execute(self.config, job)
+            except Exception:
+                LOG.exception('Failed to run action %s', job.action)
+            else:
+                if returncode:
+                    LOG.warning('Action %s exited with %d',
+                                job.action, returncode)
+            finally:
+                self._done(job)
+
+
+def record_jobs(events, jobs):
+    """Record the jobs of an event in a spool, returning the new job ids.
+
+    Jobs that are already in the spool, because they are being replayed,
+    aren't recorded again.
+    """
+    # the jobs of a request share an event
+    unrecorded = [job for job in jobs if not job.spool_ids]
+
+    if not events or not unrecorded:
+        return []
+
+    spool_ids = events.record(unrecorded[0].event_type,
+                              unrecorded[0].body,
+                              [job.handler for job in unrecorded])
+
+    for job, spool_id in zip(unrecorded, spool_ids):
+        job.spool_ids.append(spool_id)
+
+    return spool_ids
+
+
+def discard_jobs(events, spool_ids):
+    """Remove jobs recorded by record_jobs that were then not queued."""
+    if not events or not spool_ids:
+        return
+
+    try:
+        events.discard(spool_ids)
+    except Exception:
+        LOG.exception('Failed to remove jobs %s from the spool', spool_ids)
+
+
+def complete_jobs(events, job):
+    """Mark the spool records of a job that has run as complete."""
+    if not events or not job.spool_ids:
+        return
+
+    try:
+        events.complete(job.spool_ids)
+    except Exception:
+        LOG.exception('Failed to mark job %s as complete in the spool',
+                      job.spool_ids)
+
+
+def pending_jobs(events, retention=DEFAULT_SPOOL_RETENTION):
+    """Load the jobs that were never completed from a spool.
+
+    Completed jobs older than retention seconds are removed from the spool
+    first.
+    """
+    if not events:
+        return []
+
+    events.purge(time.time() - retention)
+    jobs = [Job.from_spool(spooled) for spooled in events.pending()]
+
+    if jobs:
+        LOG.info('Resumed %d jobs from the spool', len(jobs))
+
+    return jobs
+
+
+def get_executor(config):
+    """Fetch the executor for the application with this config."""
+    return utils.config_state(config, 'executor', Executor.from_config)
@@ -0,0 +1,152 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fnmatch
+import re
+
+from github_webhook_handler import utils
+
+
+def get_path(data, path, default=None):
+    """Fetch a value from a nested dictionary with a pre-split key path."""
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+
+    return data
+
+
+class ExactMatcher(object):
+    """Match any of a set of values."""
+
+    def __init__(self, values):
+        self.values = frozenset(values)
+
+    def __call__(self, value):
+        try:
+            return value in self.values
+        except TypeError:
+            # an unhashable value like a dict can't be one of ours
+            return False
+
+
+class PatternMatcher(object):
+    """Match string values against a compiled regular expression."""
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    @classmethod
+    def from_glob(cls, glob):
+        return cls(re.compile(fnmatch.translate(glob)))
+
+    @classmethod
+    def from_regex(cls, regex):
+        try:
+            return cls(re.compile(regex))
+        except re.error as e:
+            raise ValueError('Invalid filter regex %r: %s' % (regex, e))
+
+    def __call__(self, value):
+        try:
+            return self.pattern.match(value) is not None
+        except TypeError:
+            return False
+
+
+class AnyMatcher(object):
+    """Match if any of a list of matchers does."""
+
+    def __init__(self, matchers):
+        self.matchers = tuple(matchers)
+
+    def __call__(self, value):
+        for matcher in self.matchers:
+            if matcher(value):
+                return True
+
+        return False
+
+
+def compile_matcher(value):
+    """Compile the value of a filter entry into a matcher.
+
+    A plain value or list of values matches exactly, even if it contains
+    * ? or [, as a value could always contain them. {'glob': ...} is a glob
+    pattern and {'regex': ...} a regular expression.
+    """
+    exact = []
+    patterns = []
+
+    for entry in utils.as_list(value):
+        if isinstance(entry, dict):
+            if len(entry) != 1:
+                raise ValueError('Filter patterns take a single glob or '
+                                 'regex key: %r' % entry)
+
+            kind, pattern = list(entry.items())[0]
+
+            if kind == 'glob':
+                patterns.append(PatternMatcher.from_glob(pattern))
+            elif kind == 'regex':
+                patterns.append(PatternMatcher.from_regex(pattern))
+            else:
+                raise ValueError('Unknown filter pattern type %r' % kind)
+
+        else:
+            exact.append(entry)
+
+    if exact:
+        patterns.insert(0, ExactMatcher(exact))
+
+    if len(patterns) == 1:
+        return patterns[0]
+
+    return AnyMatcher(patterns)
+
+
+class Filter(object):
+    """A compiled filter entry of a handler."""
+
+    def __init__(self, name, value):
+        self.name = name
+        self.path = tuple(name.split('.'))
+        self.matcher = compile_matcher(value)
+
+    def __call__(self, event_data):
+        value = get_path(event_data, self.path)
+
+        if isinstance(value, list):
+            for entry in value:
+                if self.matcher(entry):
+                    return True
+
+            return False
+
+        # empty values never match, just as with utils.as_list
+        return bool(value) and self.matcher(value)
+
+
+def compile_filters(handler):
+    """Compile the filter section of a handler into a tuple of Filters."""
+    return tuple(Filter(name, value)
+                 for name, value in (handler.get('filter') or {}).items())
+
+
+def match_all(filters, event_data):
+    for f in filters:
+        if not f(event_data):
+            return False
+
+    return True
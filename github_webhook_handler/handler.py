@@ -12,27 +12,100 @@
 
 import hashlib
 import hmac
-import os
-import os.path
-import shlex
-import subprocess
 
 import webob
 import webob.exc
-import yaml
 
+from github_webhook_handler import dedup
+from github_webhook_handler import dispatch
+from github_webhook_handler import executor
+from github_webhook_handler import filters
+from github_webhook_handler import loader
+from github_webhook_handler import metrics
 from github_webhook_handler import utils
 
 
+SIGNATURE_HEADERS = ('X-Hub-Signature-256', 'X-Hub-Signature')
+DIGESTS = {'sha1': hashlib.sha1, 'sha256': hashlib.sha256}
+
+
 def handle(config, request):
-    for handler in _handlers_from_file(config):
-        if filter_handler(config, request, handler):
+    handlers = dispatch.handler_set(_handlers_from_file(config))
+
+    # check the request can be accepted by one of the handlers for its
+    # repository before paying to parse the rest of the body
+    with metrics.get_metrics(config).stage('hmac'):
+        verify_request(config, request, handlers)
+
+    with dedup.track(config, request.delivery) as new:
+        if not new:
+            return webob.Response(status=200,
+                                  content_type='application/json',
+                                  json={'duplicate': True})
+
+        matched = match_handlers(config, request, handlers)
+
+        if config.get('execution') == 'async':
+            return _enqueue(config, request, matched)
+
+        actions = [handler for handler in matched
+                   if executor.has_action(handler)]
+
+        if actions:
+            # hold the event file so every action reads the same copy
+            with request.payload.held():
+                for handler in actions:
+                    run_action(config, request, handler)
+
+        return webob.Response(status=200,
+                              content_type='application/json',
+                              json={})
+
+
+def match_handlers(config, request, handlers):
+    """Return the handlers to run for a verified request.
+
+    Raises HTTPForbidden if any of them rejects the signature.
+    """
+    stats = metrics.get_metrics(config)
+
+    with stats.stage('parse'):
+        event_data = request.event_data
+
+    with stats.stage('filter'):
+        matched = handlers.match(request.event_type, event_data)
+
+    with stats.stage('hmac'):
+        for handler in matched:
             validate_signature(config, request, handler)
-            run_action(config, request, handler)
 
-    return webob.Response(status=200,
+    stats.record_delivery(request.event_type,
+                          filters.get_path(event_data,
+                                           dispatch.FULL_NAME_PATH),
+                          matched)
+
+    return matched
+
+
+def _enqueue(config, request, handlers):
+    jobs = [executor.Job.from_request(request, handler)
+            for handler in handlers
+            if executor.has_action(handler)]
+
+    if not jobs:
+        return webob.Response(status=200,
+                              content_type='application/json',
+                              json={})
+
+    try:
+        executor.get_executor(config).submit(jobs)
+    except executor.QueueFull:
+        raise webob.exc.HTTPServiceUnavailable(
+            comment='Action queue is full.')
+
+    return webob.Response(status=202,
                           content_type='application/json',
-                          json={})
+                          json={'queued': len(jobs)})
 
 
 def _handlers_from_file(config):
@@ -42,26 +115,69 @@ def _handlers_from_file(config):
     if not handlers_file:
         raise webob.exc.HTTPOk(comment='No handlers file available. Exiting.')
 
-    with open(handlers_file, 'r') as f:
-        return yaml.safe_load(f)
+    return utils.config_state(config,
+                              'handlers',
+                              loader.HandlersFile.from_config).get()
 
 
 def filter_handler(config, request, handler):
     full_name = request.event_data.get('repository', {}).get('full_name')
 
-    if request.event_type not in utils.as_list(handler.get('type', ['push'])):
+    if request.event_type not in dispatch.handler_types(handler):
         return False
 
-    if full_name not in utils.as_list(handler.get('repo')):
+    for repo in dispatch.handler_repos(handler):
+        if dispatch.repo_matches(repo, full_name):
+            break
+    else:
         return False
 
-    for name, matcher in handler.get('filter', {}).items():
-        filter_val = utils.get_dotted_key(request.event_data, name)
+    return filters.match_all(filters.compile_filters(handler),
+                             request.event_data)
+
+
+def verify_request(config, request, handlers):
+    """Reject a request that the handlers for its repository would reject.
+
+    Every handler with a key requires a valid signature and every handler
+    without a key rejects a signed request. Only the repository is looked up
+    in the body, to find the handlers for the event type and repository,
+    and the signature is only checked against their keys. A request signed
+    with one of them, or unsigned when one of them has no key, is left for
+    the handlers it matches to check. Any other request would be rejected by
+    all of them, so it is rejected without running their filters. Where
+    there are none it is accepted, as nothing would run.
+    """
+    try:
+        full_name = filters.get_path(request.event_data,
+                                     dispatch.FULL_NAME_PATH)
+    except ValueError:
+        # no handler can be found to verify a body that can't be parsed
+        raise webob.exc.HTTPForbidden()
+
+    keys, keyless = handlers.signers(request.event_type, full_name)
+
+    if not keys and not keyless:
+        return
+
+    if not _signature_acceptable(request, keys, keyless):
+        raise webob.exc.HTTPForbidden()
+
+
+def _signature_acceptable(request, keys, keyless):
+    if not request.signature:
+        return keyless
+
+    try:
+        algorithm, value = _split_signature(request.signature)
+    except webob.exc.HTTPForbidden:
+        return False
 
-        if matcher not in utils.as_list(filter_val):
-            return False
+    for key in keys:
+        if hmac.compare_digest(request.hexdigest(key, algorithm), value):
+            return True
 
-    return True
+    return False
 
 
 def validate_signature(config, request, handler):
@@ -74,37 +190,25 @@ def validate_signature(config, request, handler):
         raise webob.exc.HTTPForbidden()
 
     elif key:
-        digest, value = request.signature.split('=')
+        algorithm, value = _split_signature(request.signature)
+        digest = request.hexdigest(dispatch.key_bytes(key), algorithm)
 
-        if digest != 'sha1':
+        if not hmac.compare_digest(digest, value):
             raise webob.exc.HTTPForbidden()
 
-        mac = hmac.new(key, msg=request.body, digestmod=hashlib.sha1)
 
-        if not hmac.compare_digest(mac.hexdigest(), value):
-            raise webob.exc.HTTPForbidden()
-
-
-def run_action(config, request, handler):
-    action = handler.get('action')
-
-    if not action:
-        return
-
-    env = os.environ.copy()
-    env['GWH_EVENT_TYPE'] = request.event_type
+def _split_signature(signature):
+    try:
+        algorithm, value = signature.split('=', 1)
+    except ValueError:
+        raise webob.exc.HTTPForbidden()
 
-    cache_dir = config.get('cache_dir')
-    if cache_dir:
-        env['GWH_CACHE_DIR'] = cache_dir
+    if algorithm not in DIGESTS:
+        raise webob.exc.HTTPForbidden()
 
-    # working dir is a temporary directory the scripts are executed from
-    with utils.mkdtemp() as working_dir:
-        event_file = os.path.join(working_dir, 'event.json')
-        env['GWH_EVENT_FILE'] = event_file
+    return algorithm, value
 
-        with open(event_file, 'w') as f:
-            f.write(request.text)
 
-        p = subprocess.Popen(shlex.split(action), cwd=working_dir, env=env)
-        p.communicate()
+def run_action(config, request, handler):
+    return executor.execute(config, executor.Job.from_request(request,
+                                                              handler))
@@ -0,0 +1,195 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Parse only the parts of a JSON document that are looked at.
+
+Most handlers only look at a few keys of an event, such as ref and
+repository.full_name, but a push event can carry thousands of commits. An
+object is parsed by finding where each of its members starts and ends, and a
+value is only kept once it is looked up. Objects within it are parsed the
+same way, other values are decoded with the json module.
+
+The end of a value that is skipped is found by jumping between the brackets
+in it with a regular expression that steps over strings, without building
+anything from it, so a large commits list costs a scan rather than thousands
+of objects. Only the brackets are balanced, what is between them is checked
+when the value is looked up. The scan is slower than the json module's C
+decoder, so documents smaller than LAZY_MIN_SIZE are decoded in full.
+"""
+
+import json
+import re
+
+try:
+    from collections import abc
+except ImportError:  # python 2
+    import collections as abc
+
+_decoder = json.JSONDecoder()
+
+# bytes of text, below which decoding everything is quicker and holds little
+LAZY_MIN_SIZE = 256 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# everything up to the next bracket that isn't in a string
+_FLAT = re.compile(r'(?:[^"{}\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+_SCALAR = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+                     r'|true|false|null')
+
+
+def loads(text, min_size=LAZY_MIN_SIZE):
+    """Parse a JSON document, lazily if it is a large enough object."""
+    if len(text) < min_size:
+        return json.loads(text)
+
+    pos = _WHITESPACE.match(text).end()
+
+    if text[pos:pos + 1] != '{':
+        return json.loads(text)
+
+    return LazyObject(text, pos)
+
+
+def _skip_string(text, pos):
+    match = _STRING.match(text, pos)
+
+    if match is None:
+        raise ValueError('Unterminated string starting at %d' % pos)
+
+    return match.end()
+
+
+def _skip(text, pos):
+    """Return the end of the value starting at pos without decoding it."""
+    char = text[pos:pos + 1]
+
+    if char == '"':
+        return _skip_string(text, pos)
+
+    if char not in ('{', '['):
+        match = _SCALAR.match(text, pos)
+
+        if match is None:
+            raise ValueError('Expecting value at %d' % pos)
+
+        return match.end()
+
+    flat = _FLAT.match
+    start = pos
+    depth = 0
+
+    while True:
+        found = text[pos:pos + 1]
+
+        if found in ('{', '['):
+            depth += 1
+        elif found in ('}', ']'):
+            depth -= 1
+
+            if not depth:
+                return pos + 1
+        elif found == '"':
+            raise ValueError('Unterminated string starting at %d' % pos)
+        else:
+            raise ValueError('Unterminated %s starting at %d' % (char, start))
+
+        pos = flat(text, pos + 1).end()
+
+
+def _expect(text, pos, char):
+    pos = _WHITESPACE.match(text, pos).end()
+
+    if text[pos:pos + 1] != char:
+        raise ValueError('Expecting %r at %d' % (char, pos))
+
+    return _WHITESPACE.match(text, pos + 1).end()
+
+
+class LazyObject(abc.Mapping):
+    """A read only mapping over a JSON object in a larger document.
+
+    Members are indexed as far as needed to find a key. Iterating or taking
+    the length indexes them all, which is the only time the whole object is
+    scanned.
+    """
+
+    def __init__(self, text, pos):
+        self._text = text
+        self._spans = {}
+        self._values = {}
+
+        # the position of the next member to index, or None when done
+        self._pos = _expect(text, pos, '{')
+
+        if text[self._pos:self._pos + 1] == '}':
+            self._pos = None
+
+    def _index_next(self):
+        text = self._text
+        pos = self._pos
+
+        if text[pos:pos + 1] != '"':
+            raise ValueError('Expecting property name at %d' % pos)
+
+        key, pos = json.decoder.scanstring(text, pos + 1)
+        start = _expect(text, pos, ':')
+        end = _skip(text, start)
+
+        self._spans[key] = (start, end)
+        self._values.pop(key, None)
+
+        pos = _WHITESPACE.match(text, end).end()
+        char = text[pos:pos + 1]
+
+        if char == ',':
+            self._pos = _WHITESPACE.match(text, pos + 1).end()
+        elif char == '}':
+            self._pos = None
+        else:
+            raise ValueError('Expecting , or } at %d' % pos)
+
+        return key
+
+    def _index_all(self):
+        while self._pos is not None:
+            self._index_next()
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        while key not in self._spans and self._pos is not None:
+            self._index_next()
+
+        start, end = self._spans[key]
+
+        if self._text[start] == '{':
+            value = LazyObject(self._text, start)
+        else:
+            value = _decoder.raw_decode(self._text, start)[0]
+
+        self._values[key] = value
+        return value
+
+    def __iter__(self):
+        self._index_all()
+        return iter(self._spans)
+
+    def __len__(self):
+        self._index_all()
+        return len(self._spans)
+
+    def __repr__(self):
+        return 'LazyObject(%r)' % dict(self)
@@ -0,0 +1,126 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+from github_webhook_handler import dispatch
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CHECK_INTERVAL = 1.0
+
+
+def load_handlers(path):
+    """Read and validate a handlers file."""
+    with open(path, 'r') as f:
+        handlers = yaml.safe_load(f)
+
+    if handlers is None:
+        return []
+
+    if not isinstance(handlers, list):
+        raise ValueError('Handlers file must contain a list of handlers')
+
+    for handler in handlers:
+        if not isinstance(handler, dict):
+            raise ValueError('Each handler must be a mapping')
+
+    return handlers
+
+
+class HandlersFile(object):
+    """Keep the parsed contents of a handlers file in memory.
+
+    The file is stat'd at most once every check interval and is only parsed
+    again when its inode, size or modification time changes. The parsed
+    handlers are compiled into a dispatch.HandlerSet and replaced as a whole
+    so a caller always works with a single consistent version. If a changed
+    file fails to load the previously loaded handlers are kept and an error
+    is logged.
+    """
+
+    def __init__(self, path, check_interval=DEFAULT_CHECK_INTERVAL,
+                 clock=time.time):
+        self.path = path
+        self.check_interval = check_interval
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._stat = None
+        self._handlers = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['handlers'],
+                   check_interval=config.get('handlers_check_interval',
+                                             DEFAULT_CHECK_INTERVAL))
+
+    def load(self, path):
+        return dispatch.HandlerSet(load_handlers(path))
+
+    def get(self):
+        """Return the current handlers, reloading them if they changed."""
+        if self._handlers is None:
+            with self._lock:
+                if self._handlers is None:
+                    self._check(initial=True)
+
+        elif self._clock() - self._checked_at >= self.check_interval:
+            # if another request is already checking the file then use the
+            # handlers we have rather than waiting on it
+            if self._lock.acquire(False):
+                try:
+                    self._check()
+                finally:
+                    self._lock.release()
+
+        return self._handlers
+
+    def _check(self, initial=False):
+        self._checked_at = self._clock()
+
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            if initial:
+                raise
+
+            LOG.exception('Unable to stat handlers file %s, keeping the '
+                          'current handlers', self.path)
+            return
+
+        stat = (st.st_ino, st.st_size, st.st_mtime)
+
+        if stat == self._stat:
+            return
+
+        try:
+            handlers = self.load(self.path)
+        except (IOError, OSError, ValueError, yaml.YAMLError):
+            if initial:
+                raise
+
+            LOG.exception('Failed to reload handlers file %s, keeping the '
+                          'current handlers', self.path)
+        else:
+            self._handlers = handlers
+            LOG.info('Loaded %d handlers from %s', len(handlers), self.path)
+
+        # remember a broken file as well so it is not parsed again until it
+        # is changed
+        self._stat = stat
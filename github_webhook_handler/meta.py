@@ -0,0 +1,235 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from github_webhook_handler import cidr
+from github_webhook_handler import utils
+
+LOG = logging.getLogger(__name__)
+
+GITHUB_META_URL = 'https://api.github.com/meta'
+DEFAULT_TTL = 3600
+DEFAULT_TIMEOUT = 10
+
+
+class MetaCache(object):
+    """Cache the hook address blocks published by the GitHub meta API.
+
+    Blocks are served from memory. Once they are older than the TTL a refresh
+    is started in the background and the stale blocks continue to be served
+    until it completes. A failed refresh keeps the previous blocks. If a
+    snapshot file is configured every successful fetch is written to it and
+    it is used to populate the cache at startup. A refresh reads the snapshot
+    first, holding a lock on it, and only fetches if no other process sharing
+    the file has fetched within the TTL.
+
+    The blocks, along with any extra networks, are compiled into a
+    NetworkIndex when they are loaded so that checking an address does not
+    need to parse them again.
+    """
+
+    def __init__(self, url=GITHUB_META_URL, ttl=DEFAULT_TTL, snapshot=None,
+                 timeout=DEFAULT_TIMEOUT, extra_networks=None,
+                 clock=time.time):
+        self.url = url
+        self.ttl = ttl
+        self.snapshot = snapshot
+        self.timeout = timeout
+        self.extra_networks = list(extra_networks or [])
+
+        # fail on a bad config value now rather than on first fetch
+        cidr.NetworkIndex(self.extra_networks)
+
+        self._clock = clock
+        self._fetch_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+        self._hooks = None
+        self._index = None
+        self._fetched_at = None
+
+        if snapshot:
+            self._load_snapshot()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(url=config.get('meta_url', GITHUB_META_URL),
+                   ttl=config.get('meta_ttl', DEFAULT_TTL),
+                   snapshot=config.get('meta_snapshot'),
+                   timeout=config.get('meta_timeout', DEFAULT_TIMEOUT),
+                   extra_networks=config.get('allowed_networks'))
+
+    @property
+    def expired(self):
+        if self._fetched_at is None:
+            return True
+
+        return self._clock() - self._fetched_at >= self.ttl
+
+    @property
+    def loaded(self):
+        """Whether hooks() can return without waiting on a fetch."""
+        return self._hooks is not None
+
+    def hooks(self):
+        """Return the hook blocks, or None if they are not yet known.
+
+        This only blocks if there has never been a successful fetch and there
+        is no snapshot to start from, otherwise expired data is returned and a
+        refresh is started in the background.
+        """
+        hooks = self._hooks
+
+        if hooks is None:
+            with self._fetch_lock:
+                # another request may have completed the fetch while we
+                # were waiting on the lock
+                if self._hooks is None:
+                    self._fetch()
+
+            hooks = self._hooks
+
+        elif self.expired:
+            self.refresh_async()
+
+        return hooks
+
+    def networks(self):
+        """Return a NetworkIndex of the allowed source networks.
+
+        This follows the same rules as hooks() and returns None if the hook
+        blocks are not yet known.
+        """
+        index = self._index
+
+        if self.hooks() is None:
+            return None
+
+        return self._index if index is None else index
+
+    def refresh(self):
+        """Fetch the meta data now. Returns True if the fetch succeeded."""
+        with self._fetch_lock:
+            return self._fetch()
+
+    def refresh_async(self):
+        """Start a background refresh if one is not already running."""
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return self._thread
+
+            self._thread = threading.Thread(target=self.refresh,
+                                            name='github-meta-refresh')
+            self._thread.daemon = True
+            self._thread.start()
+
+            return self._thread
+
+    def join(self, timeout=None):
+        """Wait for any running background refresh to complete."""
+        thread = self._thread
+
+        if thread:
+            thread.join(timeout)
+
+    def _fetch(self):
+        if not self.snapshot:
+            return self._fetch_url()
+
+        try:
+            lock_file = open(self.snapshot + '.lock', 'a')
+        except (IOError, OSError):
+            LOG.exception('Failed to lock GitHub meta snapshot %s',
+                          self.snapshot)
+            return self._fetch_url()
+
+        with lock_file, utils.flock(lock_file.fileno()):
+            # another process may have fetched since the snapshot was read
+            if self._load_snapshot() and not self.expired:
+                return True
+
+            return self._fetch_url()
+
+    def _fetch_url(self):
+        try:
+            resp = requests.get(self.url, timeout=self.timeout)
+            resp.raise_for_status()
+            hooks = resp.json()['hooks']
+            index = self._compile(hooks)
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            LOG.exception('Failed to fetch GitHub meta data from %s',
+                          self.url)
+            return False
+
+        self._set(hooks, index, self._clock())
+
+        if self.snapshot:
+            self._save_snapshot()
+
+        return True
+
+    def _compile(self, hooks):
+        return cidr.NetworkIndex(list(hooks) + self.extra_networks)
+
+    def _set(self, hooks, index, fetched_at):
+        # assign the hooks last so a reader never sees new hooks with an old
+        # fetch time or index and skips a refresh
+        self._fetched_at = fetched_at
+        self._index = index
+        self._hooks = hooks
+
+    def _load_snapshot(self):
+        """Use the snapshot if it is newer. Returns True if it was used."""
+        try:
+            with open(self.snapshot, 'r') as f:
+                data = json.load(f)
+
+            fetched_at = data['fetched_at']
+
+            if self._fetched_at is not None and fetched_at <= self._fetched_at:
+                return False
+
+            self._set(data['hooks'], self._compile(data['hooks']), fetched_at)
+            return True
+        except (IOError, OSError):
+            LOG.info('No GitHub meta snapshot available at %s', self.snapshot)
+        except (ValueError, KeyError, TypeError):
+            LOG.exception('Ignoring invalid GitHub meta snapshot %s',
+                          self.snapshot)
+
+        return False
+
+    def _save_snapshot(self):
+        data = {'hooks': self._hooks, 'fetched_at': self._fetched_at}
+        tmp_file = '%s.%d.tmp' % (self.snapshot, os.getpid())
+
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(data, f)
+
+            os.rename(tmp_file, self.snapshot)
+        except (IOError, OSError):
+            LOG.exception('Failed to write GitHub meta snapshot %s',
+                          self.snapshot)
+
+
+def get_cache(config):
+    """Fetch the meta cache for the application with this config."""
+    return utils.config_state(config, 'meta', MetaCache.from_config)
@@ -0,0 +1,306 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Counters and histograms of deliveries, served in the Prometheus format.
+
+Recording a value takes a lock and a dictionary update, so the handler
+records every delivery. The metrics are only served if metrics_path is set
+in the config.
+"""
+
+import bisect
+import threading
+import time
+
+from github_webhook_handler import dispatch
+from github_webhook_handler import profiling
+from github_webhook_handler import utils
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from a dictionary lookup to a long running build
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+STAGES = ('meta', 'hmac', 'parse', 'filter', 'spawn')
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\')
+                      .replace('\n', '\\n')
+                      .replace('"', '\\"'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+
+    if not pairs:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in pairs)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """A count for each combination of label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), value=1):
+        labels = tuple(labels)
+
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, labels=()):
+        return self._values.get(tuple(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for labels, value in values:
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram(object):
+    """The distribution of observations for each combination of labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+
+        self._lock = threading.Lock()
+        # label values: [count in each bucket..., count above, sum]
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        labels = tuple(labels)
+        i = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            counts = self._values.get(labels)
+
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+            counts[i] += 1
+            counts[-1] += value
+
+    def time(self, labels=()):
+        """Observe how long the body of a with statement takes."""
+        return _Timer(self, labels)
+
+    def count(self, labels=()):
+        counts = self._values.get(tuple(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, list(counts))
+                            for labels, counts in self._values.items())
+
+        bounds = self.buckets + (float('inf'),)
+
+        for labels, counts in values:
+            total = 0
+
+            for bound, count in zip(bounds, counts):
+                total += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.labels, labels,
+                                      [('le', _format_value(bound))]),
+                       total)
+
+            yield self.name + '_sum', _format_labels(self.labels, labels), \
+                counts[-1]
+            yield self.name + '_count', _format_labels(self.labels, labels), \
+                total
+
+
+class Gauge(object):
+    """A value read when the metrics are rendered.
+
+    func returns a number, a dictionary of label values to numbers, or None
+    if there is nothing to report.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, func, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labels = tuple(labels)
+
+    def samples(self):
+        values = self.func()
+
+        if values is None:
+            return
+
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class _Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.time() - self.start
+        self.histogram.observe(elapsed, self.labels)
+
+        trace = profiling.current()
+
+        if trace is not None:
+            trace.span(self.labels[0] if self.labels else self.histogram.name,
+                       elapsed)
+
+
+def handler_name(handler):
+    """How a handler is labelled: its name, or the repositories it is for."""
+    return handler.get('name') or ','.join(dispatch.handler_repos(handler))
+
+
+class Metrics(object):
+    """The metrics of one application."""
+
+    def __init__(self, config):
+        self.config = config
+
+        self.requests = Histogram(
+            'github_webhook_request_seconds',
+            'Time to respond to a request to the hook, by status code.',
+            labels=('code',))
+        self.stages = Histogram(
+            'github_webhook_stage_seconds',
+            'Time spent in each stage of handling a delivery.',
+            labels=('stage',))
+        self.deliveries = Counter(
+            'github_webhook_deliveries_total',
+            'Deliveries accepted, by event type and repository.',
+            labels=('event', 'repo'))
+        self.matches = Counter(
+            'github_webhook_handler_matches_total',
+            'Deliveries matched by each handler.',
+            labels=('handler',))
+        self.action_exits = Counter(
+            'github_webhook_action_exits_total',
+            'Actions run, by handler and exit code.',
+            labels=('handler', 'exit_code'))
+        self.actions = Histogram(
+            'github_webhook_action_seconds',
+            'Time actions took to run, including starting them.',
+            labels=('handler',))
+        self.queue = Gauge(
+            'github_webhook_action_queue',
+            'Actions waiting in or running from the queue.',
+            self._queue_stats,
+            labels=('state',))
+
+        self.metrics = [self.requests, self.stages, self.deliveries,
+                        self.matches, self.action_exits, self.actions,
+                        self.queue]
+
+    def stage(self, name):
+        """Time a stage of a delivery with a with statement."""
+        return self.stages.time((name,))
+
+    def record_delivery(self, event_type, full_name, handlers):
+        self.deliveries.inc((event_type or '', full_name or ''))
+
+        names = [handler_name(handler) for handler in handlers]
+
+        for name in names:
+            self.matches.inc((name,))
+
+        trace = profiling.current()
+
+        if trace is not None:
+            trace.handlers.extend(names)
+
+    def record_action(self, handler, returncode, seconds):
+        name = handler_name(handler)
+        code = 'error' if returncode is None else returncode
+
+        self.action_exits.inc((name, str(code)))
+        self.actions.observe(seconds, (name,))
+
+        trace = profiling.current()
+
+        if trace is not None:
+            trace.span('action', seconds)
+
+    def _queue_stats(self):
+        state = self.config.get('_state') or {}
+        stats = {}
+
+        # only the executors that have been started are reported
+        for name in ('executor', 'async_executor'):
+            if name in state:
+                for key, value in state[name].stats().items():
+                    stats[(key,)] = stats.get((key,), 0) + value
+
+        return stats or None
+
+    def render(self):
+        """The metrics in the Prometheus text format."""
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels, _format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics(config):
+    """Fetch the metrics for the application with this config."""
+    return utils.config_state(config, 'metrics', Metrics)
+
+
+def is_metrics_request(config, request):
+    path = config.get('metrics_path')
+    return bool(path) and request.path == path
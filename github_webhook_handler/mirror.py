@@ -0,0 +1,371 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The bare mirrors of repositories kept in the cloner cache.
+
+Every process using a mirror holds a file lock on it while changing it, so
+concurrent events for the same repository can't corrupt its remote config
+or refs. Events that were waiting on the lock while another one fetched skip
+their own fetch if the commit they need was fetched. Without a commit a fetch
+is skipped if another fetch of the same refspec started after the event
+asked for one.
+
+The first fetch into a mirror decides whether it is shallow or partial.
+Later fetches only ever widen it, so one handler's depth or filter can't
+truncate the clones of another handler sharing the mirror: a shallow mirror
+is unshallowed for a clone without a depth, and a partial one refetched in
+full for a clone without a filter.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import git
+
+from github_webhook_handler import utils
+from github_webhook_handler import worktree
+
+LOG = logging.getLogger(__name__)
+
+FETCHED_FILE = 'gwh-fetched.json'
+USED_FILE = 'gwh-used'
+MAINTAINED_FILE = 'gwh-maintained'
+
+
+def has_commit(repo, commit):
+    try:
+        repo.git.cat_file('-e', commit + '^{commit}')
+    except git.GitCommandError:
+        return False
+
+    return True
+
+
+def is_shallow(repo):
+    return os.path.exists(os.path.join(repo.git_dir, 'shallow'))
+
+
+def partial_filter(repo):
+    """Return the filter of a partial clone, or None if it is complete."""
+    try:
+        return repo.git.config('remote.origin.partialclonefilter')
+    except git.GitCommandError:
+        return None
+
+
+def fetch(repo, refspec=None, commit=None, depth=None, filter_spec=None):
+    """Fetch refspec from origin, and commit if that didn't fetch it.
+
+    A shallow fetch may not reach commit if the ref has moved on since the
+    event. The commit is then asked for by itself, and if the server won't
+    send it the history is fetched in full.
+    """
+    kwargs = {}
+
+    if depth:
+        kwargs['depth'] = depth
+    if filter_spec:
+        kwargs['filter'] = filter_spec
+
+    repo.remotes.origin.fetch(refspec=refspec, **kwargs)
+
+    if not commit or has_commit(repo, commit):
+        return
+
+    LOG.info('%s is not reachable at depth %s, fetching it', commit, depth)
+
+    try:
+        repo.git.fetch('origin', commit, **kwargs)
+    except git.GitCommandError:
+        if not is_shallow(repo):
+            raise
+
+        LOG.info('Fetching the full history to find %s', commit)
+        repo.git.fetch('origin', *utils.as_list(refspec), unshallow=True)
+
+
+def _unset_partial(repo):
+    for name in ('remote.origin.promisor',
+                 'remote.origin.partialclonefilter',
+                 'extensions.partialclone'):
+        try:
+            repo.git.config('--unset', name)
+        except git.GitCommandError:
+            # not set
+            pass
+
+
+def widen(repo, refspec=None, depth=None, filter_spec=None):
+    """Widen a mirror to what a fetch needs and return its depth and filter.
+
+    An empty mirror takes the depth and filter asked for. A shallow mirror
+    is unshallowed if no depth is asked for, and a partial one is refetched
+    without its filter if no filter is asked for. A mirror that is already
+    complete keeps its history and objects rather than being narrowed, and
+    a partial one keeps its own filter.
+    """
+    if not repo.git.for_each_ref('--count=1'):
+        return depth, filter_spec
+
+    refspec = utils.as_list(refspec)
+    current = partial_filter(repo)
+
+    if current and not filter_spec:
+        LOG.info('Refetching %s without filter %s', repo.git_dir, current)
+        _unset_partial(repo)
+        repo.git.fetch('origin', *refspec, refetch=True,
+                       unshallow=is_shallow(repo) and not depth)
+    elif is_shallow(repo) and not depth:
+        LOG.info('Fetching the full history of %s', repo.git_dir)
+        repo.git.fetch('origin', *refspec, unshallow=True)
+
+    if not is_shallow(repo):
+        depth = None
+    if filter_spec:
+        # a different filter is fetched lazily from the promisor remote
+        filter_spec = partial_filter(repo)
+
+    return depth, filter_spec
+
+
+class Mirror(object):
+    """The cached bare mirror of one repository."""
+
+    def __init__(self, cache_dir, full_name):
+        self.cache_dir = cache_dir
+        self.full_name = full_name
+        self.git_dir = os.path.join(cache_dir, full_name + '.git')
+        self.lock_path = os.path.join(cache_dir, full_name + '.lock')
+        self.worktrees_dir = os.path.join(cache_dir, full_name + '.worktrees')
+
+    @classmethod
+    def find(cls, cache_dir):
+        """Return the mirrors in a cache directory."""
+        mirrors = []
+
+        for dirpath, dirnames, _ in os.walk(cache_dir):
+            for dirname in list(dirnames):
+                if dirname.endswith(('.worktrees', '.lock')):
+                    # don't walk the checkouts of worktrees
+                    dirnames.remove(dirname)
+                    continue
+
+                if not dirname.endswith('.git'):
+                    continue
+
+                # don't look for mirrors within a mirror
+                dirnames.remove(dirname)
+                path = os.path.join(dirpath, dirname)
+
+                if os.path.exists(os.path.join(path, 'HEAD')):
+                    full_name = os.path.relpath(path, cache_dir)[:-4]
+                    mirrors.append(cls(cache_dir, full_name))
+
+        return mirrors
+
+    def _mtime(self, name):
+        try:
+            return os.path.getmtime(os.path.join(self.git_dir, name))
+        except OSError:
+            return None
+
+    def _touch(self, name):
+        path = os.path.join(self.git_dir, name)
+
+        with open(path, 'a'):
+            os.utime(path, None)
+
+    @property
+    def last_used(self):
+        """When the mirror was last fetched into or used for a clone."""
+        return self._mtime(USED_FILE) or self._mtime('HEAD')
+
+    @property
+    def last_maintained(self):
+        return self._mtime(MAINTAINED_FILE)
+
+    def size(self):
+        """The bytes used by the mirror and its spare worktrees."""
+        total = 0
+
+        for top in (self.git_dir, self.worktrees_dir):
+            for dirpath, _, filenames in os.walk(top):
+                for filename in filenames:
+                    try:
+                        total += os.lstat(os.path.join(dirpath,
+                                                       filename)).st_size
+                    except OSError:
+                        pass
+
+        return total
+
+    def maintain(self):
+        """Repack the mirror and clean up after it.
+
+        Unreachable objects are kept, as commits that were fetched by
+        themselves and clones that borrow objects may still need them.
+        """
+        with self.lock():
+            repo = self.repo
+            repo.git.repack('-a', '-d', '-k', '-q')
+            repo.git.prune_packed()
+            repo.git.pack_refs('--all')
+            repo.git.commit_graph('write', '--reachable')
+            repo.git.worktree('prune')
+            self._touch(MAINTAINED_FILE)
+
+    def remove(self):
+        """Delete the mirror and its spare worktrees."""
+        with self.lock():
+            self._remove()
+
+    def remove_unused(self, used_before=None):
+        """Delete the mirror unless it is in use. Returns True if it was.
+
+        It is in use while a worktree other than a spare is checked out of
+        it, or if it was used at or after used_before, as the clones that
+        borrow its objects through alternates can't be found.
+        """
+        with self.lock():
+            if self._in_use(used_before):
+                return False
+
+            self._remove()
+            return True
+
+    def _in_use(self, used_before):
+        if used_before is not None and (self.last_used or 0) >= used_before:
+            return True
+
+        if not os.path.isdir(self.git_dir):
+            return False
+
+        ignored = (os.path.realpath(self.git_dir),
+                   os.path.realpath(self.worktrees_dir))
+
+        for path in worktree.list_worktrees(self.repo):
+            # the mirror itself is listed, and worktrees that were deleted
+            # are until they are pruned
+            if path == ignored[0] or os.path.dirname(path) == ignored[1]:
+                continue
+
+            if os.path.isdir(path):
+                return True
+
+        return False
+
+    def _remove(self):
+        shutil.rmtree(self.worktrees_dir, ignore_errors=True)
+        shutil.rmtree(self.git_dir, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold the lock of the mirror, shared by every process."""
+        dirname = os.path.dirname(self.lock_path)
+
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by another process at the same time
+                if not os.path.isdir(dirname):
+                    raise
+
+        with open(self.lock_path, 'a') as f:
+            with utils.flock(f.fileno()):
+                yield
+
+    @property
+    def repo(self):
+        return git.Repo(self.git_dir)
+
+    def _init(self, clone_url, keep_origin=False):
+        # must be called with the lock held
+        if os.path.isdir(self.git_dir):
+            repo = git.Repo(self.git_dir)
+        else:
+            repo = git.Repo.init(self.git_dir, bare=True, mkdir=True)
+
+        if 'origin' in [remote.name for remote in repo.remotes]:
+            if not keep_origin and repo.remotes.origin.url != clone_url:
+                repo.git.remote('set-url', 'origin', clone_url)
+        else:
+            repo.create_remote('origin', clone_url)
+
+        self._touch(USED_FILE)
+        return repo
+
+    def _read_fetched(self):
+        try:
+            with open(os.path.join(self.git_dir, FETCHED_FILE)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_fetched(self, fetched):
+        path = os.path.join(self.git_dir, FETCHED_FILE)
+
+        with open(path + '.tmp', 'w') as f:
+            json.dump(fetched, f)
+
+        os.rename(path + '.tmp', path)
+
+    def fetch(self, clone_url, refspec=None, commit=None,
+              depth=None, filter_spec=None, keep_origin=False):
+        """Fetch refspecs from clone_url into the mirror and return its repo.
+
+        The fetch is skipped if commit is already in the mirror, or if
+        another fetch of the same refspec started while this one was
+        waiting for the lock. With keep_origin a mirror that already exists
+        is fetched from the origin it has rather than from clone_url.
+        The mirror is first widened if it is shallower or more partial than
+        the fetch asks for.
+        """
+        requested = time.time()
+
+        with self.lock():
+            repo = self._init(clone_url, keep_origin=keep_origin)
+            depth, filter_spec = widen(repo, refspec=refspec, depth=depth,
+                                       filter_spec=filter_spec)
+
+            key = list(utils.as_list(refspec))
+
+            if depth:
+                key.append('--depth=%s' % depth)
+            if filter_spec:
+                key.append('--filter=%s' % filter_spec)
+
+            key = ' '.join(key)
+
+            if commit and has_commit(repo, commit):
+                LOG.info('%s of %s is already cached', commit, self.full_name)
+                return repo
+
+            fetched = self._read_fetched()
+
+            if fetched.get(key, 0) >= requested:
+                LOG.info('Using the fetch of %s %s made while waiting',
+                         self.full_name, key)
+                return repo
+
+            started = time.time()
+            fetch(repo, refspec=refspec, commit=commit,
+                  depth=depth, filter_spec=filter_spec)
+
+            fetched[key] = started
+            self._write_fetched(fetched)
+
+        return repo
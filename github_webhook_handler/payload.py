@@ -0,0 +1,87 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import contextlib
+import os
+import tempfile
+import threading
+
+SHM_DIR = '/dev/shm'
+
+
+def default_directory():
+    """Keep event files in memory when there is a tmpfs to put them on."""
+    if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK | os.X_OK):
+        return SHM_DIR
+
+    return None
+
+
+class Payload(object):
+    """The body of an event written to a read only file shared by actions.
+
+    The file is written when the first reference is acquired and removed
+    when the last is released, so the actions for an event share one copy
+    of it however many of them there are.
+    """
+
+    def __init__(self, body, directory=None):
+        self.body = body
+        self.directory = directory
+        self.path = None
+
+        self._lock = threading.Lock()
+        self._refs = 0
+
+    def acquire(self):
+        """Take a reference to the file, writing it if needed, and return
+        its path.
+        """
+        with self._lock:
+            if not self._refs:
+                self.path = self._write()
+
+            self._refs += 1
+            return self.path
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+
+            if not self._refs:
+                os.unlink(self.path)
+                self.path = None
+
+    @contextlib.contextmanager
+    def held(self):
+        path = self.acquire()
+
+        try:
+            yield path
+        finally:
+            self.release()
+
+    def _write(self):
+        directory = self.directory or default_directory()
+        fd, path = tempfile.mkstemp(prefix='gwh-',
+                                    suffix='-event.json',
+                                    dir=directory)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.body)
+                os.fchmod(f.fileno(), 0o400)
+        except Exception:
+            os.unlink(path)
+            raise
+
+        return path
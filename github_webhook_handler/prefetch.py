@@ -0,0 +1,230 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Keep the cache mirrors of the repositories in the handlers file warm.
+
+Every repository named by a handler is fetched into its mirror regularly,
+so the clone for an event only has to fetch what was pushed since.
+"""
+
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from multiprocessing import pool as mp_pool
+
+import git
+import webob.exc
+
+from github_webhook_handler import dispatch
+from github_webhook_handler import handler
+from github_webhook_handler import mirror
+from github_webhook_handler import utils
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_URL = 'https://github.com/{full_name}.git'
+DEFAULT_INTERVAL = 300
+DEFAULT_WORKERS = 4
+DEFAULT_JITTER = 30
+
+REFSPEC = '+refs/heads/*:refs/heads/*'
+
+
+def _merge_clone(clone, other):
+    # a mirror shared by handlers has to have what each of them clones
+    depths = (clone.get('depth'), other.get('depth'))
+    filters = (clone.get('filter'), other.get('filter'))
+
+    return {'depth': None if None in depths else max(depths),
+            'filter': filters[0] if filters[0] == filters[1] else None}
+
+
+def handler_repos(config):
+    """Return the repositories named in the handlers file and how to fetch.
+
+    Each repository maps to the depth and filter of the clone options of
+    its handlers, None where a handler clones it in full. Patterns such as
+    myorg/* can't be fetched and are skipped.
+    """
+    try:
+        handlers = handler._handlers_from_file(config)
+    except webob.exc.HTTPOk:
+        # there is no handlers file
+        return {}
+
+    repos = {}
+
+    for h in handlers:
+        options = h.get('clone') or {}
+        clone = {'depth': options.get('depth'),
+                 'filter': options.get('filter')}
+
+        for repo in dispatch.handler_repos(h):
+            if repo and not repo.endswith('*'):
+                repos[repo] = (_merge_clone(repos[repo], clone)
+                               if repo in repos else clone)
+
+    return repos
+
+
+class Prefetcher(object):
+    """Fetch the repositories of the handlers into the cache every interval.
+
+    At most workers repositories are fetched at once and each waits a
+    random time of up to jitter seconds first, so mirrors aren't all fetched
+    at the same moment.
+    """
+
+    def __init__(self, config, url=DEFAULT_URL, interval=DEFAULT_INTERVAL,
+                 workers=DEFAULT_WORKERS, jitter=DEFAULT_JITTER,
+                 sleep=time.sleep):
+        self.config = config
+        self.cache_dir = config['cache_dir']
+        self.url = url
+        self.interval = interval
+        self.workers = workers
+        self.jitter = jitter
+
+        self._sleep = sleep
+        self._stop = threading.Event()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config,
+                   url=config.get('prefetch_url', DEFAULT_URL),
+                   interval=config.get('prefetch_interval', DEFAULT_INTERVAL),
+                   workers=config.get('prefetch_workers', DEFAULT_WORKERS),
+                   jitter=config.get('prefetch_jitter', DEFAULT_JITTER))
+
+    def prefetch(self, full_name, clone=None):
+        """Fetch one repository. Returns True if the fetch succeeded.
+
+        clone is the depth and filter to fetch with, from handler_repos. The
+        url is only used to create a mirror, one that exists is fetched
+        from the origin it was cloned from.
+        """
+        clone = clone or {}
+
+        if self.jitter:
+            self._sleep(random.uniform(0, self.jitter))
+
+        cache = mirror.Mirror(self.cache_dir, full_name)
+
+        try:
+            cache.fetch(self.url.format(full_name=full_name),
+                        refspec=REFSPEC,
+                        depth=clone.get('depth'),
+                        filter_spec=clone.get('filter'),
+                        keep_origin=True)
+        except git.GitCommandError:
+            LOG.exception('Failed to prefetch %s', full_name)
+            return False
+
+        return True
+
+    def run_once(self):
+        """Fetch every repository once and return whether each succeeded."""
+        repos = handler_repos(self.config)
+
+        if not repos:
+            return {}
+
+        names = sorted(repos)
+        workers = mp_pool.ThreadPool(min(self.workers, len(names)))
+
+        try:
+            results = workers.map(lambda name: self.prefetch(name,
+                                                             repos[name]),
+                                  names)
+        finally:
+            workers.close()
+            workers.join()
+
+        return dict(zip(names, results))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                LOG.exception('Prefetching into %s failed', self.cache_dir)
+
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Prefetch every interval in a background thread."""
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return self._thread
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='github-prefetch')
+            self._thread.daemon = True
+            self._thread.start()
+
+            return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        thread = self._thread
+
+        if thread:
+            thread.join(timeout)
+
+
+def enabled(config):
+    """Whether the handler should prefetch in the background."""
+    return bool(config.get('cache_dir')) and 'prefetch_interval' in config
+
+
+def get_prefetcher(config):
+    """Fetch the prefetcher for the application with this config."""
+    return utils.config_state(config, 'prefetch', Prefetcher.from_config)
+
+
+def main(argv=None):
+    """Prefetch the repositories of a handler config, once or forever."""
+    parser = argparse.ArgumentParser(prog='github-webhook-cloner prefetch')
+
+    parser.add_argument('-c', '--config',
+                        dest='config',
+                        required=True,
+                        help='The config file of the handler')
+
+    parser.add_argument('--once',
+                        action='store_true',
+                        help='Fetch every repository once and exit')
+
+    logging.basicConfig(level=logging.INFO)
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    # imported here as the application starts the prefetcher
+    from github_webhook_handler import application
+    config = application.load_config(args.config)
+
+    if not config.get('cache_dir'):
+        parser.error('The config has no cache_dir to prefetch into')
+
+    prefetcher = Prefetcher.from_config(config)
+
+    if args.once:
+        results = prefetcher.run_once()
+        return 0 if all(results.values()) else 1
+
+    prefetcher._run()
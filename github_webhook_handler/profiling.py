@@ -0,0 +1,265 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Profile a sample of deliveries and trace the slow ones.
+
+With profile_dir set every profile_sample-th delivery is run under cProfile
+and, when profile_slow is set, any delivery slower than that many seconds is
+recorded too. The stage timings of a delivery are collected as it runs, so a
+slow delivery that wasn't sampled is recorded without a profile. Each record
+is a JSON file, with a .prof file next to it if the delivery was profiled,
+and only the newest profile_keep records are kept.
+
+Without profile_dir the application doesn't call into this module at all.
+"""
+
+import argparse
+import cProfile
+import itertools
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+import webob.exc
+
+from github_webhook_handler import utils
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_KEEP = 100
+
+_local = threading.local()
+
+
+def current():
+    """The trace of the delivery being handled by this thread, if any."""
+    return getattr(_local, 'trace', None)
+
+
+class Trace(object):
+    """The stage timings and matched handlers of one delivery."""
+
+    def __init__(self, delivery=None, event_type=None):
+        self.delivery = delivery
+        self.event_type = event_type
+        self.spans = []
+        self.handlers = []
+
+    def span(self, name, seconds):
+        self.spans.append((name, seconds))
+
+
+class Profiler(object):
+    """Run deliveries, profiling and recording them as configured."""
+
+    def __init__(self, directory, sample=None, slow=None, keep=DEFAULT_KEEP):
+        self.directory = directory
+        self.sample = sample
+        self.slow = slow
+        self.keep = keep
+
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['profile_dir'],
+                   sample=config.get('profile_sample'),
+                   slow=config.get('profile_slow'),
+                   keep=config.get('profile_keep', DEFAULT_KEEP))
+
+    def run(self, request, func, *args):
+        """Call func(*args) to handle request and return what it returns."""
+        sampled = bool(self.sample) and next(self._counter) % self.sample == 0
+
+        if not sampled and self.slow is None:
+            return func(*args)
+
+        trace = _local.trace = Trace(request.delivery, request.event_type)
+        profile = cProfile.Profile() if sampled else None
+        status = 500
+        start = time.time()
+
+        try:
+            if profile:
+                try:
+                    profile.enable()
+                except ValueError:
+                    # another thread is profiling, only one can at a time
+                    profile = None
+
+            response = func(*args)
+            status = response.status_int
+            return response
+        except webob.exc.HTTPException as e:
+            status = e.code
+            raise
+        finally:
+            elapsed = time.time() - start
+
+            if profile:
+                profile.disable()
+
+            _local.trace = None
+
+            if profile or (self.slow is not None and elapsed >= self.slow):
+                try:
+                    self.write(trace, profile, elapsed, status)
+                except (IOError, OSError):
+                    LOG.exception('Failed to write the profile of %s',
+                                  trace.delivery)
+
+    def write(self, trace, profile, elapsed, status):
+        """Record a delivery and remove the oldest records beyond keep."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        now = time.time()
+        name = '%s%06d-%s' % (time.strftime('%Y%m%dT%H%M%S',
+                                            time.gmtime(now)),
+                              int(now % 1 * 1e6),
+                              trace.delivery or uuid.uuid4().hex)
+        name = name.replace(os.sep, '_')
+        path = os.path.join(self.directory, name)
+
+        record = {'delivery': trace.delivery,
+                  'event': trace.event_type,
+                  'time': now,
+                  'seconds': elapsed,
+                  'status': status,
+                  'handlers': trace.handlers,
+                  'stages': trace.spans,
+                  'profile': None}
+
+        if profile:
+            profile.dump_stats(path + '.prof')
+            record['profile'] = name + '.prof'
+
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump(record, f)
+
+        os.rename(path + '.json.tmp', path + '.json')
+
+        with self._lock:
+            self._rotate()
+
+        return path + '.json'
+
+    def _rotate(self):
+        records = sorted(n for n in os.listdir(self.directory)
+                         if n.endswith('.json'))
+
+        for name in records[:max(0, len(records) - self.keep)]:
+            base = os.path.join(self.directory, name[:-len('.json')])
+
+            for path in (base + '.json', base + '.prof'):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+
+def enabled(config):
+    return bool(config.get('profile_dir'))
+
+
+def get_profiler(config):
+    """Fetch the profiler for the application with this config."""
+    return utils.config_state(config, 'profiler', Profiler.from_config)
+
+
+def load_records(directory):
+    """Return the records in a profile directory, oldest first."""
+    records = []
+
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as f:
+                records.append(json.load(f))
+
+    return records
+
+
+def summarise(directory, slowest=10, top=20, sort='cumulative',
+              out=sys.stdout):
+    """Print the slowest deliveries, stage times and hottest functions."""
+    records = load_records(directory)
+
+    if not records:
+        out.write('No profiles in %s\n' % directory)
+        return
+
+    out.write('%d deliveries, %d profiled\n\n' % (
+        len(records), sum(1 for r in records if r['profile'])))
+
+    out.write('Slowest deliveries:\n')
+    for record in sorted(records, key=lambda r: -r['seconds'])[:slowest]:
+        out.write('  %8.3fs %3s %-12s %-36s %s\n' % (
+            record['seconds'],
+            record['status'],
+            record['event'] or '',
+            record['delivery'] or '',
+            ', '.join(record['handlers'])))
+
+    stages = {}
+    for record in records:
+        for name, seconds in record['stages']:
+            stages.setdefault(name, []).append(seconds)
+
+    out.write('\nStages:\n')
+    for name, times in sorted(stages.items(), key=lambda s: -sum(s[1])):
+        out.write('  %-10s count=%-6d mean=%8.3fms max=%8.3fms\n' % (
+            name, len(times), sum(times) / len(times) * 1e3,
+            max(times) * 1e3))
+
+    profiles = [os.path.join(directory, r['profile'])
+                for r in records
+                if r['profile'] and os.path.exists(os.path.join(
+                    directory, r['profile']))]
+
+    if profiles:
+        out.write('\nFunctions, over every profile:\n')
+        stats = pstats.Stats(*profiles, stream=out)
+        stats.sort_stats(sort).print_stats(top)
+
+
+def main(argv=None):
+    """Summarise the deliveries recorded in a profile directory."""
+    parser = argparse.ArgumentParser(prog='github-webhook-profiles')
+
+    parser.add_argument('directory',
+                        help='The profile_dir of the handler')
+
+    parser.add_argument('--slowest',
+                        type=int,
+                        default=10,
+                        help='How many of the slowest deliveries to list')
+
+    parser.add_argument('--top',
+                        type=int,
+                        default=20,
+                        help='How many functions to list')
+
+    parser.add_argument('--sort',
+                        default='cumulative',
+                        choices=('cumulative', 'tottime', 'ncalls'),
+                        help='What to sort the functions by')
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    summarise(args.directory, slowest=args.slowest, top=args.top,
+              sort=args.sort)
@@ -0,0 +1,133 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import datetime
+import logging
+import os
+import sys
+import time
+
+from github_webhook_handler import application
+from github_webhook_handler import executor
+from github_webhook_handler import spool
+
+LOG = logging.getLogger(__name__)
+
+TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+
+
+def parse_time(value):
+    """Parse a unix timestamp or a local ISO 8601 date and time."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    for fmt in TIME_FORMATS:
+        try:
+            dt = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+
+        return time.mktime(dt.timetuple())
+
+    raise argparse.ArgumentTypeError('Invalid time %r' % value)
+
+
+def replay(config, events_spool, since=None, until=None, pending=False,
+           workers=executor.DEFAULT_WORKERS):
+    """Run the actions of spooled jobs as fast as the workers allow.
+
+    If pending is set only jobs that never completed are run and they are
+    marked as complete in the spool, otherwise the spool is not changed.
+    Returns the number of jobs that were run.
+    """
+    jobs = [executor.Job.from_spool(spooled)
+            for spooled in events_spool.jobs(since=since,
+                                             until=until,
+                                             pending=pending)]
+
+    if not pending:
+        for job in jobs:
+            del job.spool_ids[:]
+
+    ex = executor.Executor(config,
+                           workers=workers,
+                           queue_size=len(jobs),
+                           spool=events_spool if pending else None)
+
+    ex.submit(jobs)
+    ex.join()
+    ex.stop()
+
+    return len(jobs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the actions of events recorded in the spool')
+
+    parser.add_argument('-c', '--config',
+                        dest='config',
+                        default=os.environ.get('GWH_CONFIG_FILE'),
+                        help='Config file to load')
+
+    parser.add_argument('--spool',
+                        dest='spool',
+                        help='The spool to read events from, defaults to '
+                             'the spool in the config file')
+
+    parser.add_argument('--since',
+                        type=parse_time,
+                        help='Only replay events received at or after this '
+                             'time, as a unix timestamp or ISO 8601')
+
+    parser.add_argument('--until',
+                        type=parse_time,
+                        help='Only replay events received before this time')
+
+    parser.add_argument('--pending',
+                        action='store_true',
+                        help='Only replay jobs that never completed and '
+                             'mark them complete')
+
+    parser.add_argument('-j', '--workers',
+                        type=int,
+                        default=executor.DEFAULT_WORKERS,
+                        help='The number of actions to run at once')
+
+    logging.basicConfig(level=logging.INFO)
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    config = application.load_config(args.config)
+    spool_path = args.spool or config.get('spool')
+
+    if not spool_path:
+        parser.error('No spool given and none in the config file')
+
+    start = time.time()
+    count = replay(config,
+                   spool.Spool(spool_path),
+                   since=args.since,
+                   until=args.until,
+                   pending=args.pending,
+                   workers=args.workers)
+    elapsed = time.time() - start
+
+    LOG.info('Replayed %d jobs in %.2fs (%.1f/s)',
+             count, elapsed, count / elapsed if elapsed else 0)
+
+
+if __name__ == '__main__':
+    main()
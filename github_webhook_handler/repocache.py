@@ -0,0 +1,231 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Keep the cloner cache within a disk budget and its mirrors maintained."""
+
+import argparse
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+import git
+
+from github_webhook_handler import mirror
+from github_webhook_handler import utils
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 3600
+
+# how recently a mirror can have been used and still be evicted, as clones
+# may be borrowing its objects
+DEFAULT_MIN_AGE = 3600
+
+_SIZE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.I)
+_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30, 't': 1 << 40}
+
+
+def parse_size(value):
+    """Parse a number of bytes such as 1024, '500M' or '10GB'."""
+    if value is None or isinstance(value, int):
+        return value
+
+    match = _SIZE.match(value)
+
+    if not match:
+        raise ValueError('Invalid size %r' % value)
+
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+class CacheManager(object):
+    """Evict and maintain the mirrors in a cache directory.
+
+    Once the mirrors use more than max_size bytes the least recently used
+    ones are removed until they fit. Mirrors that worktrees are checked out
+    of, or that were used in the last min_age seconds, are kept. A mirror
+    that has been used since it was last maintained, and not maintained for
+    interval seconds, is repacked.
+    """
+
+    def __init__(self, cache_dir, max_size=None, interval=DEFAULT_INTERVAL,
+                 min_age=DEFAULT_MIN_AGE, clock=time.time):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.interval = interval
+        self.min_age = min_age
+
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['cache_dir'],
+                   max_size=parse_size(config.get('cache_max_size')),
+                   interval=config.get('cache_maintenance_interval',
+                                       DEFAULT_INTERVAL),
+                   min_age=config.get('cache_min_age', DEFAULT_MIN_AGE))
+
+    def evict(self, mirrors=None):
+        """Remove the least recently used mirrors to fit the budget.
+
+        Returns the mirrors that were removed.
+        """
+        if self.max_size is None:
+            return []
+
+        if mirrors is None:
+            mirrors = mirror.Mirror.find(self.cache_dir)
+
+        sizes = [(m.last_used or 0, m.size(), m) for m in mirrors]
+        total = sum(size for _, size, _ in sizes)
+        used_before = self._clock() - self.min_age
+        removed = []
+
+        for _, size, m in sorted(sizes, key=lambda s: s[0]):
+            if total <= self.max_size:
+                break
+
+            if not m.remove_unused(used_before):
+                LOG.info('Not evicting %s from the cache as it is in use',
+                         m.full_name)
+                continue
+
+            LOG.info('Evicted %s (%d bytes) from the cache', m.full_name,
+                     size)
+            total -= size
+            removed.append(m)
+
+        return removed
+
+    def needs_maintenance(self, m):
+        last_maintained = m.last_maintained
+
+        if last_maintained is None:
+            return True
+
+        if (m.last_used or 0) <= last_maintained:
+            return False
+
+        return self._clock() - last_maintained >= self.interval
+
+    def maintain(self, force=False):
+        """Maintain the mirrors that need it, or all of them with force.
+
+        Returns the mirrors that were maintained.
+        """
+        maintained = []
+
+        for m in mirror.Mirror.find(self.cache_dir):
+            if not (force or self.needs_maintenance(m)):
+                continue
+
+            LOG.info('Maintaining %s', m.full_name)
+
+            try:
+                m.maintain()
+            except git.GitCommandError:
+                LOG.exception('Failed to maintain %s', m.full_name)
+            else:
+                maintained.append(m)
+
+        return maintained
+
+    def run_once(self, force=False):
+        self.evict()
+        self.maintain(force=force)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                LOG.exception('Cache maintenance of %s failed',
+                              self.cache_dir)
+
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Run maintenance every interval in a background thread."""
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return self._thread
+
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run,
+                                            name='github-cache-maintenance')
+            self._thread.daemon = True
+            self._thread.start()
+
+            return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        thread = self._thread
+
+        if thread:
+            thread.join(timeout)
+
+
+def enabled(config):
+    """Whether the cache of the handler should be managed in the background."""
+    options = ('cache_max_size', 'cache_maintenance_interval')
+    return bool(config.get('cache_dir')) and any(o in config for o in options)
+
+
+def get_manager(config):
+    """Fetch the cache manager for the application with this config."""
+    return utils.config_state(config, 'repocache', CacheManager.from_config)
+
+
+def main(argv=None):
+    """Evict and maintain the mirrors of a cache once."""
+    parser = argparse.ArgumentParser(prog='github-webhook-cloner maintain')
+
+    parser.add_argument('--cache-dir',
+                        dest='cache_dir',
+                        default=os.environ.get('GWH_CACHE_DIR'),
+                        required=not os.environ.get('GWH_CACHE_DIR'),
+                        help='The cache directory to maintain')
+
+    parser.add_argument('--max-size',
+                        dest='max_size',
+                        type=parse_size,
+                        default=os.environ.get('GWH_CACHE_MAX_SIZE'),
+                        help='Evict the least recently used mirrors once '
+                             'the cache is bigger than this, such as 10G')
+
+    parser.add_argument('--min-age',
+                        dest='min_age',
+                        type=float,
+                        default=DEFAULT_MIN_AGE,
+                        help='Only evict mirrors that were last used more '
+                             'than this many seconds ago, longer than any '
+                             'action runs for')
+
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='Maintain every mirror, not just those used '
+                             'since they were last maintained')
+
+    logging.basicConfig(level=logging.INFO)
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    manager = CacheManager(args.cache_dir, max_size=args.max_size, interval=0,
+                           min_age=args.min_age)
+    manager.run_once(force=args.force)
@@ -0,0 +1,97 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import importlib
+import io
+import multiprocessing
+import os
+import sys
+
+from github_webhook_handler import utils
+
+DEFAULT_PRELOAD = ('github_webhook_handler.cloner',)
+
+
+def load_entry_point(entry_point):
+    """Find the function named by module:function."""
+    module_name, _, attrs = entry_point.partition(':')
+
+    if not module_name or not attrs:
+        raise ValueError('Entry point %s is not of the form module:function'
+                         % entry_point)
+
+    func = importlib.import_module(module_name)
+
+    for attr in attrs.split('.'):
+        func = getattr(func, attr)
+
+    return func
+
+
+def _main(entry_point, args, env, cwd, stdin):
+    # run in the forked child, set it up as if it had been spawned as a
+    # console script the way an action is
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+
+    if stdin:
+        fd = os.open(stdin, os.O_RDONLY)
+        os.dup2(fd, 0)
+        os.close(fd)
+        sys.stdin = io.open(0, 'r', closefd=False)
+
+    sys.argv = [entry_point] + list(args)
+    sys.exit(load_entry_point(entry_point)())
+
+
+class WarmRunner(object):
+    """Run Python entry points in processes forked from a warm server.
+
+    A fork server process is started on first use with the preload modules
+    already imported. Each entry point is run in a new child forked from it,
+    so it starts without paying for an interpreter and its imports but still
+    gets a clean process with its own environment and working directory.
+    """
+
+    def __init__(self, preload=DEFAULT_PRELOAD):
+        self.preload = list(preload)
+
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self._context = multiprocessing.get_context('forkserver')
+            self._context.set_forkserver_preload(self.preload)
+        else:
+            self._context = multiprocessing.get_context('fork')
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(preload=config.get('entry_point_preload', DEFAULT_PRELOAD))
+
+    def run(self, entry_point, args, env, cwd, stdin=None):
+        """Run an entry point to completion and return its exit code.
+
+        The entry point is called with no arguments after sys.argv, the
+        environment and the working directory are set up, like a console
+        script. stdin is the path of a file to give it as standard input.
+        """
+        process = self._context.Process(
+            target=_main,
+            args=(entry_point, args, env, cwd, stdin),
+            name=entry_point)
+        process.start()
+        process.join()
+        return process.exitcode
+
+
+def get_runner(config):
+    """Fetch the entry point runner for the application with this config."""
+    return utils.config_state(config, 'runner', WarmRunner.from_config)
@@ -0,0 +1,297 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A pre-forking HTTP server for the WSGI application.
+
+The master process loads the config, the handlers and the GitHub hook
+blocks before forking the workers, so every worker starts with them already
+parsed in memory it shares with the others until it changes them. Each
+worker listens on its own SO_REUSEPORT socket and the kernel spreads the
+connections between them. Where SO_REUSEPORT isn't available the workers
+accept from one socket opened by the master.
+
+Workers that exit are replaced. The jobs left in the spool by the last run
+are read by the master before forking and run by the first worker, once,
+so a replaced worker doesn't run again jobs that other workers still have
+queued. The first worker also runs cache maintenance and prefetching, so
+they aren't done once for each worker.
+"""
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from wsgiref import simple_server
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from github_webhook_handler import application
+from github_webhook_handler import executor
+from github_webhook_handler import handler
+from github_webhook_handler import meta
+from github_webhook_handler import spool
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8080
+
+# how long a worker must run to be replaced straight away when it exits
+MIN_WORKER_LIFETIME = 1
+
+REUSE_PORT = hasattr(socket, 'SO_REUSEPORT')
+
+
+class WSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+
+class RequestHandler(simple_server.WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        LOG.info('%s %s', self.address_string(), format % args)
+
+
+def make_socket(host, port, listen=True):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET,
+                         socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if REUSE_PORT:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    sock.bind((host, port))
+
+    if listen:
+        sock.listen(socket.SOMAXCONN)
+
+    return sock
+
+
+def load_pending(config):
+    """Read the jobs the last run left in the spool, to resume them once."""
+    if config.get('execution') != 'async' or not config.get('spool'):
+        return []
+
+    # closed again before forking, a connection can't be shared with a child
+    events = spool.Spool.from_config(config)
+
+    try:
+        return executor.pending_jobs(
+            events,
+            config.get('spool_retention', executor.DEFAULT_SPOOL_RETENTION))
+    finally:
+        events.close()
+
+
+def preload(config):
+    """Load what every worker needs before they are forked."""
+    cache = meta.get_cache(config)
+
+    if not cache.loaded or cache.expired:
+        cache.refresh()
+
+    if config.get('handlers'):
+        handler._handlers_from_file(config)
+
+    if hasattr(gc, 'freeze'):
+        # keep the collector from writing to, and so copying, the pages
+        # shared with the workers
+        gc.collect()
+        gc.freeze()
+
+
+class Server(object):
+    """Fork workers to serve the application for config and keep them up."""
+
+    def __init__(self, config, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                 workers=None):
+        self.config = config
+        self.host = host
+        self.port = port
+        self.workers = workers or multiprocessing.cpu_count()
+
+        self.socket = None
+        self._pending = []
+        self._pids = {}
+        self._started = {}
+        self._stopping = False
+
+    def start(self):
+        """Bind the port, load the shared state and fork the workers."""
+        # with SO_REUSEPORT the master only binds, to hold the port (and
+        # pick it if it is 0) without taking any of the connections
+        self.socket = make_socket(self.host, self.port, listen=not REUSE_PORT)
+        self.port = self.socket.getsockname()[1]
+
+        self._pending = load_pending(self.config)
+        preload(self.config)
+
+        LOG.info('Listening on %s:%d with %d workers',
+                 self.host, self.port, self.workers)
+
+        for index in range(self.workers):
+            self._spawn(index)
+
+        # only given to the first worker 0, not those that replace it
+        self._pending = []
+
+    def run(self):
+        """Start and then replace workers that exit until stopped."""
+        signal.signal(signal.SIGTERM, self._signal_stop)
+        signal.signal(signal.SIGINT, self._signal_stop)
+
+        self.start()
+
+        while self._pids:
+            try:
+                pid, status = os.wait()
+            except OSError:
+                continue
+
+            index = self._pids.pop(pid, None)
+
+            if index is None or self._stopping:
+                continue
+
+            LOG.warning('Worker %d (pid %d) exited with status %d',
+                        index, pid, status)
+
+            if time.time() - self._started[index] < MIN_WORKER_LIFETIME:
+                # don't spin if workers can't start
+                time.sleep(MIN_WORKER_LIFETIME)
+
+            if not self._stopping:
+                self._spawn(index)
+
+        self.socket.close()
+
+    def stop(self):
+        self._stopping = True
+
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _signal_stop(self, signum, frame):
+        LOG.info('Stopping workers')
+        self.stop()
+
+    def _spawn(self, index):
+        pid = os.fork()
+
+        if pid:
+            self._pids[pid] = index
+            self._started[index] = time.time()
+            return pid
+
+        status = 1
+
+        try:
+            self._worker(index)
+            status = 0
+        except Exception:
+            LOG.exception('Worker %d failed', index)
+        finally:
+            os._exit(status)
+
+    def _worker(self, index):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        if REUSE_PORT:
+            self.socket.close()
+            sock = make_socket(self.host, self.port)
+        else:
+            sock = self.socket
+
+        config = self.config
+
+        if index == 0:
+            application.start_background(config)
+
+        httpd = WSGIServer((self.host, self.port), RequestHandler,
+                           bind_and_activate=False)
+        httpd.socket = sock
+        httpd.server_address = sock.getsockname()
+        httpd.server_name = socket.getfqdn(self.host)
+        httpd.server_port = self.port
+        httpd.setup_environ()
+        httpd.set_app(application.make_application(config, resume=False))
+
+        if index == 0 and self._pending:
+            executor.get_executor(config).requeue(self._pending)
+
+        def stop(signum, frame):
+            # shutdown waits for serve_forever, so can't be called from it
+            threading.Thread(target=httpd.shutdown).start()
+
+        signal.signal(signal.SIGTERM, stop)
+
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+
+        job_executor = config.get('_state', {}).get('executor')
+
+        if job_executor:
+            job_executor.stop()
+
+
+def main(argv=None):
+    """Serve the handler from a pre-forked pool of worker processes."""
+    parser = argparse.ArgumentParser(prog='github-webhook-server')
+
+    parser.add_argument('-c', '--config',
+                        dest='config',
+                        default=os.environ.get('GWH_CONFIG_FILE'),
+                        help='Config file to load')
+
+    parser.add_argument('--host',
+                        default=DEFAULT_HOST,
+                        help='The address to listen on')
+
+    parser.add_argument('-p', '--port',
+                        type=int,
+                        default=DEFAULT_PORT,
+                        help='The port to listen on')
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=None,
+                        help='How many worker processes to run, by default '
+                             'one for each CPU')
+
+    logging.basicConfig(level=logging.INFO)
+
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    server = Server(application.load_config(args.config),
+                    host=args.host,
+                    port=args.port,
+                    workers=args.workers)
+    server.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    received REAL NOT NULL,
+    event_type TEXT,
+    body BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id INTEGER NOT NULL REFERENCES events(id),
+    handler TEXT NOT NULL,
+    completed REAL
+);
+
+CREATE INDEX IF NOT EXISTS events_received ON events(received);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs(completed, event_id);
+"""
+
+
+class SpooledJob(object):
+    """A job read back from the spool."""
+
+    def __init__(self, job_id, received, event_type, body, handler,
+                 completed):
+        self.job_id = job_id
+        self.received = received
+        self.event_type = event_type
+        self.body = body
+        self.handler = handler
+        self.completed = completed
+
+
+class Spool(object):
+    """Record accepted events and their jobs in a SQLite database.
+
+    The database uses write ahead logging. With the default synchronous mode
+    of NORMAL a commit is written to the log but the log is only fsync'd when
+    it is checkpointed, so records survive the process crashing at the cost
+    of a small number of fsyncs. Set synchronous to FULL to fsync on every
+    commit and survive losing power as well.
+
+    A new database is only readable by its owner, as the events may hold
+    anything the senders put in them. SQLite gives the log the same mode.
+    The keys of the handlers are never recorded.
+    """
+
+    def __init__(self, path, synchronous='NORMAL', clock=time.time):
+        self.path = path
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self._conn = sqlite3.connect(path,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+
+        synchronous = synchronous.upper()
+
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError('Unknown spool synchronous mode %s' % synchronous)
+
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=%s' % synchronous)
+        self._conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['spool'],
+                   synchronous=config.get('spool_synchronous', 'NORMAL'))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, event_type, body, handlers):
+        """Record an event and a job for each handler, returning the job ids.
+
+        Nothing is recorded unless everything is.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                cursor = self._conn.execute(
+                    'INSERT INTO events (received, event_type, body) '
+                    'VALUES (?, ?, ?)',
+                    (self._clock(), event_type, sqlite3.Binary(body)))
+                event_id = cursor.lastrowid
+
+                job_ids = []
+
+                for handler in handlers:
+                    handler = dict((name, value)
+                                   for name, value in handler.items()
+                                   if name != 'key')
+                    cursor = self._conn.execute(
+                        'INSERT INTO jobs (event_id, handler) VALUES (?, ?)',
+                        (event_id, json.dumps(handler)))
+                    job_ids.append(cursor.lastrowid)
+
+        return job_ids
+
+    def complete(self, job_ids):
+        with self._lock:
+            self._conn.executemany(
+                'UPDATE jobs SET completed = ? WHERE id = ?',
+                [(self._clock(), job_id) for job_id in job_ids])
+
+    def discard(self, job_ids):
+        """Remove jobs that were recorded but not accepted, and their events.
+
+        Other jobs of their events are kept, as are the events if any are.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                event_ids = set()
+
+                for job_id in job_ids:
+                    row = self._conn.execute(
+                        'SELECT event_id FROM jobs WHERE id = ?',
+                        (job_id,)).fetchone()
+
+                    if row:
+                        event_ids.add(row[0])
+                        self._conn.execute('DELETE FROM jobs WHERE id = ?',
+                                           (job_id,))
+
+                self._conn.executemany(
+                    'DELETE FROM events WHERE id = ? AND NOT EXISTS '
+                    '(SELECT 1 FROM jobs WHERE event_id = events.id)',
+                    [(event_id,) for event_id in event_ids])
+
+    def jobs(self, since=None, until=None, pending=False):
+        """Return the spooled jobs in the order their events were received."""
+        query = ['SELECT jobs.id, events.received, events.event_type, '
+                 'events.body, jobs.handler, jobs.completed '
+                 'FROM jobs JOIN events ON jobs.event_id = events.id '
+                 'WHERE 1']
+        args = []
+
+        if since is not None:
+            query.append('AND events.received >= ?')
+            args.append(since)
+
+        if until is not None:
+            query.append('AND events.received < ?')
+            args.append(until)
+
+        if pending:
+            query.append('AND jobs.completed IS NULL')
+
+        query.append('ORDER BY jobs.id')
+
+        with self._lock:
+            rows = self._conn.execute(' '.join(query), args).fetchall()
+
+        return [SpooledJob(job_id, received, event_type, bytes(body),
+                           json.loads(handler), completed)
+                for job_id, received, event_type, body, handler, completed
+                in rows]
+
+    def pending(self):
+        return self.jobs(pending=True)
+
+    def purge(self, before):
+        """Remove completed jobs, and events with no other jobs, by age."""
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN')
+                self._conn.execute(
+                    'DELETE FROM jobs WHERE completed IS NOT NULL AND '
+                    'event_id IN (SELECT id FROM events WHERE received < ?)',
+                    (before,))
+                self._conn.execute(
+                    'DELETE FROM events WHERE received < ? AND id NOT IN '
+                    '(SELECT event_id FROM jobs)',
+                    (before,))
@@ -10,6 +10,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import hashlib
+import hmac
+import json
 import uuid
 
 from requests_mock.contrib import fixture
@@ -20,11 +23,24 @@ import webtest
 from github_webhook_handler import application
 from github_webhook_handler import handler
 
+SIGNATURE_HEADERS = {'sha1': 'X-Hub-Signature',
+                     'sha256': 'X-Hub-Signature-256'}
+
 
 def _flip_handler_args(request, config):
     return handler.handle(config, request)
 
 
+class FakeClock(object):
+    """A clock that only moves when a test changes it."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
 class TestCase(testtools.TestCase):
     """Test case base class for all unit tests."""
 
@@ -37,7 +53,8 @@ class TestCase(testtools.TestCase):
         self.requests_mock = self.useFixture(fixture.Fixture())
 
     def create_app(self, config=None, full_application=False):
-        config = config or {}
+        if config is None:
+            config = {}
 
         # application does some checks on routing and if the caller is coming
         # from a github IP address. We don't need that generally so we can set
@@ -55,10 +72,11 @@ class TestCase(testtools.TestCase):
 
     def post(self, data, **kwargs):
         app = self.create_app(
-            config=kwargs.pop('config', {}),
+            config=kwargs.pop('config', None),
             full_application=kwargs.pop('full_application', False))
 
         headers = kwargs.setdefault('headers', {})
+        body = json.dumps(data).encode('utf-8')
 
         try:
             signature = kwargs.pop('signature')
@@ -67,7 +85,20 @@ class TestCase(testtools.TestCase):
         else:
             headers['X-Hub-Signature'] = 'sha1=%s' % signature
 
-        return app.post_json('/', data, **kwargs)
+        # sign the body with a key using each of the given algorithms
+        key = kwargs.pop('key', None)
+
+        for algorithm in kwargs.pop('algorithms', ['sha1']) if key else []:
+            mac = hmac.new(key.encode('utf-8'),
+                           msg=body,
+                           digestmod=getattr(hashlib, algorithm))
+            headers[SIGNATURE_HEADERS[algorithm]] = '%s=%s' % (
+                algorithm, mac.hexdigest())
+
+        return app.post('/',
+                        body,
+                        content_type='application/json',
+                        **kwargs)
 
     def ping(self, data=None, **kwargs):
         data = data or {}
@@ -0,0 +1,382 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import subprocess
+
+import fixtures
+
+from github_webhook_handler import asgi
+from github_webhook_handler import metrics
+from github_webhook_handler import spool
+from github_webhook_handler.tests import base
+from github_webhook_handler.tests import test_dedup
+from github_webhook_handler.tests import test_github_webhook_handler
+from github_webhook_handler.tests import test_metrics
+
+handler_func = 'github_webhook_handler.handler._handlers_from_file'
+exec_func = 'github_webhook_handler.asgi.asyncio.create_subprocess_exec'
+
+
+class Response(object):
+
+    def __init__(self, status_int, headers, body):
+        self.status_int = status_int
+        self.headers = headers
+        self.body = body
+
+    @property
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+
+class AsgiTestApp(object):
+    """Enough of webtest.TestApp to drive an ASGI application."""
+
+    def __init__(self, app, loop):
+        self.app = app
+        self.loop = loop
+
+    async def _call(self, scope, body):
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        await self.app(scope, receive, send)
+
+        return Response(sent[0]['status'],
+                        dict(sent[0]['headers']),
+                        b''.join(m.get('body', b'') for m in sent[1:]))
+
+    def request(self, method, path, body=b'', headers=None,
+                content_type=None, status=None, extra_environ=None):
+        headers = dict(headers or {})
+
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        environ = extra_environ or {}
+        scope = {'type': 'http',
+                 'method': method,
+                 'path': path,
+                 'headers': [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                             for k, v in headers.items()],
+                 'client': (environ.get('REMOTE_ADDR', '127.0.0.1'), 12345)}
+
+        resp = self.loop.run_until_complete(self._call(scope, body))
+
+        if status is None:
+            assert 200 <= resp.status_int < 400, resp.status_int
+        else:
+            assert resp.status_int == status, resp.status_int
+
+        return resp
+
+    def post(self, path, params=b'', **kwargs):
+        return self.request('POST', path, params, **kwargs)
+
+    def post_json(self, path, data, **kwargs):
+        kwargs['content_type'] = 'application/json'
+        return self.post(path, json.dumps(data), **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def put(self, path, params=b'', **kwargs):
+        return self.request('PUT', path, params, **kwargs)
+
+    def head(self, path, **kwargs):
+        return self.request('HEAD', path, **kwargs)
+
+
+class PopenProcess(object):
+    """Run an asyncio subprocess with subprocess.Popen so it can be faked."""
+
+    def __init__(self, args, kwargs):
+        self.process = subprocess.Popen(list(args), **kwargs)
+
+    async def wait(self):
+        self.process.communicate()
+        return self.process.returncode
+
+
+async def popen_exec(*args, **kwargs):
+    return PopenProcess(args, kwargs)
+
+
+class AsgiMixin(object):
+    """Run a test case written against the WSGI application with ASGI."""
+
+    def setUp(self):
+        super(AsgiMixin, self).setUp()
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        self.useFixture(fixtures.MockPatch(exec_func, new=popen_exec))
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def lifespan(self, app):
+        """Start and then shut down an application as a server would."""
+        messages = [{'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        self.run_async(app({'type': 'lifespan'}, receive, send))
+        return sent
+
+    def create_app(self, config=None, full_application=False):
+        app = asgi.Application({} if config is None else config)
+
+        # as with the WSGI tests skip the routing and source checks
+        if not full_application:
+            app.application = app.handle
+
+        return AsgiTestApp(app, self.loop)
+
+
+class TestAsgiHandler(AsgiMixin,
+                      test_github_webhook_handler.TestGithubWebhookHandler):
+
+    def test_working_dir_removed(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './run.sh'}]
+
+        self.push()
+
+        args = self.fake_popen.procs[0]._args
+        self.assertFalse(os.path.exists(args['cwd']))
+        self.assertFalse(os.path.exists(args['env']['GWH_EVENT_FILE']))
+
+    def test_lifespan(self):
+        sent = self.lifespan(asgi.Application({}))
+
+        self.assertEqual(['lifespan.startup.complete',
+                          'lifespan.shutdown.complete'], sent)
+
+
+class TestAsgiDeduplication(AsgiMixin, test_dedup.TestDeduplication):
+    pass
+
+
+class TestAsgiMetricsEndpoint(AsgiMixin, test_metrics.TestMetricsEndpoint):
+
+    def scrape(self):
+        app = self.create_app(config=self.config, full_application=True)
+        resp = app.get('/metrics')
+
+        self.assertEqual(metrics.CONTENT_TYPE.encode('utf-8'),
+                         resp.headers[b'content-type'])
+        return resp.body.decode('utf-8').splitlines()
+
+
+class SlowExec(object):
+    """A fake subprocess exec whose process runs until it is released."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = []
+        self.finished = []
+
+    async def __call__(self, *args, **kwargs):
+        return SlowProcess(self, args, kwargs)
+
+
+class SlowProcess(object):
+
+    def __init__(self, exec_, args, kwargs):
+        self.exec_ = exec_
+        self.args = list(args)
+        self.kwargs = kwargs
+
+        with open(kwargs['env']['GWH_EVENT_FILE'], 'r') as f:
+            self.event = f.read()
+
+        exec_.started.append(self)
+
+    async def wait(self):
+        await self.exec_.release.wait()
+        self.exec_.finished.append(self)
+        return 0
+
+
+class TestAsgiAsyncExecution(AsgiMixin, base.TestCase):
+
+    def setUp(self):
+        super(TestAsgiAsyncExecution, self).setUp()
+
+        self.handlers = []
+        self.useFixture(fixtures.MockPatch(handler_func,
+                                           new=lambda config: self.handlers))
+
+        self.exec_ = SlowExec()
+        self.useFixture(fixtures.MockPatch(exec_func, new=self.exec_))
+
+        self.config = {'execution': 'async',
+                       'action_workers': 2,
+                       'action_queue_size': 4}
+
+    def get_executor(self):
+        return asgi.get_executor(self.config)
+
+    def wait_started(self, count):
+        for _ in range(500):
+            if len(self.exec_.started) >= count:
+                break
+
+            self.run_async(asyncio.sleep(0.01))
+
+        self.assertEqual(count, len(self.exec_.started))
+
+    def finish(self):
+        self.exec_.release.set()
+        self.run_async(asyncio.wait_for(self.get_executor().join(), 10))
+
+    def test_returns_before_action_completes(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh'}]
+
+        resp = self.push(config=self.config, status=202)
+
+        self.assertEqual({'queued': 1}, resp.json)
+        self.wait_started(1)
+        self.assertEqual([], self.exec_.finished)
+
+        self.finish()
+
+        self.assertEqual(1, len(self.exec_.finished))
+        self.assertEqual(['./slow.sh'], self.exec_.finished[0].args)
+
+    def test_worker_limit(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(2)
+
+        self.assertEqual({'pending': 1, 'running': 2, 'coalesced': 0},
+                         self.get_executor().stats())
+
+        self.finish()
+        self.assertEqual(3, len(self.exec_.finished))
+
+    def test_queue_full(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        self.push(config=self.config, status=202)
+        self.push(config=self.config, status=202)
+
+        # 2 of the jobs are running and 4 queued so there is no space
+        self.push(config=self.config, status=503)
+
+        self.finish()
+        self.assertEqual(6, len(self.exec_.finished))
+
+    def test_no_actions(self):
+        self.handlers = [{'repo': self.REPO_NAME}]
+
+        self.push(config=self.config, status=200)
+
+    def test_coalesce_pushes(self):
+        self.get_executor().workers = 1
+        self.handlers = [{'repo': self.REPO_NAME,
+                          'action': './slow.sh',
+                          'coalesce': True}]
+
+        self.push(config=self.config, status=202)
+
+        for after in ('a' * 40, 'b' * 40, 'c' * 40):
+            self.push(config=self.config, after=after, status=202)
+
+        self.assertEqual({'pending': 1, 'running': 1, 'coalesced': 2},
+                         self.get_executor().stats())
+
+        self.finish()
+
+        self.assertEqual(2, len(self.exec_.finished))
+        event = json.loads(self.exec_.finished[1].event)
+        self.assertEqual('c' * 40, event['after'])
+
+    def test_max_in_flight(self):
+        self.handlers = [{'repo': ['test/repo', 'test/other'],
+                          'action': './slow.sh',
+                          'max_in_flight': 1}]
+
+        self.push(config=self.config, status=202)
+        self.push(config=self.config, status=202)
+        self.push({'repository': {'full_name': 'test/other'}},
+                  config=self.config,
+                  status=202)
+
+        self.wait_started(2)
+        self.assertEqual({'pending': 1, 'running': 2, 'coalesced': 0},
+                         self.get_executor().stats())
+
+        self.finish()
+        self.assertEqual(3, len(self.exec_.finished))
+
+    def test_node_limit_with_small_thread_pool(self):
+        # waiting for a slot mustn't hold the threads that running jobs need
+        # to clean up and release theirs
+        pool = concurrent.futures.ThreadPoolExecutor(2)
+        self.addCleanup(pool.shutdown)
+        self.loop.set_default_executor(pool)
+
+        self.config['action_workers'] = 4
+        self.config['action_limit'] = 1
+        self.config['action_limit_dir'] = self.useFixture(
+            fixtures.TempDir()).path
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(1)
+
+        self.finish()
+        self.assertEqual(3, len(self.exec_.finished))
+
+    def test_resume_from_spool(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                            'spool.db')
+        events = spool.Spool(path)
+        self.addCleanup(events.close)
+        events.record('push', b'{}', [{'action': './slow.sh'}])
+
+        self.config['spool'] = path
+        self.exec_.release.set()
+
+        # shutting down waits for the resumed job to finish
+        self.lifespan(asgi.Application(self.config))
+
+        self.assertEqual(1, len(self.exec_.finished))
+        self.assertEqual([], events.pending())
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+import fixtures
+
+from github_webhook_handler import batch
+from github_webhook_handler import cloner
+from github_webhook_handler import mirror
+from github_webhook_handler.tests import test_cloner
+
+
+class TestBatch(test_cloner.ClonerTestCase):
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.output_dir = os.path.join(self.tmpdir, 'out')
+
+        self.first = self.commit({'a': '1'})
+        self.second = self.commit({'a': '2'})
+
+    def named(self, event, full_name):
+        event['repository']['full_name'] = full_name
+        return event
+
+    def events(self):
+        return [self.named(self.event(self.first), 'org/one'),
+                self.named(self.event(self.second), 'org/one'),
+                self.named(self.event(), 'org/one'),
+                self.named(self.event(self.first), 'org/two')]
+
+    def test_load_events(self):
+        jsonl = os.path.join(self.tmpdir, 'events.jsonl')
+        events_dir = os.path.join(self.tmpdir, 'events')
+        os.mkdir(events_dir)
+
+        with open(jsonl, 'w') as f:
+            for i, event in enumerate(self.events()):
+                f.write(json.dumps(event) + '\n\n')
+
+                with open(os.path.join(events_dir, '%d.json' % i), 'w') as e:
+                    json.dump(event, e)
+
+        self.assertEqual(self.events(), batch.load_events(jsonl))
+        self.assertEqual(self.events(), batch.load_events(events_dir))
+
+    def test_group_events(self):
+        self.assertEqual({'org/one': [0, 1, 2], 'org/two': [3]},
+                         batch.group_events(self.events()))
+
+    def test_run(self):
+        results = batch.run(self.events(), self.output_dir, self.cache_dir,
+                            jobs=2)
+
+        self.assertEqual([0, 1, 2, 3], [r['index'] for r in results])
+        self.assertEqual([self.first, self.second, self.second, self.first],
+                         [r['after'] for r in results])
+
+        for result in results:
+            self.assertNotIn('error', result)
+
+        self.assertEqual('1', self.read(results[0]['output_dir'], 'a'))
+        self.assertEqual('2', self.read(results[2]['output_dir'], 'a'))
+
+        # every repository was only fetched by the batch, not each clone
+        for full_name in ('org/one', 'org/two'):
+            cache = mirror.Mirror(self.cache_dir, full_name)
+            self.assertEqual(1, len(cache._read_fetched()))
+
+    def test_failed_fetch(self):
+        events = self.events()
+        events.append(self.named(self.event(self.first,
+                                            url='/does/not/exist'),
+                                 'org/missing'))
+
+        results = batch.run(events, self.output_dir, self.cache_dir,
+                            jobs=2, worktree=True)
+
+        self.assertEqual([False] * 4 + [True],
+                         ['error' in r for r in results])
+
+    def test_cloner_subcommand(self):
+        jsonl = os.path.join(self.tmpdir, 'events.jsonl')
+
+        with open(jsonl, 'w') as f:
+            for event in self.events():
+                f.write(json.dumps(event) + '\n')
+
+        summary = self.useFixture(fixtures.MockPatch(
+            'github_webhook_handler.batch.print_summary')).mock
+        status = cloner.main(['batch', '-j', '2', '-o', self.output_dir,
+                              jsonl])
+
+        self.assertEqual(0, status)
+        self.assertEqual(4, len(summary.call_args[0][0]))
+        self.assertTrue(os.path.isdir(os.path.join(self.output_dir,
+                                                   '.cache', 'org',
+                                                   'one.git')))
@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import ipaddress
+
+from github_webhook_handler import application
+from github_webhook_handler import cidr
+from github_webhook_handler.tests import base
+
+
+class TestNetworkIndex(base.TestCase):
+
+    def test_ipv4(self):
+        index = cidr.NetworkIndex(['192.30.252.0/22', '10.0.0.0/8'])
+
+        self.assertIn('192.30.252.0', index)
+        self.assertIn('192.30.255.255', index)
+        self.assertIn('10.1.2.3', index)
+        self.assertNotIn('192.30.251.255', index)
+        self.assertNotIn('192.31.0.0', index)
+        self.assertNotIn('9.255.255.255', index)
+
+    def test_ipv6(self):
+        index = cidr.NetworkIndex(['2a0a:a440::/29', '192.30.252.0/22'])
+
+        self.assertIn('2a0a:a440::1', index)
+        self.assertIn('2a0a:a447:ffff::1', index)
+        self.assertNotIn('2a0a:a448::', index)
+        self.assertNotIn('::1', index)
+
+    def test_ipv4_mapped(self):
+        index = cidr.NetworkIndex(['192.30.252.0/22'])
+
+        self.assertIn('::ffff:192.30.252.10', index)
+        self.assertNotIn('::ffff:10.0.0.1', index)
+
+    def test_address_objects(self):
+        index = cidr.NetworkIndex(['192.30.252.0/22'])
+
+        self.assertIn(ipaddress.ip_address(u'192.30.252.1'), index)
+        self.assertNotIn(ipaddress.ip_address(u'192.30.248.1'), index)
+
+    def test_merges_overlapping(self):
+        index = cidr.NetworkIndex(['10.0.0.0/24',
+                                   '10.0.0.128/25',
+                                   '10.0.1.0/24',
+                                   '10.0.3.0/24'])
+
+        self.assertEqual(2, len(index))
+        self.assertIn('10.0.1.255', index)
+        self.assertNotIn('10.0.2.0', index)
+        self.assertIn('10.0.3.0', index)
+
+    def test_host_bits(self):
+        index = cidr.NetworkIndex(['10.0.0.1/24', '172.16.0.1'])
+
+        self.assertIn('10.0.0.200', index)
+        self.assertIn('172.16.0.1', index)
+        self.assertNotIn('172.16.0.2', index)
+
+    def test_empty(self):
+        index = cidr.NetworkIndex()
+
+        self.assertEqual(0, len(index))
+        self.assertNotIn('10.0.0.1', index)
+        self.assertNotIn('::1', index)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, cidr.NetworkIndex, ['10.0.0.0/33'])
+
+    def test_application_allowed_networks(self):
+        self.requests_mock.get(application.GITHUB_META_URL,
+                               json={'hooks': ['192.30.252.0/22']})
+
+        config = {'allowed_networks': ['10.0.0.0/8']}
+        app = self.create_app(config=config, full_application=True)
+
+        app.post('/', extra_environ={'REMOTE_ADDR': '192.168.0.5'}, status=403)
+
+        for addr in ('10.0.0.1', '192.30.252.88'):
+            app.post_json('/',
+                          {'repository': {'full_name': 'app/test'}},
+                          extra_environ={'REMOTE_ADDR': addr})
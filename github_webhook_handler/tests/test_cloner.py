@@ -0,0 +1,438 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import threading
+
+import fixtures
+import git
+
+from github_webhook_handler import cloner
+from github_webhook_handler import mirror
+from github_webhook_handler import worktree
+from github_webhook_handler.tests import base
+
+
+class ClonerTestCase(base.TestCase):
+    """Clone from a local repository standing in for GitHub."""
+
+    def setUp(self):
+        super(ClonerTestCase, self).setUp()
+        self.useFixture(fixtures.EnvironmentVariable('GIT_AUTHOR_NAME', 'a'))
+        self.useFixture(fixtures.EnvironmentVariable('GIT_AUTHOR_EMAIL',
+                                                     'a@example.com'))
+        self.useFixture(fixtures.EnvironmentVariable('GIT_COMMITTER_NAME',
+                                                     'a'))
+        self.useFixture(fixtures.EnvironmentVariable('GIT_COMMITTER_EMAIL',
+                                                     'a@example.com'))
+
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.upstream_dir = os.path.join(self.tmpdir, 'upstream')
+        self.upstream = git.Repo.init(self.upstream_dir)
+
+        with self.upstream.config_writer() as config:
+            config.set_value('uploadpack', 'allowFilter', True)
+
+    def commit(self, files):
+        for name, content in files.items():
+            path = os.path.join(self.upstream_dir, name)
+
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            with open(path, 'w') as f:
+                f.write(content)
+
+            self.upstream.index.add([path])
+
+        return self.upstream.index.commit('update').hexsha
+
+    def event(self, after=None, url=None):
+        return {'ref': 'refs/heads/master',
+                'after': after,
+                'repository': {'full_name': self.REPO_NAME,
+                               'clone_url': url or self.upstream_dir}}
+
+    def read(self, path, name):
+        with open(os.path.join(path, name)) as f:
+            return f.read()
+
+
+class TestClone(ClonerTestCase):
+
+    def setUp(self):
+        super(TestClone, self).setUp()
+        self.fetch = self.useFixture(fixtures.MockPatchObject(
+            git.Remote, 'fetch', autospec=True,
+            side_effect=git.Remote.fetch)).mock
+
+    def test_cached_fetches_once(self):
+        sha = self.commit({'a': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        cloner.clone(self.event(sha), output_dir, cache_dir=self.cache_dir)
+
+        repo = git.Repo(output_dir)
+        self.assertEqual(sha, repo.head.commit.hexsha)
+        self.assertEqual(self.upstream_dir, repo.remotes.origin.url)
+        self.assertEqual(1, self.fetch.call_count)
+        self.assertFalse(os.path.exists(os.path.join(
+            repo.git_dir, 'objects', 'info', 'alternates')))
+
+    def test_cached_shared(self):
+        sha = self.commit({'a': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        cloner.clone(self.event(sha), output_dir,
+                     cache_dir=self.cache_dir,
+                     shared=True)
+
+        repo = git.Repo(output_dir)
+        self.assertEqual('1', self.read(output_dir, 'a'))
+        self.assertTrue(os.path.exists(os.path.join(
+            repo.git_dir, 'objects', 'info', 'alternates')))
+
+    def test_cached_default_branch(self):
+        sha = self.commit({'a': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        cloner.clone(self.event(), output_dir, cache_dir=self.cache_dir)
+
+        repo = git.Repo(output_dir)
+        self.assertEqual(sha, repo.head.commit.hexsha)
+        self.assertEqual('origin/master',
+                         repo.heads.master.tracking_branch().name)
+
+    def test_uncached(self):
+        sha = self.commit({'a': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        cloner.clone(self.event(sha), output_dir)
+
+        self.assertEqual(sha, git.Repo(output_dir).head.commit.hexsha)
+
+
+class TestCloneOptions(ClonerTestCase):
+
+    def setUp(self):
+        super(TestCloneOptions, self).setUp()
+        # shallow and partial fetches are ignored for plain paths
+        self.url = 'file://' + self.upstream_dir
+        self.first = self.commit({'a/x': '1', 'b/y': '1', 'top': '1'})
+        self.second = self.commit({'a/x': '2', 'b/y': '2'})
+        self.output_dir = os.path.join(self.tmpdir, 'out')
+
+    def cloned(self):
+        repo = git.Repo(self.output_dir)
+        return repo, repo.git.rev_list('--count', 'HEAD')
+
+    def test_depth(self):
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     depth=1)
+
+        repo, count = self.cloned()
+        self.assertEqual(self.second, repo.head.commit.hexsha)
+        self.assertEqual('1', count)
+
+    def test_depth_cached(self):
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     depth=1)
+
+        repo, count = self.cloned()
+        self.assertEqual(self.second, repo.head.commit.hexsha)
+        self.assertEqual('1', count)
+
+    def test_depth_unreachable(self):
+        # the branch has moved on since the event of the first commit
+        cloner.clone(self.event(self.first, url=self.url), self.output_dir,
+                     depth=1)
+
+        repo, _ = self.cloned()
+        self.assertEqual(self.first, repo.head.commit.hexsha)
+        self.assertEqual('1', self.read(self.output_dir, 'a/x'))
+
+    def test_depth_unreachable_cached(self):
+        cloner.clone(self.event(self.first, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     depth=1)
+
+        repo, _ = self.cloned()
+        self.assertEqual(self.first, repo.head.commit.hexsha)
+
+    def test_filter(self):
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     filter_spec='blob:none')
+
+        repo, count = self.cloned()
+        self.assertEqual('2', count)
+        self.assertEqual('2', self.read(self.output_dir, 'a/x'))
+        self.assertEqual('blob:none', repo.git.config(
+            'remote.origin.partialclonefilter'))
+
+    def test_filter_cached(self):
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     filter_spec='tree:0',
+                     depth=1)
+
+        repo, count = self.cloned()
+        self.assertEqual(self.second, repo.head.commit.hexsha)
+        self.assertEqual('1', count)
+        self.assertEqual('2', self.read(self.output_dir, 'b/y'))
+        self.assertEqual(self.url, repo.remotes.origin.url)
+
+    def test_full_after_depth_cached(self):
+        # the mirror shared with a shallow handler must not truncate a clone
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     depth=1)
+        shutil.rmtree(self.output_dir)
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir)
+
+        repo, count = self.cloned()
+        self.assertEqual(self.second, repo.head.commit.hexsha)
+        self.assertEqual('2', count)
+
+    def test_full_after_filter_cached(self):
+        git.Repo(self.upstream_dir).git.config('uploadpack.allowFilter',
+                                               'true')
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     filter_spec='blob:none')
+        shutil.rmtree(self.output_dir)
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir)
+
+        repo, count = self.cloned()
+        self.assertEqual('2', count)
+        self.assertEqual('1', self.read(self.output_dir, 'top'))
+        self.assertRaises(git.GitCommandError, repo.git.config,
+                          'remote.origin.partialclonefilter')
+        self.assertFalse(mirror.partial_filter(
+            mirror.Mirror(self.cache_dir, self.REPO_NAME).repo))
+
+    def test_depth_after_full_cached(self):
+        # a complete mirror isn't made shallow again
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir)
+        shutil.rmtree(self.output_dir)
+        third = self.commit({'a/x': '3'})
+        cloner.clone(self.event(third, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     depth=1)
+
+        self.assertFalse(mirror.is_shallow(
+            mirror.Mirror(self.cache_dir, self.REPO_NAME).repo))
+
+    def test_sparse(self):
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     sparse=['a'])
+
+        self.assertEqual('2', self.read(self.output_dir, 'a/x'))
+        self.assertEqual('1', self.read(self.output_dir, 'top'))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'b')))
+
+    def test_sparse_cached(self):
+        cloner.clone(self.event(self.second, url=self.url), self.output_dir,
+                     cache_dir=self.cache_dir,
+                     filter_spec='blob:none',
+                     sparse=['b'])
+
+        self.assertEqual('2', self.read(self.output_dir, 'b/y'))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'a')))
+
+    def test_sparse_worktree(self):
+        cloner.clone_worktree(self.event(self.second, url=self.url),
+                              self.output_dir, self.cache_dir,
+                              depth=1, sparse=['a'])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'b')))
+
+        # the next checkout into the same worktree isn't sparse
+        cloner.clone_worktree(self.event(self.second, url=self.url),
+                              self.output_dir, self.cache_dir)
+        self.assertEqual('2', self.read(self.output_dir, 'b/y'))
+
+    def test_main(self):
+        event_file = os.path.join(self.tmpdir, 'event.json')
+
+        with open(event_file, 'w') as f:
+            json.dump(self.event(self.second, url=self.url), f)
+
+        cloner.main(['-o', self.output_dir, '--depth', '1',
+                     '--sparse', 'a', event_file])
+
+        repo, count = self.cloned()
+        self.assertEqual('1', count)
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, 'b')))
+
+
+class TestWorktree(ClonerTestCase):
+
+    def test_checkout_and_reuse(self):
+        first = self.commit({'a': '1', 'b': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        repo = cloner.clone_worktree(self.event(first), output_dir,
+                                     self.cache_dir)
+        self.assertEqual(first, repo.head.commit.hexsha)
+        self.assertEqual('1', self.read(output_dir, 'a'))
+
+        # untracked files left behind by the last action are removed
+        with open(os.path.join(output_dir, 'junk'), 'w') as f:
+            f.write('junk')
+
+        second = self.commit({'a': '2'})
+        repo = cloner.clone_worktree(self.event(second), output_dir,
+                                     self.cache_dir)
+        self.assertEqual(second, repo.head.commit.hexsha)
+        self.assertEqual('2', self.read(output_dir, 'a'))
+        self.assertFalse(os.path.exists(os.path.join(output_dir, 'junk')))
+
+    def test_default_branch_head(self):
+        sha = self.commit({'a': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        repo = cloner.clone_worktree(self.event(), output_dir, self.cache_dir)
+        self.assertEqual(sha, repo.head.commit.hexsha)
+
+    def test_release_and_take_from_pool(self):
+        first = self.commit({'a': '1'})
+        out1 = os.path.join(self.tmpdir, 'out1')
+        out2 = os.path.join(self.tmpdir, 'out2')
+
+        cloner.clone_worktree(self.event(first), out1, self.cache_dir)
+        cloner.release_worktree(self.event(), out1, self.cache_dir)
+        self.assertFalse(os.path.exists(out1))
+
+        cache = mirror.Mirror(self.cache_dir, self.REPO_NAME)
+        pool = worktree.WorktreePool.for_mirror(cache)
+        spares = pool.spares()
+        self.assertEqual(1, len(spares))
+
+        second = self.commit({'a': '2'})
+        cloner.clone_worktree(self.event(second), out2, self.cache_dir)
+        self.assertEqual('2', self.read(out2, 'a'))
+        self.assertEqual([], pool.spares())
+        self.assertFalse(os.path.exists(spares[0]))
+
+    def test_release_full_pool_removes(self):
+        sha = self.commit({'a': '1'})
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        cloner.clone_worktree(self.event(sha), output_dir, self.cache_dir,
+                              pool_size=0)
+        cloner.release_worktree(self.event(), output_dir, self.cache_dir,
+                                pool_size=0)
+
+        repo = mirror.Mirror(self.cache_dir, self.REPO_NAME).repo
+        self.assertEqual([os.path.realpath(repo.git_dir)],
+                         worktree.list_worktrees(repo))
+
+    def test_prune(self):
+        sha = self.commit({'a': '1'})
+        cache = mirror.Mirror(self.cache_dir, self.REPO_NAME)
+        repo = cache.fetch(self.upstream_dir,
+                           refspec='+refs/heads/master:refs/heads/master')
+
+        pool = worktree.WorktreePool.for_mirror(cache, size=3)
+        pool.fill(sha)
+        self.assertEqual(3, len(pool.spares()))
+
+        in_use = os.path.join(self.tmpdir, 'in-use')
+        pool.checkout(in_use, sha)
+        stale = os.path.join(pool.pool_dir, 'stale')
+        os.mkdir(stale)
+
+        pool.size = 1
+        pool.prune()
+
+        self.assertEqual(1, len(pool.spares()))
+        self.assertFalse(os.path.exists(stale))
+        self.assertIn(os.path.realpath(in_use),
+                      worktree.list_worktrees(repo))
+
+
+class TestConcurrency(ClonerTestCase):
+
+    def setUp(self):
+        super(TestConcurrency, self).setUp()
+        self.fetch = self.useFixture(fixtures.MockPatchObject(
+            git.Remote, 'fetch', autospec=True,
+            side_effect=git.Remote.fetch)).mock
+
+    def run_parallel(self, count, target):
+        errors = []
+
+        def run(i):
+            try:
+                target(i)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(count)]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        self.assertEqual([], errors)
+
+    def test_parallel_worktrees_fetch_once(self):
+        sha = self.commit({'a': '1'})
+        outputs = [os.path.join(self.tmpdir, 'out%d' % i) for i in range(16)]
+
+        self.run_parallel(len(outputs), lambda i: cloner.clone_worktree(
+            self.event(sha), outputs[i], self.cache_dir))
+
+        self.assertEqual(1, self.fetch.call_count)
+
+        for output_dir in outputs:
+            self.assertEqual(sha, git.Repo(output_dir).head.commit.hexsha)
+
+    def test_parallel_clones(self):
+        sha = self.commit({'a': '1'})
+        outputs = [os.path.join(self.tmpdir, 'out%d' % i) for i in range(8)]
+
+        def target(i):
+            if i % 2:
+                cloner.clone_worktree(self.event(sha), outputs[i],
+                                      self.cache_dir)
+            else:
+                cloner.clone(self.event(sha), outputs[i],
+                             cache_dir=self.cache_dir)
+
+        self.run_parallel(len(outputs), target)
+
+        for output_dir in outputs:
+            self.assertEqual('1', self.read(output_dir, 'a'))
+
+        cache = mirror.Mirror(self.cache_dir, self.REPO_NAME)
+        self.assertEqual(self.upstream_dir, cache.repo.remotes.origin.url)
+
+    def test_fetch_without_commit(self):
+        self.commit({'a': '1'})
+        cache = mirror.Mirror(self.cache_dir, self.REPO_NAME)
+
+        cache.fetch(self.upstream_dir, refspec='refs/heads/master')
+        sha = self.commit({'a': '2'})
+        repo = cache.fetch(self.upstream_dir, refspec='refs/heads/master')
+
+        self.assertEqual(2, self.fetch.call_count)
+        self.assertTrue(mirror.has_commit(repo, sha))
@@ -0,0 +1,195 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import uuid
+
+import fixtures
+
+from github_webhook_handler import dedup
+from github_webhook_handler.tests import base
+
+handler_func = 'github_webhook_handler.handler._handlers_from_file'
+
+
+class DeliveryCacheTests(object):
+
+    def test_duplicate(self):
+        cache = self.create()
+
+        self.assertTrue(cache.add('a'))
+        self.assertTrue(cache.add('b'))
+        self.assertFalse(cache.add('a'))
+        self.assertFalse(cache.add('b'))
+
+    def test_expiry(self):
+        cache = self.create(ttl=60)
+
+        self.assertTrue(cache.add('a'))
+        self.clock.now += 30
+        self.assertFalse(cache.add('a'))
+        self.clock.now += 30
+        self.assertTrue(cache.add('a'))
+
+    def test_discard(self):
+        cache = self.create()
+
+        cache.add('a')
+        cache.discard('a')
+        cache.discard('b')
+
+        self.assertTrue(cache.add('a'))
+
+    def test_bounded(self):
+        cache = self.create(size=10)
+
+        ids = [uuid.uuid4().hex for _ in range(1000)]
+
+        for delivery_id in ids:
+            self.assertTrue(cache.add(delivery_id))
+
+        # the most recent are always remembered
+        self.assertFalse(cache.add(ids[-1]))
+
+
+class TestDeliveryCache(DeliveryCacheTests, base.TestCase):
+
+    def setUp(self):
+        super(TestDeliveryCache, self).setUp()
+        self.clock = base.FakeClock()
+
+    def create(self, size=100, ttl=3600):
+        return dedup.DeliveryCache(maxsize=size, ttl=ttl, clock=self.clock)
+
+    def test_oldest_dropped(self):
+        cache = self.create(size=2)
+
+        cache.add('a')
+        cache.add('b')
+        cache.add('c')
+
+        self.assertEqual(['b', 'c'], list(cache._seen))
+        self.assertTrue(cache.add('a'))
+
+
+class TestFileDeliveryCache(DeliveryCacheTests, base.TestCase):
+
+    def setUp(self):
+        super(TestFileDeliveryCache, self).setUp()
+        self.clock = base.FakeClock()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmpdir, 'deliveries')
+
+    def create(self, size=100, ttl=3600):
+        cache = dedup.FileDeliveryCache(self.path,
+                                        slots=size,
+                                        ttl=ttl,
+                                        clock=self.clock)
+        self.addCleanup(cache.close)
+        return cache
+
+    def test_shared(self):
+        first = self.create()
+        second = self.create()
+
+        self.assertTrue(first.add('a'))
+        self.assertFalse(second.add('a'))
+        self.assertTrue(second.add('b'))
+        self.assertFalse(first.add('b'))
+
+    def test_fixed_size(self):
+        cache = self.create(size=10)
+
+        for _ in range(100):
+            cache.add(uuid.uuid4().hex)
+
+        self.assertEqual(10 * cache.SLOT.size, os.path.getsize(self.path))
+
+
+class TestDeduplication(base.TestCase):
+
+    def setUp(self):
+        super(TestDeduplication, self).setUp()
+
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './run.sh'}]
+        self.useFixture(fixtures.MockPatch(handler_func,
+                                           new=lambda config: self.handlers))
+        self.fake_popen = self.useFixture(fixtures.FakePopen())
+
+    def delivery(self, delivery_id=None, **kwargs):
+        headers = kwargs.setdefault('headers', {})
+        headers['X-GitHub-Delivery'] = delivery_id or uuid.uuid4().hex
+        return self.push(**kwargs)
+
+    def test_duplicate_skipped(self):
+        config = {}
+        delivery_id = uuid.uuid4().hex
+
+        self.delivery(delivery_id, config=config)
+        resp = self.delivery(delivery_id, config=config)
+        self.delivery(config=config)
+
+        self.assertEqual({'duplicate': True}, resp.json)
+        self.assertEqual(2, len(self.fake_popen.procs))
+
+    def test_no_delivery_header(self):
+        config = {}
+
+        self.push(config=config)
+        self.push(config=config)
+
+        self.assertEqual(2, len(self.fake_popen.procs))
+
+    def test_disabled(self):
+        config = {'delivery_cache_size': 0}
+        delivery_id = uuid.uuid4().hex
+
+        self.delivery(delivery_id, config=config)
+        self.delivery(delivery_id, config=config)
+
+        self.assertEqual(2, len(self.fake_popen.procs))
+
+    def test_failed_delivery_can_be_retried(self):
+        config = {}
+        delivery_id = uuid.uuid4().hex
+
+        self.handlers[0]['key'] = 'secret'
+        self.handlers.append({'repo': self.REPO_NAME})
+
+        # the keyless handler lets the unsigned request past verification
+        # but the keyed handler then rejects it
+        self.delivery(delivery_id, config=config, status=403)
+
+        self.handlers.pop()
+        self.delivery(delivery_id, config=config, key='secret')
+
+        self.assertEqual(1, len(self.fake_popen.procs))
+
+    def test_bad_signature_not_recorded(self):
+        config = {}
+        delivery_id = uuid.uuid4().hex
+
+        self.handlers[0]['key'] = 'secret'
+
+        self.delivery(delivery_id, config=config, key='wrong', status=403)
+        self.delivery(delivery_id, config=config, key='secret')
+
+        self.assertEqual(1, len(self.fake_popen.procs))
+
+    def test_shared_file(self):
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'ids')
+        delivery_id = uuid.uuid4().hex
+
+        self.delivery(delivery_id, config={'delivery_cache_file': path})
+        self.delivery(delivery_id, config={'delivery_cache_file': path})
+
+        self.assertEqual(1, len(self.fake_popen.procs))
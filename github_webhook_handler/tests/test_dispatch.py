@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from github_webhook_handler import dispatch
+from github_webhook_handler.tests import base
+
+
+class TestHandlerSet(base.TestCase):
+
+    def test_exact(self):
+        a = {'repo': 'org/a'}
+        b = {'repo': ['org/b', 'org/c'], 'type': ['push', 'ping']}
+        handlers = dispatch.HandlerSet([a, b])
+
+        self.assertEqual([a], handlers.candidates('push', 'org/a'))
+        self.assertEqual([b], handlers.candidates('push', 'org/c'))
+        self.assertEqual([b], handlers.candidates('ping', 'org/b'))
+        self.assertEqual([], handlers.candidates('ping', 'org/a'))
+        self.assertEqual([], handlers.candidates('push', 'org/d'))
+        self.assertEqual([], handlers.candidates('push', None))
+
+    def test_default_type_is_push(self):
+        a = {'repo': 'org/a'}
+        handlers = dispatch.HandlerSet([a])
+
+        self.assertEqual([a], handlers.candidates('push', 'org/a'))
+        self.assertEqual([], handlers.candidates('pull_request', 'org/a'))
+
+    def test_no_repo_never_matches(self):
+        handlers = dispatch.HandlerSet([{'type': 'push'}])
+
+        self.assertEqual([], handlers.candidates('push', 'org/a'))
+
+    def test_wildcard(self):
+        org = {'repo': 'org/*'}
+        other = {'repo': 'other/*'}
+        everything = {'repo': '*', 'type': 'ping'}
+        handlers = dispatch.HandlerSet([org, other, everything])
+
+        self.assertEqual([org], handlers.candidates('push', 'org/a'))
+        self.assertEqual([other], handlers.candidates('push', 'other/b'))
+        self.assertEqual([], handlers.candidates('push', 'organisation/a'))
+        self.assertEqual([everything], handlers.candidates('ping', 'x/y'))
+
+    def test_order_preserved(self):
+        first = {'repo': 'org/*'}
+        second = {'repo': 'org/a'}
+        third = {'repo': ['org/a', 'org/*']}
+        fourth = {'repo': 'o*'}
+        handlers = dispatch.HandlerSet([first, second, third, fourth])
+
+        self.assertEqual([first, second, third, fourth],
+                         handlers.candidates('push', 'org/a'))
+        self.assertEqual([first, third, fourth],
+                         handlers.candidates('push', 'org/b'))
+
+    def test_duplicate_repo(self):
+        a = {'repo': ['org/a', 'org/a']}
+        handlers = dispatch.HandlerSet([a])
+
+        self.assertEqual([a], handlers.candidates('push', 'org/a'))
+
+    def test_iterate(self):
+        a = {'repo': 'org/a'}
+        b = {'repo': 'org/b'}
+        handlers = dispatch.HandlerSet([a, b])
+
+        self.assertEqual([a, b], list(handlers))
+        self.assertEqual(2, len(handlers))
+
+    def test_handler_set(self):
+        handlers = dispatch.HandlerSet([])
+
+        self.assertIs(handlers, dispatch.handler_set(handlers))
+        self.assertIsInstance(dispatch.handler_set(None), dispatch.HandlerSet)
+        self.assertIsInstance(dispatch.handler_set([{'repo': 'org/a'}]),
+                              dispatch.HandlerSet)
+
+    def test_repo_matches(self):
+        self.assertTrue(dispatch.repo_matches('org/a', 'org/a'))
+        self.assertTrue(dispatch.repo_matches('org/*', 'org/a'))
+        self.assertTrue(dispatch.repo_matches('*', 'org/a'))
+        self.assertFalse(dispatch.repo_matches('org/a', 'org/b'))
+        self.assertFalse(dispatch.repo_matches('org/*', 'other/a'))
+        self.assertFalse(dispatch.repo_matches('*', None))
@@ -0,0 +1,284 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import copy
+import json
+import os
+import threading
+import time
+
+import fixtures
+
+from github_webhook_handler import executor
+from github_webhook_handler.tests import base
+
+handler_func = 'github_webhook_handler.handler._handlers_from_file'
+
+
+class SlowPopen(object):
+    """A fake Popen whose process runs until the test releases it."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+        self.finished = []
+        self.lock = threading.Lock()
+
+    def __call__(self, args, **kwargs):
+        return SlowProcess(self, args, kwargs)
+
+
+class SlowProcess(object):
+
+    def __init__(self, popen, args, kwargs):
+        self.popen = popen
+        self.args = args
+        self.kwargs = kwargs
+        self.returncode = None
+
+        with popen.lock:
+            popen.started.append(self)
+
+    def communicate(self, input=None):
+        with open(self.kwargs['env']['GWH_EVENT_FILE'], 'r') as f:
+            self.event = f.read()
+
+        self.popen.release.wait(10)
+        self.returncode = 0
+
+        with self.popen.lock:
+            self.popen.finished.append(self)
+
+        return None, None
+
+
+class TestAsyncExecution(base.TestCase):
+
+    def setUp(self):
+        super(TestAsyncExecution, self).setUp()
+
+        self.handlers = []
+        self.useFixture(fixtures.MockPatch(handler_func,
+                                           new=lambda config: self.handlers))
+
+        self.popen = SlowPopen()
+        self.useFixture(fixtures.MockPatch(
+            'github_webhook_handler.executor.subprocess.Popen',
+            new=self.popen))
+
+        self.config = {'execution': 'async',
+                       'action_workers': 2,
+                       'action_queue_size': 4}
+
+        # stop the workers before the fake Popen is removed
+        self.addCleanup(self.get_executor().stop, 10)
+        self.addCleanup(self.popen.release.set)
+
+    def get_executor(self):
+        return executor.get_executor(self.config)
+
+    def wait_started(self, count):
+        for _ in range(500):
+            if len(self.popen.started) >= count:
+                break
+
+            time.sleep(0.01)
+
+        self.assertEqual(count, len(self.popen.started))
+
+    def test_returns_before_action_completes(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh'}]
+
+        start = time.time()
+        resp = self.push(config=self.config, status=202)
+        elapsed = time.time() - start
+
+        self.assertEqual({'queued': 1}, resp.json)
+        self.assertEqual([], self.popen.finished)
+        self.assertLess(elapsed, 5)
+
+        self.popen.release.set()
+        self.assertTrue(self.get_executor().join(10))
+
+        self.assertEqual(1, len(self.popen.finished))
+        self.assertEqual(['./slow.sh'], self.popen.finished[0].args)
+
+    def test_worker_limit(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        self.push(config=self.config, status=202)
+
+        ex = self.get_executor()
+        self.wait_started(2)
+
+        self.assertEqual({'pending': 1, 'running': 2, 'coalesced': 0},
+                         ex.stats())
+
+        self.popen.release.set()
+        self.assertTrue(ex.join(10))
+        self.assertEqual(3, len(self.popen.finished))
+
+    def test_queue_full(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(2)
+        self.push(config=self.config, status=202)
+
+        # 2 of the jobs are running and 4 queued so there is no space
+        self.push(config=self.config, status=503)
+
+        self.popen.release.set()
+        self.assertTrue(self.get_executor().join(10))
+        self.assertEqual(6, len(self.popen.finished))
+
+    def test_no_actions(self):
+        self.handlers = [{'repo': self.REPO_NAME}]
+
+        self.push(config=self.config, status=200)
+
+    def test_bad_signature_not_queued(self):
+        self.handlers = [{'repo': self.REPO_NAME,
+                          'key': 'secret',
+                          'action': './slow.sh'}]
+
+        self.push(config=self.config, key='wrong', status=403)
+        self.assertEqual({'pending': 0, 'running': 0, 'coalesced': 0},
+                         self.get_executor().stats())
+
+    def test_failed_action_doesnt_stop_worker(self):
+        ex = executor.Executor({}, workers=1, queue_size=2)
+        self.addCleanup(ex.stop, 10)
+
+        def fail(config, job):
+            if job.action == 'fail':
+                raise RuntimeError()
+
+        self.useFixture(fixtures.MockPatch(
+            'github_webhook_handler.executor.execute', side_effect=fail))
+
+        ex.submit([executor.Job({'action': 'fail'}, 'push', b'{}'),
+                   executor.Job({'action': 'ok'}, 'push', b'{}')])
+
+        self.assertTrue(ex.join(10))
+
+    def test_coalesce_pushes(self):
+        self.get_executor().workers = 1
+        self.handlers = [{'repo': self.REPO_NAME,
+                          'action': './slow.sh',
+                          'coalesce': True}]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(1)
+
+        # these are queued behind the first and collapse into the last
+        for after in ('a' * 40, 'b' * 40, 'c' * 40):
+            self.push(config=self.config, after=after, status=202)
+
+        # a push to another ref is kept
+        self.push(config=self.config, ref='refs/heads/other', status=202)
+
+        ex = self.get_executor()
+        self.assertEqual({'pending': 2, 'running': 1, 'coalesced': 2},
+                         ex.stats())
+
+        self.popen.release.set()
+        self.assertTrue(ex.join(10))
+
+        self.assertEqual(3, len(self.popen.finished))
+
+        event = json.loads(self.popen.finished[1].event)
+        self.assertEqual('c' * 40, event['after'])
+
+    def test_coalesce_across_reload(self):
+        self.get_executor().workers = 1
+        self.handlers = [{'repo': self.REPO_NAME,
+                          'action': './slow.sh',
+                          'key': 'secret',
+                          'coalesce': True}]
+
+        self.push(config=self.config, status=202, key='secret')
+        self.wait_started(1)
+        self.push(config=self.config, after='a' * 40, status=202,
+                  key='secret')
+
+        # the same handlers loaded again are new objects
+        self.handlers = copy.deepcopy(self.handlers)
+        self.push(config=self.config, after='b' * 40, status=202,
+                  key='secret')
+
+        ex = self.get_executor()
+        self.assertEqual({'pending': 1, 'running': 1, 'coalesced': 1},
+                         ex.stats())
+
+        self.popen.release.set()
+        self.assertTrue(ex.join(10))
+
+        event = json.loads(self.popen.finished[1].event)
+        self.assertEqual('b' * 40, event['after'])
+
+    def test_no_coalesce_by_default(self):
+        self.get_executor().workers = 1
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh'}]
+
+        for _ in range(3):
+            self.push(config=self.config, status=202)
+
+        self.popen.release.set()
+        self.assertTrue(self.get_executor().join(10))
+
+        self.assertEqual(3, len(self.popen.finished))
+        self.assertEqual(0, self.get_executor().stats()['coalesced'])
+
+    def test_max_in_flight(self):
+        self.handlers = [{'repo': ['test/repo', 'test/other'],
+                          'action': './slow.sh',
+                          'max_in_flight': 1}]
+
+        self.push(config=self.config, status=202)
+        self.push(config=self.config, status=202)
+        self.push({'repository': {'full_name': 'test/other'}},
+                  config=self.config,
+                  status=202)
+
+        # one job for each repo runs, the second for test/repo has to wait
+        self.wait_started(2)
+        time.sleep(0.05)
+
+        ex = self.get_executor()
+        self.assertEqual(2, len(self.popen.started))
+        self.assertEqual({'pending': 1, 'running': 2, 'coalesced': 0},
+                         ex.stats())
+
+        self.popen.release.set()
+        self.assertTrue(ex.join(10))
+        self.assertEqual(3, len(self.popen.finished))
+
+
+class TestActionEnv(base.TestCase):
+
+    def test_clone_options(self):
+        handler = {'clone': {'depth': 1,
+                             'filter': 'blob:none',
+                             'sparse': ['src', 'docs']}}
+        job = executor.Job(handler, 'push', b'{}')
+
+        env = executor.action_env({'cache_dir': '/cache'}, job)
+
+        self.assertEqual('/cache', env['GWH_CACHE_DIR'])
+        self.assertEqual('1', env['GWH_CLONE_DEPTH'])
+        self.assertEqual('blob:none', env['GWH_CLONE_FILTER'])
+        self.assertEqual(['src', 'docs'],
+                         env['GWH_CLONE_SPARSE'].split(os.pathsep))
+        self.assertNotIn('GWH_CLONE_WORKTREE', env)
@@ -0,0 +1,101 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from github_webhook_handler import dispatch
+from github_webhook_handler import filters
+from github_webhook_handler.tests import base
+
+
+class TestFilters(base.TestCase):
+
+    def match(self, value, event_value):
+        return filters.Filter('a.b', value)({'a': {'b': event_value}})
+
+    def test_get_path(self):
+        data = {'a': {'b': {'c': 'd'}, 'l': [1, 2]}}
+
+        self.assertEqual('d', filters.get_path(data, ('a', 'b', 'c')))
+        self.assertEqual({'c': 'd'}, filters.get_path(data, ('a', 'b')))
+        self.assertIsNone(filters.get_path(data, ('a', 'x', 'c')))
+        self.assertIsNone(filters.get_path(data, ('a', 'b', 'c', 'd')))
+        self.assertIsNone(filters.get_path(data, ('a', 'l', 'c')))
+        self.assertEqual('x', filters.get_path(data, ('z',), 'x'))
+
+    def test_exact(self):
+        self.assertTrue(self.match('d', 'd'))
+        self.assertFalse(self.match('d', 'e'))
+        self.assertFalse(self.match('d', None))
+
+    def test_exact_list(self):
+        self.assertTrue(self.match(['d', 'e'], 'e'))
+        self.assertFalse(self.match(['d', 'e'], 'f'))
+
+    def test_event_list(self):
+        self.assertTrue(self.match('bug', ['feature', 'bug']))
+        self.assertFalse(self.match('bug', ['feature']))
+        self.assertFalse(self.match('bug', []))
+
+    def test_unhashable_event_value(self):
+        self.assertFalse(self.match('d', {'c': 'd'}))
+        self.assertFalse(self.match('d*', {'c': 'd'}))
+
+    def test_glob(self):
+        self.assertTrue(self.match({'glob': 'refs/heads/release-*'},
+                                   'refs/heads/release-1.0'))
+        self.assertFalse(self.match({'glob': 'refs/heads/release-*'},
+                                    'refs/heads/master'))
+        self.assertTrue(self.match({'glob': 'v?.[0-9]'}, 'v1.2'))
+
+    def test_plain_value_not_a_glob(self):
+        self.assertTrue(self.match('feature/[wip]*', 'feature/[wip]*'))
+        self.assertFalse(self.match('feature/[wip]*', 'feature/w'))
+        self.assertFalse(self.match('release-?', 'release-1'))
+
+    def test_regex(self):
+        matcher = {'regex': r'refs/tags/v\d+$'}
+
+        self.assertTrue(self.match(matcher, 'refs/tags/v12'))
+        self.assertFalse(self.match(matcher, 'refs/tags/v1.2'))
+        self.assertFalse(self.match(matcher, 12))
+
+    def test_mixed(self):
+        matcher = ['refs/heads/master', {'glob': 'refs/heads/stable/*'},
+                   {'regex': 'refs/tags/.*'}]
+
+        self.assertTrue(self.match(matcher, 'refs/heads/master'))
+        self.assertTrue(self.match(matcher, 'refs/heads/stable/1.0'))
+        self.assertTrue(self.match(matcher, 'refs/tags/1.0'))
+        self.assertFalse(self.match(matcher, 'refs/heads/feature'))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, filters.compile_matcher,
+                          {'regex': '('})
+        self.assertRaises(ValueError, filters.compile_matcher,
+                          {'fuzzy': 'a'})
+        self.assertRaises(ValueError, filters.compile_matcher,
+                          {'glob': 'a', 'regex': 'b'})
+
+    def test_handler_set_match(self):
+        release = {'repo': 'org/*',
+                   'filter': {'ref': {'glob': 'refs/heads/rel-*'}}}
+        master = {'repo': 'org/a', 'filter': {'ref': 'refs/heads/master'}}
+        handlers = dispatch.HandlerSet([release, master])
+
+        def event(ref):
+            return {'ref': ref, 'repository': {'full_name': 'org/a'}}
+
+        self.assertEqual([release],
+                         handlers.match('push', event('refs/heads/rel-1')))
+        self.assertEqual([master],
+                         handlers.match('push', event('refs/heads/master')))
+        self.assertEqual([], handlers.match('push', event('refs/heads/x')))
+        self.assertEqual([], handlers.match('push', {}))
@@ -11,6 +11,8 @@
 # under the License.
 
 import fixtures
+import hmac
+import os
 import uuid
 
 from github_webhook_handler import application
@@ -138,6 +140,38 @@ class TestGithubWebhookHandler(base.TestCase):
         self.assertEqual('push', env['GWH_EVENT_TYPE'])
         self.assertEqual('event.json', env['GWH_EVENT_FILE'][-10:])
 
+    def test_event_file_shared(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'action': './run.sh %d' % i} for i in range(3)
+        ]
+
+        self.push()
+
+        event_files = set(p._args['env']['GWH_EVENT_FILE']
+                          for p in self.fake_popen.procs)
+
+        self.assertEqual(3, len(self.fake_popen.procs))
+        self.assertEqual(1, len(event_files))
+        self.assertFalse(os.path.exists(event_files.pop()))
+
+    def test_event_stdin(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'action': './run.sh stdin',
+             'event_stdin': True},
+            {'repo': self.REPO_NAME,
+             'action': './run.sh file'},
+        ]
+
+        self.push()
+
+        stdin = self.fake_popen.procs[0]._args['stdin']
+        env = self.fake_popen.procs[0]._args['env']
+
+        self.assertEqual(env['GWH_EVENT_FILE'], stdin.name)
+        self.assertIsNone(self.fake_popen.procs[1]._args['stdin'])
+
     def test_filter_stuff(self):
         self.handlers = [
             {'repo': self.REPO_NAME,
@@ -167,3 +201,175 @@ class TestGithubWebhookHandler(base.TestCase):
         self.push(data)
 
         self.assertEqual(0, len(self.fake_popen.procs))
+
+    def test_wildcard_repo(self):
+        self.handlers = [
+            {'repo': 'test/*',
+             'action': './run.sh org'},
+            {'repo': 'other/*',
+             'action': './run.sh other'},
+        ]
+
+        self.push()
+
+        self.assertEqual(1, len(self.fake_popen.procs))
+        args = self.fake_popen.procs[0]._args['args']
+        self.assertEqual(['./run.sh', 'org'], args)
+
+    def test_filter_glob(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'action': './run.sh release',
+             'filter': {'ref': {'glob': 'refs/heads/release-*'}}}
+        ]
+
+        self.push(ref='refs/heads/release-1.0')
+        self.push(ref='refs/heads/master')
+
+        self.assertEqual(1, len(self.fake_popen.procs))
+
+    def test_push_good_signature(self):
+        key = uuid.uuid4().hex
+
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'key': key,
+             'action': './run.sh job'}
+        ]
+
+        self.push(key=key)
+        self.push(key=key, algorithms=['sha256'])
+
+        self.assertEqual(2, len(self.fake_popen.procs))
+
+    def test_sha256_preferred(self):
+        key = uuid.uuid4().hex
+
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'key': key,
+             'action': './run.sh job'}
+        ]
+
+        self.push(key=key,
+                  algorithms=['sha256'],
+                  signature=uuid.uuid4().hex)
+        self.assertEqual(1, len(self.fake_popen.procs))
+
+        self.push(key=uuid.uuid4().hex,
+                  algorithms=['sha256', 'sha1'],
+                  status=403)
+        self.assertEqual(1, len(self.fake_popen.procs))
+
+    def test_unsupported_signature(self):
+        key = uuid.uuid4().hex
+
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'key': key}
+        ]
+
+        self.push(headers={'X-Hub-Signature': 'md5=abc'}, status=403)
+        self.push(headers={'X-Hub-Signature': 'garbage'}, status=403)
+
+    def test_bad_signature_rejected_before_filters(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'key': uuid.uuid4().hex,
+             'filter': {'ref': 'refs/heads/other'},
+             'action': './run.sh job'}
+        ]
+
+        self.push(signature=uuid.uuid4().hex, status=403)
+        self.push(status=403)
+
+        self.assertEqual(0, len(self.fake_popen.procs))
+
+    def test_unparseable_body_rejected(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'key': uuid.uuid4().hex}
+        ]
+
+        app = self.create_app()
+        headers = {'X-Github-Event': 'push',
+                   'X-Hub-Signature': 'sha1=%s' % uuid.uuid4().hex}
+
+        for body in ('not json', '', '{"repository": {"full_name": "te'):
+            app.post('/', body, headers=headers, status=403)
+            app.post('/', body, headers={'X-Github-Event': 'push'},
+                     status=403)
+
+    def test_only_keys_of_the_repository_checked(self):
+        key = uuid.uuid4().hex
+
+        self.handlers = [
+            {'repo': 'other%d/repo' % i,
+             'key': uuid.uuid4().hex} for i in range(5)
+        ] + [
+            {'repo': self.REPO_NAME,
+             'key': key,
+             'action': './run.sh job'}
+        ]
+
+        hmac_new = self.useFixture(fixtures.MockPatch(
+            'github_webhook_handler.application.hmac.new',
+            wraps=hmac.new)).mock
+
+        self.push(signature=uuid.uuid4().hex, status=403)
+        self.assertEqual(1, hmac_new.call_count)
+
+    def test_keyless_handler_of_another_repository(self):
+        self.handlers = [
+            {'repo': 'other/repo'},
+            {'repo': self.REPO_NAME,
+             'key': uuid.uuid4().hex,
+             'action': './run.sh job'}
+        ]
+
+        self.push(status=403)
+        self.assertEqual(0, len(self.fake_popen.procs))
+
+    def test_signed_request_needs_a_key(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'type': 'ping'}
+        ]
+
+        self.ping(key=uuid.uuid4().hex, status=403)
+
+    def test_bad_signature_without_handlers_accepted(self):
+        # as nothing would be run for it, whatever its signature
+        self.handlers = [
+            {'repo': 'other/repo',
+             'key': uuid.uuid4().hex,
+             'action': './run.sh job'},
+            {'repo': self.REPO_NAME,
+             'type': 'ping',
+             'key': uuid.uuid4().hex}
+        ]
+
+        self.push(signature=uuid.uuid4().hex)
+        self.push()
+        self.push(headers={'X-Hub-Signature': 'garbage'})
+
+        self.assertEqual(0, len(self.fake_popen.procs))
+
+    def test_digest_computed_once(self):
+        key = uuid.uuid4().hex
+
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'key': key,
+             'action': './run.sh %d' % i} for i in range(3)
+        ]
+
+        hmac_new = self.useFixture(fixtures.MockPatch(
+            'github_webhook_handler.application.hmac.new',
+            wraps=hmac.new)).mock
+
+        self.push(key=key)
+
+        # once to sign the request and once to verify it
+        self.assertEqual(3, len(self.fake_popen.procs))
+        self.assertEqual(2, hmac_new.call_count)
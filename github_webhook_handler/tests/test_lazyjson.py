@@ -0,0 +1,101 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+from github_webhook_handler import filters
+from github_webhook_handler import lazyjson
+from github_webhook_handler.tests import base
+
+SAMPLES = os.path.join(os.path.dirname(__file__), '..', '..', 'samples')
+
+
+def loads(text):
+    # lazily however small the document is
+    return lazyjson.loads(text, min_size=0)
+
+
+def materialize(value):
+    if isinstance(value, lazyjson.LazyObject):
+        return dict((k, materialize(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [materialize(v) for v in value]
+    return value
+
+
+class TestLazyJson(base.TestCase):
+
+    def test_matches_json(self):
+        with open(os.path.join(SAMPLES, 'push1.json')) as f:
+            text = f.read()
+
+        self.assertEqual(json.loads(text), materialize(loads(text)))
+
+    def test_key_paths(self):
+        data = loads('{"ref": "refs/heads/master", '
+                     '"repository": {"full_name": "a/b"}}')
+
+        self.assertEqual('a/b', filters.get_path(data,
+                                                 ('repository', 'full_name')))
+        self.assertEqual('refs/heads/master', data.get('ref'))
+        self.assertIsNone(data.get('missing'))
+
+    def test_brackets_in_strings(self):
+        data = loads(' {"a": "}]\\"{[", "b": [1, {"c": {}}], '
+                     '"d": {"e": "}"}} ')
+
+        self.assertEqual('}]"{[', data['a'])
+        self.assertEqual([1, {'c': {}}], data['b'])
+        self.assertEqual('}', data['d']['e'])
+        self.assertEqual(['a', 'b', 'd'], sorted(data))
+
+    def test_only_indexes_what_is_needed(self):
+        data = loads('{"ref": "x", "commits": [1, 2], "last": 1}')
+
+        self.assertEqual('x', data['ref'])
+        self.assertEqual(['ref'], list(data._spans))
+        self.assertEqual(['ref'], list(data._values))
+
+    def test_not_an_object(self):
+        self.assertEqual([1, 2], loads('[1, 2]'))
+
+    def test_empty_object(self):
+        self.assertEqual(0, len(loads('{ }')))
+
+    def test_invalid(self):
+        data = loads('{"a": 1 "b": 2}')
+        self.assertRaises(ValueError, data.__getitem__, 'b')
+
+    def test_escapes_in_skipped_strings(self):
+        data = loads('{"a": ["\\\\", "\\"]"], "b": 2}')
+
+        self.assertEqual(2, data['b'])
+        self.assertEqual(['\\', '"]'], data['a'])
+
+    def test_invalid_skipped_values(self):
+        for text in ('{"a": [1, "]}', '{"a": [[1]', '{"a": nul, "b": 1}'):
+            data = loads(text)
+            self.assertRaises(ValueError, data.__getitem__, 'b')
+
+    def test_skipped_value_checked_when_looked_up(self):
+        data = loads('{"a": [1, 2,], "b": 2}')
+
+        self.assertEqual(2, data['b'])
+        self.assertRaises(ValueError, data.__getitem__, 'a')
+
+    def test_small_documents_decoded(self):
+        text = '{"ref": "x"}'
+
+        self.assertEqual({'ref': 'x'}, lazyjson.loads(text))
+        self.assertIsInstance(lazyjson.loads(text, min_size=len(text)),
+                              lazyjson.LazyObject)
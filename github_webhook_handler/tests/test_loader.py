@@ -0,0 +1,154 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import fixtures
+import yaml
+
+from github_webhook_handler import dispatch
+from github_webhook_handler import loader
+from github_webhook_handler.tests import base
+
+
+class TestHandlersFile(base.TestCase):
+
+    def setUp(self):
+        super(TestHandlersFile, self).setUp()
+        self.clock = base.FakeClock()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmpdir, 'handlers.yaml')
+        self.mtime = 1000
+
+    def write(self, handlers=None, text=None, replace=False):
+        path = self.path + '.new' if replace else self.path
+
+        with open(path, 'w') as f:
+            f.write(yaml.safe_dump(handlers) if text is None else text)
+
+        # make sure the change is visible even on coarse mtime filesystems
+        self.mtime += 10
+        os.utime(path, (self.mtime, self.mtime))
+
+        if replace:
+            os.rename(path, self.path)
+
+    def create(self, check_interval=0):
+        handlers_file = loader.HandlersFile(self.path,
+                                            check_interval=check_interval,
+                                            clock=self.clock)
+        self.load = self.useFixture(fixtures.MockPatchObject(
+            handlers_file, 'load', wraps=handlers_file.load)).mock
+        return handlers_file
+
+    def test_cached(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+        self.assertIs(handlers_file.get(), handlers_file.get())
+        self.assertEqual(1, self.load.call_count)
+
+    def test_reload_on_change(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+        first = list(handlers_file.get())
+
+        self.write([{'repo': 'c/d'}])
+        second = list(handlers_file.get())
+
+        self.assertEqual([{'repo': 'a/b'}], first)
+        self.assertEqual([{'repo': 'c/d'}], second)
+        self.assertEqual(2, self.load.call_count)
+
+    def test_reload_on_replace(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+        handlers_file.get()
+
+        self.write([{'repo': 'c/d'}], replace=True)
+
+        self.assertEqual([{'repo': 'c/d'}], list(handlers_file.get()))
+
+    def test_check_interval(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create(check_interval=5)
+        handlers_file.get()
+
+        self.write([{'repo': 'c/d'}])
+        self.clock.now += 4
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+
+        self.clock.now += 1
+        self.assertEqual([{'repo': 'c/d'}], list(handlers_file.get()))
+
+    def test_broken_edit_keeps_last_good(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+        handlers_file.get()
+
+        self.write(text='- repo: [a/b\n')
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+
+        # the broken file is only parsed once
+        self.assertEqual(2, self.load.call_count)
+
+        self.write([{'repo': 'c/d'}])
+        self.assertEqual([{'repo': 'c/d'}], list(handlers_file.get()))
+
+    def test_invalid_structure_keeps_last_good(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+        handlers_file.get()
+
+        self.write({'repo': 'a/b'})
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+
+    def test_invalid_filter_keeps_last_good(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+        handlers_file.get()
+
+        self.write([{'repo': 'a/b', 'filter': {'ref': {'regex': '('}}}])
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+
+    def test_removed_file_keeps_last_good(self):
+        self.write([{'repo': 'a/b'}])
+        handlers_file = self.create()
+        handlers_file.get()
+
+        os.unlink(self.path)
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+
+    def test_initial_failure_raises(self):
+        handlers_file = self.create()
+        self.assertRaises(OSError, handlers_file.get)
+
+        self.write(text='- repo: [a/b\n')
+        self.assertRaises(yaml.YAMLError, handlers_file.get)
+
+        self.write([{'repo': 'a/b'}])
+        self.assertEqual([{'repo': 'a/b'}], list(handlers_file.get()))
+
+    def test_compiled(self):
+        self.write([{'repo': 'a/b'}])
+        handlers = self.create().get()
+
+        self.assertIsInstance(handlers, dispatch.HandlerSet)
+        self.assertEqual([{'repo': 'a/b'}], handlers.candidates('push', 'a/b'))
+
+    def test_empty_file(self):
+        self.write(text='')
+        handlers_file = self.create()
+
+        self.assertEqual([], list(handlers_file.get()))
@@ -0,0 +1,194 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+import fixtures
+
+from github_webhook_handler import meta
+from github_webhook_handler.tests import base
+
+
+class TestMetaCache(base.TestCase):
+
+    BLOCKS = ['192.30.252.0/22']
+    NEW_BLOCKS = ['185.199.108.0/22']
+
+    def setUp(self):
+        super(TestMetaCache, self).setUp()
+        self.clock = base.FakeClock()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.snapshot = os.path.join(self.tmpdir, 'meta.json')
+
+    def mock_meta(self, hooks=None, **kwargs):
+        if hooks is not None:
+            kwargs['json'] = {'hooks': hooks}
+
+        return self.requests_mock.get(meta.GITHUB_META_URL, **kwargs)
+
+    def create_cache(self, **kwargs):
+        kwargs.setdefault('ttl', 60)
+        return meta.MetaCache(clock=self.clock, **kwargs)
+
+    def test_cold_fetch(self):
+        m = self.mock_meta(self.BLOCKS)
+        cache = self.create_cache()
+
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        self.assertEqual(1, m.call_count)
+
+    def test_cold_fetch_failure(self):
+        self.mock_meta(status_code=500)
+        cache = self.create_cache()
+
+        self.assertIsNone(cache.hooks())
+
+    def test_expiry_serves_stale_and_refreshes(self):
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache()
+        cache.hooks()
+
+        self.mock_meta(self.NEW_BLOCKS)
+        self.clock.now += 61
+
+        # the expired value is served while the refresh happens
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        cache.join()
+
+        self.assertEqual(self.NEW_BLOCKS, cache.hooks())
+        self.assertEqual(2, self.requests_mock.call_count)
+        self.assertFalse(cache.expired)
+
+    def test_not_expired_within_ttl(self):
+        m = self.mock_meta(self.BLOCKS)
+        cache = self.create_cache()
+        cache.hooks()
+
+        self.clock.now += 59
+        cache.hooks()
+        cache.join()
+
+        self.assertEqual(1, m.call_count)
+
+    def test_refresh_failure_keeps_stale(self):
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache()
+        cache.hooks()
+
+        m = self.mock_meta(status_code=503)
+        self.clock.now += 61
+
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        cache.join()
+
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        self.assertTrue(cache.expired)
+
+    def test_refresh_invalid_response_keeps_stale(self):
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache()
+        cache.hooks()
+
+        self.mock_meta(text='not json')
+
+        self.assertFalse(cache.refresh())
+        self.assertEqual(self.BLOCKS, cache.hooks())
+
+    def test_snapshot_written_and_used_at_start(self):
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache(snapshot=self.snapshot)
+        cache.hooks()
+
+        with open(self.snapshot, 'r') as f:
+            self.assertEqual(self.BLOCKS, json.load(f)['hooks'])
+
+        m = self.mock_meta(status_code=500)
+        cache = self.create_cache(snapshot=self.snapshot)
+
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        cache.join()
+        self.assertEqual(0, m.call_count)
+
+    def test_stale_snapshot_is_served_and_refreshed(self):
+        with open(self.snapshot, 'w') as f:
+            json.dump({'hooks': self.BLOCKS, 'fetched_at': 0}, f)
+
+        m = self.mock_meta(self.NEW_BLOCKS)
+        cache = self.create_cache(snapshot=self.snapshot)
+
+        self.assertEqual(self.BLOCKS, cache.hooks())
+        cache.join()
+
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(self.NEW_BLOCKS, cache.hooks())
+
+    def test_refresh_uses_newer_snapshot(self):
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache(snapshot=self.snapshot)
+        cache.hooks()
+
+        # another process sharing the snapshot has already refreshed
+        self.clock.now += 61
+        with open(self.snapshot, 'w') as f:
+            json.dump({'hooks': self.NEW_BLOCKS, 'fetched_at': self.clock.now},
+                      f)
+
+        m = self.mock_meta(status_code=500)
+
+        self.assertTrue(cache.refresh())
+        self.assertEqual(0, m.call_count)
+        self.assertEqual(self.NEW_BLOCKS, cache.hooks())
+        self.assertFalse(cache.expired)
+
+    def test_refresh_ignores_expired_snapshot(self):
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache(snapshot=self.snapshot)
+        cache.hooks()
+
+        self.clock.now += 61
+        m = self.mock_meta(self.NEW_BLOCKS)
+
+        self.assertTrue(cache.refresh())
+        self.assertEqual(1, m.call_count)
+        self.assertEqual(self.NEW_BLOCKS, cache.hooks())
+
+    def test_invalid_snapshot_ignored(self):
+        with open(self.snapshot, 'w') as f:
+            f.write('garbage')
+
+        self.mock_meta(self.BLOCKS)
+        cache = self.create_cache(snapshot=self.snapshot)
+
+        self.assertEqual(self.BLOCKS, cache.hooks())
+
+    def test_application_unavailable_without_meta(self):
+        self.mock_meta(status_code=500)
+        app = self.create_app(full_application=True)
+
+        app.post('/',
+                 extra_environ={'REMOTE_ADDR': '192.30.252.88'},
+                 status=503)
+
+    def test_application_caches_meta(self):
+        m = self.mock_meta(self.BLOCKS)
+        config = {'meta_ttl': 3600, 'handlers': None}
+        app = self.create_app(config=config, full_application=True)
+
+        for _ in range(3):
+            app.post_json('/',
+                          {'repository': {'full_name': 'app/test'}},
+                          extra_environ={'REMOTE_ADDR': '192.30.252.88'})
+
+        self.assertEqual(1, m.call_count)
@@ -0,0 +1,145 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fixtures
+
+from github_webhook_handler import application
+from github_webhook_handler import executor
+from github_webhook_handler import metrics
+from github_webhook_handler.tests import base
+
+handler_func = 'github_webhook_handler.handler._handlers_from_file'
+
+
+class TestMetricTypes(base.TestCase):
+
+    def test_counter(self):
+        counter = metrics.Counter('events_total', 'Events.', labels=('repo',))
+        counter.inc(('a/b',))
+        counter.inc(('a/b',), 2)
+        counter.inc(('c/"d"',))
+
+        self.assertEqual(3, counter.get(('a/b',)))
+        self.assertEqual([('events_total', '{repo="a/b"}', 3),
+                          ('events_total', '{repo="c/\\"d\\""}', 1)],
+                         list(counter.samples()))
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('seconds', 'Time.', buckets=(1, 5))
+        histogram.observe(0.5)
+        histogram.observe(1)
+        histogram.observe(10)
+
+        self.assertEqual(3, histogram.count())
+        self.assertEqual([('seconds_bucket', '{le="1"}', 2),
+                          ('seconds_bucket', '{le="5"}', 2),
+                          ('seconds_bucket', '{le="+Inf"}', 3),
+                          ('seconds_sum', '', 11.5),
+                          ('seconds_count', '', 3)],
+                         list(histogram.samples()))
+
+    def test_gauge(self):
+        gauge = metrics.Gauge('depth', 'Depth.', lambda: None)
+        self.assertEqual([], list(gauge.samples()))
+
+        gauge = metrics.Gauge('depth', 'Depth.', lambda: 4)
+        self.assertEqual([('depth', '', 4)], list(gauge.samples()))
+
+    def test_handler_name(self):
+        self.assertEqual('build', metrics.handler_name({'name': 'build',
+                                                        'repo': 'a/b'}))
+        self.assertEqual('a/b,c/*', metrics.handler_name({'repo': ['a/b',
+                                                                   'c/*']}))
+
+
+class TestMetricsEndpoint(base.TestCase):
+
+    def setUp(self):
+        super(TestMetricsEndpoint, self).setUp()
+
+        self.handlers = []
+        self.useFixture(fixtures.MockPatch(handler_func,
+                                           new=lambda config: self.handlers))
+        self.fake_popen = self.useFixture(fixtures.FakePopen(
+            lambda args: {'returncode': 3}))
+
+        self.requests_mock.get(application.GITHUB_META_URL,
+                               json={'hooks': ['192.30.252.0/22']})
+        self.config = {'metrics_path': '/metrics'}
+
+    def push_from_github(self, **kwargs):
+        extra_environ = {'REMOTE_ADDR': '192.30.252.88'}
+        return self.push(config=self.config, full_application=True,
+                         extra_environ=extra_environ, **kwargs)
+
+    def scrape(self):
+        app = self.create_app(config=self.config, full_application=True)
+        resp = app.get('/metrics')
+
+        self.assertEqual(metrics.CONTENT_TYPE, resp.headers['Content-Type'])
+        return resp.body.decode('utf-8').splitlines()
+
+    def test_other_paths_not_found(self):
+        app = self.create_app(config=self.config, full_application=True)
+
+        app.get('/metric', status=404)
+        app.post('/abc', status=404)
+        app.post('/metrics', status=405)
+
+    def test_not_served_by_default(self):
+        self.config = {}
+        app = self.create_app(config=self.config, full_application=True)
+
+        app.get('/metrics', status=404)
+
+    def test_delivery(self):
+        self.handlers = [{'name': 'build',
+                          'repo': self.REPO_NAME,
+                          'action': './run.sh'},
+                         {'repo': 'other/repo',
+                          'action': './run.sh'}]
+
+        self.push_from_github()
+        lines = self.scrape()
+
+        self.assertIn('github_webhook_deliveries_total'
+                      '{event="push",repo="test/repo"} 1', lines)
+        self.assertIn('github_webhook_handler_matches_total'
+                      '{handler="build"} 1', lines)
+        self.assertIn('github_webhook_action_exits_total'
+                      '{handler="build",exit_code="3"} 1', lines)
+        self.assertIn('github_webhook_action_seconds_count'
+                      '{handler="build"} 1', lines)
+        self.assertIn('github_webhook_request_seconds_count{code="200"} 1',
+                      lines)
+
+        for stage in metrics.STAGES:
+            self.assertIn('github_webhook_stage_seconds_count'
+                          '{stage="%s"}' % stage,
+                          ' '.join(lines))
+
+    def test_rejected_delivery(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'key': 'secret'}]
+
+        self.push_from_github(signature='bad', status=403)
+        lines = self.scrape()
+
+        self.assertIn('github_webhook_request_seconds_count{code="403"} 1',
+                      lines)
+        self.assertNotIn('github_webhook_deliveries_total{', '\n'.join(lines))
+
+    def test_queue_depth(self):
+        self.config['execution'] = 'async'
+        executor.get_executor(self.config)
+
+        self.assertIn('github_webhook_action_queue{state="pending"} 0',
+                      self.scrape())
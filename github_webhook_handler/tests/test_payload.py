@@ -0,0 +1,98 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import stat
+
+import fixtures
+
+from github_webhook_handler import executor
+from github_webhook_handler import payload
+from github_webhook_handler.tests import base
+
+
+class TestPayload(base.TestCase):
+
+    def setUp(self):
+        super(TestPayload, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+
+    def create(self, body=b'{"a": 1}'):
+        return payload.Payload(body, directory=self.tmpdir)
+
+    def test_written_once(self):
+        p = self.create()
+        self.useFixture(fixtures.MockPatchObject(p, '_write',
+                                                 wraps=p._write))
+
+        first = p.acquire()
+        second = p.acquire()
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, p._write.call_count)
+
+        with open(first, 'rb') as f:
+            self.assertEqual(b'{"a": 1}', f.read())
+
+    def test_removed_with_last_reference(self):
+        p = self.create()
+
+        path = p.acquire()
+        p.acquire()
+
+        p.release()
+        self.assertTrue(os.path.exists(path))
+
+        p.release()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+    def test_read_only(self):
+        p = self.create()
+
+        with p.held() as path:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+
+        self.assertEqual(0o400, mode)
+
+    def test_queued_jobs_share_payload(self):
+        shared = self.create()
+        jobs = [executor.Job({'action': 'a %d' % i}, 'push', shared.body,
+                             payload=shared)
+                for i in range(3)]
+
+        queue = executor.JobQueue()
+        queue.add(jobs)
+        path = shared.path
+
+        for _ in jobs:
+            queue.done(queue.take())
+
+        self.assertIsNotNone(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_coalesced_payload_released(self):
+        queue = executor.JobQueue()
+        handler = {'action': 'a', 'coalesce': True}
+        old = self.create()
+        new = self.create()
+
+        queue.add([executor.Job(handler, 'push', old.body, 'test/repo',
+                                'refs/heads/master', payload=old)])
+        queue.add([executor.Job(handler, 'push', new.body, 'test/repo',
+                                'refs/heads/master', payload=new)])
+
+        self.assertIsNone(old.path)
+        self.assertIsNotNone(new.path)
+
+        queue.clear()
+        self.assertIsNone(new.path)
@@ -0,0 +1,175 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+import fixtures
+import git
+import webob.exc
+
+from github_webhook_handler import cloner
+from github_webhook_handler import handler
+from github_webhook_handler import mirror
+from github_webhook_handler import prefetch
+from github_webhook_handler.tests import test_cloner
+
+
+class TestPrefetch(test_cloner.ClonerTestCase):
+
+    def setUp(self):
+        super(TestPrefetch, self).setUp()
+        self.sha = self.commit({'a': '1'})
+        self.remotes_dir = os.path.join(self.tmpdir, 'remotes')
+
+        for full_name in ('org/one', 'org/two'):
+            git.Repo.clone_from(self.upstream_dir,
+                                os.path.join(self.remotes_dir, full_name),
+                                bare=True)
+
+        self.handlers = [{'repo': 'org/one'},
+                         {'repo': ['org/two', 'org/one', 'other/*'],
+                          'clone': {'filter': 'blob:none'}},
+                         {'type': 'ping'}]
+        self.useFixture(fixtures.MockPatchObject(
+            handler, '_handlers_from_file',
+            side_effect=lambda config: self.handlers))
+
+        self.config = {'cache_dir': self.cache_dir,
+                       'prefetch_url': os.path.join(self.remotes_dir,
+                                                    '{full_name}'),
+                       'prefetch_jitter': 0}
+
+    def test_handler_repos(self):
+        self.assertEqual({'org/one': {'depth': None, 'filter': None},
+                          'org/two': {'depth': None, 'filter': 'blob:none'}},
+                         prefetch.handler_repos(self.config))
+
+    def test_handler_repos_merged(self):
+        self.handlers = [{'repo': 'org/one',
+                          'clone': {'depth': 1, 'filter': 'blob:none'}},
+                         {'repo': 'org/one',
+                          'clone': {'depth': 5, 'filter': 'tree:0'}},
+                         {'repo': ['org/one', 'org/two'],
+                          'clone': {'depth': 2, 'filter': 'tree:0'}},
+                         {'repo': 'org/two'}]
+
+        self.assertEqual({'org/one': {'depth': 5, 'filter': None},
+                          'org/two': {'depth': None, 'filter': None}},
+                         prefetch.handler_repos(self.config))
+
+    def test_shallow(self):
+        self.commit({'a': '2'})
+        remote = git.Repo(os.path.join(self.remotes_dir, 'org/one'))
+        remote.git.fetch(self.upstream_dir, '+master:master')
+        self.handlers = [{'repo': 'org/one', 'clone': {'depth': 1}}]
+
+        prefetch.Prefetcher.from_config(self.config).run_once()
+
+        repo = mirror.Mirror(self.cache_dir, 'org/one').repo
+        self.assertTrue(mirror.is_shallow(repo))
+        self.assertEqual('1', repo.git.rev_list('--count', 'master'))
+
+    def test_keeps_origin(self):
+        # cloned for an event from another url than prefetch_url
+        other_url = os.path.join(self.remotes_dir, 'org/two')
+        cache = mirror.Mirror(self.cache_dir, 'org/one')
+        cache.fetch(other_url, refspec=prefetch.REFSPEC)
+
+        prefetch.Prefetcher.from_config(self.config).run_once()
+
+        self.assertEqual(other_url, cache.repo.remotes.origin.url)
+        self.assertEqual(os.path.join(self.remotes_dir, 'org/two'),
+                         mirror.Mirror(self.cache_dir,
+                                       'org/two').repo.remotes.origin.url)
+
+    def test_no_handlers_file(self):
+        self.useFixture(fixtures.MockPatchObject(
+            handler, '_handlers_from_file',
+            side_effect=webob.exc.HTTPOk()))
+        self.assertEqual({}, prefetch.handler_repos(self.config))
+
+    def test_run_once(self):
+        prefetcher = prefetch.Prefetcher.from_config(self.config)
+
+        self.assertEqual({'org/one': True, 'org/two': True},
+                         prefetcher.run_once())
+
+        for full_name in ('org/one', 'org/two'):
+            repo = mirror.Mirror(self.cache_dir, full_name).repo
+            self.assertEqual(self.sha, repo.commit('refs/heads/master').hexsha)
+
+        self.assertEqual('blob:none', mirror.partial_filter(
+            mirror.Mirror(self.cache_dir, 'org/two').repo))
+
+    def test_fetches_incrementally(self):
+        prefetcher = prefetch.Prefetcher.from_config(self.config)
+        prefetcher.run_once()
+
+        sha = self.commit({'b': '2'})
+        remote = git.Repo(os.path.join(self.remotes_dir, 'org/one'))
+        remote.git.fetch(self.upstream_dir, '+master:master')
+
+        self.assertEqual(True, prefetcher.run_once()['org/one'])
+        repo = mirror.Mirror(self.cache_dir, 'org/one').repo
+        self.assertEqual(sha, repo.commit('refs/heads/master').hexsha)
+
+    def test_clone_uses_prefetched_commit(self):
+        prefetch.Prefetcher.from_config(self.config).run_once()
+        fetch = self.useFixture(fixtures.MockPatch(
+            'github_webhook_handler.mirror.fetch')).mock
+
+        event = self.event(self.sha, url=os.path.join(self.remotes_dir,
+                                                      'org/one'))
+        event['repository']['full_name'] = 'org/one'
+        output_dir = os.path.join(self.tmpdir, 'out')
+
+        cloner.clone(event, output_dir, cache_dir=self.cache_dir)
+
+        self.assertFalse(fetch.called)
+        self.assertEqual(self.sha, git.Repo(output_dir).head.commit.hexsha)
+
+    def test_failed_fetch(self):
+        self.handlers = [{'repo': ['org/one', 'org/missing']}]
+        prefetcher = prefetch.Prefetcher.from_config(self.config)
+
+        self.assertEqual({'org/one': True, 'org/missing': False},
+                         prefetcher.run_once())
+
+    def test_jitter(self):
+        delays = []
+        prefetcher = prefetch.Prefetcher(self.config, jitter=5,
+                                         sleep=delays.append,
+                                         url=self.config['prefetch_url'])
+
+        prefetcher.prefetch('org/one')
+
+        delay, = delays
+        self.assertTrue(0 <= delay <= 5)
+
+    def test_enabled(self):
+        self.assertFalse(prefetch.enabled(self.config))
+        self.assertTrue(prefetch.enabled(dict(self.config,
+                                              prefetch_interval=60)))
+        self.assertFalse(prefetch.enabled({'prefetch_interval': 60}))
+
+    def test_main_once(self):
+        config_file = os.path.join(self.tmpdir, 'config.yaml')
+
+        with open(config_file, 'w') as f:
+            f.write('cache_dir: %s\n' % self.cache_dir)
+            f.write('prefetch_url: %s\n' % self.config['prefetch_url'])
+            f.write('prefetch_jitter: 0\n')
+
+        self.assertEqual(0, cloner.main(['prefetch', '-c', config_file,
+                                         '--once']))
+        self.assertTrue(os.path.isdir(
+            mirror.Mirror(self.cache_dir, 'org/two').git_dir))
@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import os
+
+import fixtures
+
+from github_webhook_handler import application
+from github_webhook_handler import profiling
+from github_webhook_handler.tests import base
+
+handler_func = 'github_webhook_handler.handler._handlers_from_file'
+
+
+class TestProfiling(base.TestCase):
+
+    def setUp(self):
+        super(TestProfiling, self).setUp()
+
+        self.handlers = [{'name': 'build',
+                          'repo': self.REPO_NAME,
+                          'action': './run.sh'}]
+        self.useFixture(fixtures.MockPatch(handler_func,
+                                           new=lambda config: self.handlers))
+        self.useFixture(fixtures.FakePopen())
+
+        self.requests_mock.get(application.GITHUB_META_URL,
+                               json={'hooks': ['192.30.252.0/22']})
+
+        self.profile_dir = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'profiles')
+        self.config = {'profile_dir': self.profile_dir}
+
+    def push_from_github(self, **kwargs):
+        extra_environ = {'REMOTE_ADDR': '192.30.252.88'}
+        return self.push(config=self.config, full_application=True,
+                         extra_environ=extra_environ, **kwargs)
+
+    def records(self):
+        if not os.path.isdir(self.profile_dir):
+            return []
+
+        return profiling.load_records(self.profile_dir)
+
+    def test_sampled(self):
+        self.config['profile_sample'] = 2
+
+        for _ in range(4):
+            self.push_from_github()
+
+        records = self.records()
+        self.assertEqual(2, len(records))
+
+        record = records[0]
+        self.assertEqual('push', record['event'])
+        self.assertEqual(200, record['status'])
+        self.assertEqual(['build'], record['handlers'])
+        self.assertEqual(['meta', 'hmac', 'parse', 'filter', 'hmac',
+                          'spawn', 'action'],
+                         [name for name, _ in record['stages']])
+        self.assertTrue(os.path.exists(os.path.join(self.profile_dir,
+                                                    record['profile'])))
+
+    def test_slow(self):
+        self.config['profile_slow'] = 0
+
+        self.push_from_github(headers={'X-GitHub-Delivery': 'abc'})
+
+        record, = self.records()
+        self.assertEqual('abc', record['delivery'])
+        self.assertIsNone(record['profile'])
+
+    def test_fast_requests_not_recorded(self):
+        self.config['profile_slow'] = 60
+
+        self.push_from_github()
+
+        self.assertEqual([], self.records())
+
+    def test_rejected(self):
+        self.config['profile_sample'] = 1
+        self.handlers = [{'repo': self.REPO_NAME, 'key': 'secret'}]
+
+        self.push_from_github(signature='bad', status=403)
+
+        record, = self.records()
+        self.assertEqual(403, record['status'])
+
+    def test_rotated(self):
+        self.config['profile_sample'] = 1
+        self.config['profile_keep'] = 2
+
+        for _ in range(3):
+            self.push_from_github()
+
+        self.assertEqual(2, len(self.records()))
+        self.assertEqual(4, len(os.listdir(self.profile_dir)))
+
+    def test_disabled(self):
+        self.config = {}
+
+        self.push_from_github()
+
+        self.assertNotIn('profiler', self.config['_state'])
+
+    def test_summarise(self):
+        self.config['profile_sample'] = 1
+        self.push_from_github()
+
+        out = io.StringIO()
+        profiling.summarise(self.profile_dir, out=out)
+
+        self.assertIn('1 deliveries, 1 profiled', out.getvalue())
+        self.assertIn('filter', out.getvalue())
+        self.assertIn('function calls', out.getvalue())
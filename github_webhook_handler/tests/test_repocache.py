@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+
+from github_webhook_handler import cloner
+from github_webhook_handler import mirror
+from github_webhook_handler import repocache
+from github_webhook_handler.tests import base
+from github_webhook_handler.tests import test_cloner
+
+
+class TestParseSize(base.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(1024, repocache.parse_size(1024))
+        self.assertEqual(1024, repocache.parse_size('1024'))
+        self.assertEqual(500 << 20, repocache.parse_size('500M'))
+        self.assertEqual(10 << 30, repocache.parse_size('10GB'))
+        self.assertEqual(3 << 29, repocache.parse_size('1.5 GiB'))
+        self.assertIsNone(repocache.parse_size(None))
+        self.assertRaises(ValueError, repocache.parse_size, '10 apples')
+
+
+class TestCacheManager(test_cloner.ClonerTestCase):
+
+    def setUp(self):
+        super(TestCacheManager, self).setUp()
+        self.sha = self.commit({'a': '1' * 4096})
+        self.clock = base.FakeClock(now=10000.0)
+
+    def cache(self, full_name, used):
+        cache = mirror.Mirror(self.cache_dir, full_name)
+        cache.fetch(self.upstream_dir,
+                    refspec='+refs/heads/master:refs/heads/master')
+        os.utime(os.path.join(cache.git_dir, mirror.USED_FILE), (used, used))
+        return cache
+
+    def manager(self, **kwargs):
+        return repocache.CacheManager(self.cache_dir, clock=self.clock,
+                                      **kwargs)
+
+    def test_find(self):
+        self.cache('org/one', 100)
+        self.cache('org/two', 200)
+
+        self.assertEqual(['org/one', 'org/two'],
+                         sorted(m.full_name for m in
+                                mirror.Mirror.find(self.cache_dir)))
+
+    def test_find_skips_worktrees(self):
+        cache = self.cache('org/one', 100)
+        # a checkout holding something that looks like a mirror
+        nested = os.path.join(cache.worktrees_dir, 'abc', 'vendor.git')
+        os.makedirs(nested)
+        open(os.path.join(nested, 'HEAD'), 'w').close()
+
+        self.assertEqual(['org/one'],
+                         [m.full_name for m in
+                          mirror.Mirror.find(self.cache_dir)])
+
+    def test_evict_least_recently_used(self):
+        old = self.cache('org/old', 100)
+        new = self.cache('org/new', 200)
+        manager = self.manager(max_size=new.size())
+
+        removed = manager.evict()
+
+        self.assertEqual(['org/old'], [m.full_name for m in removed])
+        self.assertFalse(os.path.exists(old.git_dir))
+        self.assertTrue(os.path.exists(new.git_dir))
+
+    def test_within_budget(self):
+        self.cache('org/one', 100)
+        self.assertEqual([], self.manager(max_size=1 << 30).evict())
+        self.assertEqual([], self.manager().evict())
+
+    def test_recently_used_not_evicted(self):
+        self.cache('org/new', self.clock.now - 10)
+
+        self.assertEqual([], self.manager(max_size=0).evict())
+        self.assertEqual(['org/new'],
+                         [m.full_name for m in
+                          self.manager(max_size=0, min_age=5).evict()])
+
+    def test_checked_out_not_evicted(self):
+        output_dir = os.path.join(self.tmpdir, 'out')
+        event = self.event(self.sha)
+        cloner.clone_worktree(event, output_dir, self.cache_dir)
+
+        cache = mirror.Mirror(self.cache_dir, self.REPO_NAME)
+        os.utime(os.path.join(cache.git_dir, mirror.USED_FILE), (100, 100))
+
+        self.assertEqual([], self.manager(max_size=0).evict())
+        self.assertEqual('1' * 4096, self.read(output_dir, 'a'))
+
+        # a spare worktree doesn't keep it
+        cloner.release_worktree(event, output_dir, self.cache_dir)
+        os.utime(os.path.join(cache.git_dir, mirror.USED_FILE), (100, 100))
+
+        self.assertEqual([self.REPO_NAME],
+                         [m.full_name for m in
+                          self.manager(max_size=0).evict()])
+        self.assertFalse(os.path.exists(cache.git_dir))
+        self.assertFalse(os.path.exists(cache.worktrees_dir))
+
+    def test_evicted_mirror_is_fetched_again(self):
+        self.cache('org/old', 100)
+        self.manager(max_size=0).evict()
+
+        output_dir = os.path.join(self.tmpdir, 'out')
+        event = self.event(self.sha)
+        event['repository']['full_name'] = 'org/old'
+        cloner.clone(event, output_dir, cache_dir=self.cache_dir)
+
+        self.assertEqual('1' * 4096, self.read(output_dir, 'a'))
+
+    def test_maintain(self):
+        cache = self.cache('org/one', 100)
+        manager = self.manager(interval=60)
+
+        self.assertTrue(manager.needs_maintenance(cache))
+        self.assertEqual(['org/one'],
+                         [m.full_name for m in manager.maintain()])
+
+        self.assertTrue(os.path.exists(os.path.join(
+            cache.git_dir, 'objects', 'info', 'commit-graph')))
+        self.assertEqual([], os.listdir(os.path.join(cache.git_dir,
+                                                     'refs', 'heads')))
+
+        # not used since it was maintained
+        self.clock.now = cache.last_maintained + 120
+        self.assertFalse(manager.needs_maintenance(cache))
+        self.assertEqual([], manager.maintain())
+        self.assertEqual(['org/one'],
+                         [m.full_name for m in manager.maintain(force=True)])
+
+        # used, but maintained too recently
+        used = cache.last_maintained + 1
+        os.utime(os.path.join(cache.git_dir, mirror.USED_FILE), (used, used))
+        self.clock.now = cache.last_maintained + 30
+        self.assertFalse(manager.needs_maintenance(cache))
+
+        self.clock.now = cache.last_maintained + 60
+        self.assertTrue(manager.needs_maintenance(cache))
+
+    def test_cloner_subcommand(self):
+        old = self.cache('org/old', 100)
+        new = self.cache('org/new', 200)
+
+        cloner.main(['maintain', '--cache-dir', self.cache_dir,
+                     '--max-size', str(new.size())])
+
+        self.assertFalse(os.path.exists(old.git_dir))
+        self.assertIsNotNone(new.last_maintained)
+
+    def test_enabled(self):
+        self.assertFalse(repocache.enabled({}))
+        self.assertFalse(repocache.enabled({'cache_max_size': '1G'}))
+        self.assertFalse(repocache.enabled({'cache_dir': self.cache_dir}))
+        self.assertTrue(repocache.enabled({'cache_dir': self.cache_dir,
+                                           'cache_max_size': '1G'}))
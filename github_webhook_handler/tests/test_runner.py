@@ -0,0 +1,125 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import sys
+
+import fixtures
+
+from github_webhook_handler import runner
+from github_webhook_handler.tests import base
+
+handler_func = 'github_webhook_handler.handler._handlers_from_file'
+
+
+def record():
+    """An entry point that writes out how it was run."""
+    with open(sys.argv[1], 'w') as f:
+        json.dump({'argv': sys.argv,
+                   'cwd': os.getcwd(),
+                   'env': os.environ.get('GWH_TEST'),
+                   'stdin': sys.stdin.read()}, f)
+
+
+def fail():
+    return 3
+
+
+class TestWarmRunner(base.TestCase):
+
+    def setUp(self):
+        super(TestWarmRunner, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.runner = runner.WarmRunner(preload=['json'])
+
+    def test_run(self):
+        output = os.path.join(self.tmpdir, 'output.json')
+        stdin = os.path.join(self.tmpdir, 'stdin')
+
+        with open(stdin, 'w') as f:
+            f.write('event')
+
+        returncode = self.runner.run(
+            'github_webhook_handler.tests.test_runner:record',
+            [output, 'extra'],
+            {'GWH_TEST': 'value'},
+            self.tmpdir,
+            stdin=stdin)
+
+        with open(output) as f:
+            result = json.load(f)
+
+        self.assertEqual(0, returncode)
+        self.assertEqual([output, 'extra'], result['argv'][1:])
+        self.assertEqual(os.path.realpath(self.tmpdir),
+                         os.path.realpath(result['cwd']))
+        self.assertEqual('value', result['env'])
+        self.assertEqual('event', result['stdin'])
+
+    def test_exit_code(self):
+        returncode = self.runner.run(
+            'github_webhook_handler.tests.test_runner:fail',
+            [], {}, self.tmpdir)
+
+        self.assertEqual(3, returncode)
+
+    def test_bad_entry_point(self):
+        self.assertRaises(ValueError, runner.load_entry_point, 'no_function')
+
+
+class TestEntryPointHandler(base.TestCase):
+
+    def setUp(self):
+        super(TestEntryPointHandler, self).setUp()
+
+        self.handlers = []
+        self.useFixture(fixtures.MockPatch(handler_func,
+                                           new=lambda config: self.handlers))
+        self.fake_popen = self.useFixture(fixtures.FakePopen())
+
+        self.calls = []
+        self.useFixture(fixtures.MockPatchObject(runner.WarmRunner, 'run',
+                                                 new=self.fake_run))
+
+    def fake_run(self, entry_point, args, env, cwd, stdin=None):
+        with open(env['GWH_EVENT_FILE']) as f:
+            event = json.load(f)
+
+        self.calls.append({'entry_point': entry_point,
+                           'args': args,
+                           'cwd': os.path.isdir(cwd),
+                           'event': event,
+                           'stdin': stdin})
+        return 0
+
+    def test_entry_point(self):
+        self.handlers = [
+            {'repo': self.REPO_NAME,
+             'entry_point': 'github_webhook_handler.cloner:main -o out',
+             'event_stdin': True},
+            {'repo': self.REPO_NAME,
+             'action': './run.sh'},
+        ]
+
+        self.push(after='a' * 40)
+
+        self.assertEqual(1, len(self.fake_popen.procs))
+        self.assertEqual(1, len(self.calls))
+
+        call = self.calls[0]
+        self.assertEqual('github_webhook_handler.cloner:main',
+                         call['entry_point'])
+        self.assertEqual(['-o', 'out'], call['args'])
+        self.assertTrue(call['cwd'])
+        self.assertEqual('a' * 40, call['event']['after'])
+        self.assertIsNotNone(call['stdin'])
@@ -0,0 +1,236 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import fixtures
+import requests
+import yaml
+
+from github_webhook_handler import executor
+from github_webhook_handler import server
+from github_webhook_handler import spool
+from github_webhook_handler.tests import base
+
+
+class TestNodeLimit(base.TestCase):
+
+    def setUp(self):
+        super(TestNodeLimit, self).setUp()
+        self.directory = self.useFixture(fixtures.TempDir()).path
+
+    def test_not_configured(self):
+        self.assertIsNone(executor.get_node_limit({}))
+
+    def test_from_config(self):
+        limit = executor.get_node_limit({'action_limit': 2,
+                                         'action_limit_dir': self.directory})
+
+        self.assertEqual(2, limit.limit)
+        self.assertEqual(self.directory, limit.directory)
+
+    def test_limit_shared(self):
+        # each limit opens its own files, as another process would
+        first = executor.NodeLimit(self.directory, 1, poll=0.01)
+        second = executor.NodeLimit(self.directory, 1, poll=0.01)
+        acquired = threading.Event()
+
+        def wait():
+            with second.held():
+                acquired.set()
+
+        with first.held():
+            thread = threading.Thread(target=wait)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+
+        self.assertTrue(acquired.wait(5))
+        thread.join()
+
+    def test_slots(self):
+        limit = executor.NodeLimit(self.directory, 2)
+
+        a = limit.acquire()
+        b = limit.acquire()
+
+        self.assertIsNone(limit._try(0))
+        self.assertIsNone(limit._try(1))
+
+        limit.release(a)
+        limit.release(b)
+
+
+class ServerTestCase(base.TestCase):
+    """Run the server in a process of its own, as it forks and signals."""
+
+    def setUp(self):
+        super(ServerTestCase, self).setUp()
+
+        # the requests to the server are real
+        self.requests_mock.stop()
+
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.pids_file = os.path.join(self.tmpdir, 'pids')
+
+        handlers_file = os.path.join(self.tmpdir, 'handlers.yaml')
+        snapshot_file = os.path.join(self.tmpdir, 'meta.json')
+        config_file = os.path.join(self.tmpdir, 'config.yaml')
+
+        # an action's parent is the worker that ran it
+        self.handler = {'repo': self.REPO_NAME,
+                        'action': "sh -c 'echo $PPID >> %s'" % self.pids_file}
+
+        with open(handlers_file, 'w') as f:
+            yaml.safe_dump([self.handler], f)
+
+        with open(snapshot_file, 'w') as f:
+            json.dump({'hooks': ['127.0.0.0/8'], 'fetched_at': time.time()},
+                      f)
+
+        config = {'handlers': handlers_file,
+                  'meta_snapshot': snapshot_file,
+                  'meta_url': 'http://127.0.0.1:1/meta',
+                  'action_limit': 2,
+                  'action_limit_dir': os.path.join(self.tmpdir, 'slots')}
+        config.update(self.server_config())
+
+        with open(config_file, 'w') as f:
+            yaml.safe_dump(config, f)
+
+        self.port = self.free_port()
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'github_webhook_handler.server',
+             '-c', config_file, '--host', '127.0.0.1',
+             '--port', str(self.port), '--workers', '2'])
+        self.addCleanup(self.kill)
+        self.wait_until_up()
+
+    def server_config(self):
+        """Config to add to that of every server, set before it starts."""
+        return {}
+
+    def free_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def kill(self):
+        if self.process.poll() is None:
+            # stopped so that the workers are stopped too
+            self.process.send_signal(signal.SIGTERM)
+
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def wait_until_up(self):
+        for _ in range(100):
+            try:
+                requests.get(self.url('/missing'), timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        self.fail('The server did not start')
+
+    def url(self, path='/'):
+        return 'http://127.0.0.1:%d%s' % (self.port, path)
+
+    def push(self, i):
+        data = {'ref': self.REF,
+                'after': '%040x' % i,
+                'repository': {'full_name': self.REPO_NAME}}
+        return requests.post(self.url(), json=data, timeout=10,
+                             headers={'X-Github-Event': 'push',
+                                      'X-GitHub-Delivery': 'delivery-%d' % i,
+                                      'Connection': 'close'})
+
+    def worker_pids(self):
+        try:
+            with open(self.pids_file) as f:
+                return [int(line) for line in f]
+        except IOError:
+            return []
+
+
+class TestServer(ServerTestCase):
+
+    def test_serves_from_every_worker(self):
+        for i in range(20):
+            self.assertEqual(200, self.push(i).status_code)
+
+        self.assertEqual(404, requests.get(self.url('/other')).status_code)
+
+        pids = self.worker_pids()
+        self.assertEqual(20, len(pids))
+        self.assertEqual(2, len(set(pids)))
+
+    def test_replaces_workers(self):
+        for i in range(10):
+            self.push(i)
+
+        for pid in set(self.worker_pids()):
+            os.kill(pid, signal.SIGKILL)
+
+        self.wait_until_up()
+
+        for i in range(10, 20):
+            self.assertEqual(200, self.push(i).status_code)
+
+    def test_stops(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.assertEqual(0, self.process.wait(10))
+
+
+class TestServerSpool(ServerTestCase):
+
+    def server_config(self):
+        path = os.path.join(self.tmpdir, 'spool.db')
+        events = spool.Spool(path)
+        self.addCleanup(events.close)
+
+        # still running when its worker is killed, so it stays pending
+        events.record('push', b'{}', [
+            {'action': "sh -c 'echo $PPID >> %s; sleep 5'" % self.pids_file}])
+
+        return {'execution': 'async', 'spool': path}
+
+    def wait_for_pids(self, count):
+        for _ in range(100):
+            if len(self.worker_pids()) >= count:
+                break
+
+            time.sleep(0.1)
+
+        return self.worker_pids()
+
+    def test_resumes_once(self):
+        pids = self.wait_for_pids(1)
+        self.assertEqual(1, len(pids))
+
+        # the worker that replaces the first one doesn't resume the job again
+        os.kill(pids[0], signal.SIGKILL)
+        self.wait_until_up()
+        time.sleep(2 * server.MIN_WORKER_LIFETIME)
+
+        self.assertEqual(pids, self.worker_pids())
@@ -0,0 +1,294 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import threading
+
+import fixtures
+
+from github_webhook_handler import executor
+from github_webhook_handler import replay
+from github_webhook_handler import spool
+from github_webhook_handler.tests import base
+from github_webhook_handler.tests import test_executor
+
+
+def _event(ref='refs/heads/master', after='a' * 40):
+    return json.dumps({'ref': ref,
+                       'after': after,
+                       'repository': {'full_name': 'test/repo'}}).encode()
+
+
+class TestSpool(base.TestCase):
+
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.clock = base.FakeClock()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmpdir, 'spool.db')
+
+    def create(self):
+        s = spool.Spool(self.path, clock=self.clock)
+        self.addCleanup(s.close)
+        return s
+
+    def test_record_and_complete(self):
+        s = self.create()
+        ids = s.record('push', _event(), [{'action': 'a'}, {'action': 'b'}])
+
+        self.assertEqual(2, len(ids))
+        pending = s.pending()
+        self.assertEqual(ids, [j.job_id for j in pending])
+        self.assertEqual({'action': 'b'}, pending[1].handler)
+        self.assertEqual(_event(), pending[1].body)
+        self.assertEqual('push', pending[1].event_type)
+
+        s.complete(ids[:1])
+        self.assertEqual(ids[1:], [j.job_id for j in s.pending()])
+        self.assertEqual(2, len(s.jobs()))
+
+    def test_persists(self):
+        self.create().record('push', _event(), [{'action': 'a'}])
+
+        self.assertEqual(1, len(self.create().pending()))
+
+    def test_time_range(self):
+        s = self.create()
+
+        for _ in range(5):
+            s.record('push', _event(), [{'action': 'a'}])
+            self.clock.now += 10
+
+        self.assertEqual(5, len(s.jobs()))
+        self.assertEqual(3, len(s.jobs(since=1020)))
+        self.assertEqual(2, len(s.jobs(until=1020)))
+        self.assertEqual(1, len(s.jobs(since=1010, until=1020)))
+
+    def test_purge(self):
+        s = self.create()
+        old = s.record('push', _event(), [{'action': 'a'}, {'action': 'b'}])
+        s.complete(old[:1])
+        self.clock.now += 100
+        new = s.record('push', _event(), [{'action': 'a'}])
+        s.complete(new)
+
+        s.purge(1050)
+
+        # the incomplete job and its event are kept, as is the newer event
+        self.assertEqual([old[1], new[0]], [j.job_id for j in s.jobs()])
+
+    def test_discard(self):
+        s = self.create()
+        kept = s.record('push', _event(), [{'action': 'a'}])
+        partly = s.record('push', _event(), [{'action': 'a'}, {'action': 'b'}])
+        gone = s.record('push', _event(), [{'action': 'a'}])
+
+        s.discard(partly[1:] + gone)
+
+        self.assertEqual(kept + partly[:1], [j.job_id for j in s.jobs()])
+        self.assertEqual(2, s._conn.execute(
+            'SELECT COUNT(*) FROM events').fetchone()[0])
+
+    def test_key_not_recorded(self):
+        s = self.create()
+        handler = {'action': 'a', 'key': 'secret'}
+        s.record('push', _event(), [handler])
+
+        self.assertEqual({'action': 'a'}, s.pending()[0].handler)
+        self.assertEqual('secret', handler['key'])
+
+        for suffix in ('', '-wal'):
+            with open(self.path + suffix, 'rb') as f:
+                self.assertNotIn(b'secret', f.read())
+
+    def test_owner_only(self):
+        self.addCleanup(os.umask, os.umask(0o022))
+        self.create().record('push', _event(), [{'action': 'a'}])
+
+        for suffix in ('', '-wal', '-shm'):
+            mode = os.stat(self.path + suffix).st_mode
+            self.assertEqual(0o600, mode & 0o777)
+
+    def test_invalid_synchronous(self):
+        self.assertRaises(ValueError, spool.Spool, self.path,
+                          synchronous='sometimes')
+
+
+class TestSpooledExecution(test_executor.TestAsyncExecution):
+
+    def setUp(self):
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmpdir, 'spool.db')
+        super(TestSpooledExecution, self).setUp()
+
+    def get_executor(self):
+        self.config['spool'] = self.path
+        return super(TestSpooledExecution, self).get_executor()
+
+    def test_recorded_and_completed(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh'}]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(1)
+
+        events = spool.Spool(self.path)
+        self.addCleanup(events.close)
+        self.assertEqual(1, len(events.pending()))
+
+        self.popen.release.set()
+        self.assertTrue(self.get_executor().join(10))
+
+        self.assertEqual([], events.pending())
+        self.assertEqual(1, len(events.jobs()))
+
+    def test_resume_after_crash(self):
+        self.get_executor().workers = 1
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(1)
+
+        # losing the process loses the running and the queued jobs, the
+        # running job must never get to record that it completed
+        ex = self.get_executor()
+        ex.stop(0)
+        ex.spool = None
+
+        self.popen.release.set()
+        ex = executor.Executor({}, workers=1, spool=spool.Spool(self.path))
+        self.addCleanup(ex.stop, 10)
+
+        self.assertEqual(3, ex.resume())
+        self.assertTrue(ex.join(10))
+
+        self.assertEqual(['./slow.sh', '0'], self.popen.started[0].args)
+        self.assertEqual(['./slow.sh', '0'], self.popen.started[1].args)
+        self.assertEqual([], ex.spool.pending())
+
+    def assert_unlocked(self, ex, func):
+        """Wrap func to check the executor's lock isn't held when called."""
+        def locked():
+            if ex._cond.acquire(False):
+                ex._cond.release()
+            else:
+                self.held.append(func.__name__)
+
+        def wrapper(*args):
+            # the lock is reentrant so it is tried from another thread
+            thread = threading.Thread(target=locked)
+            thread.start()
+            thread.join()
+            self.called.append(func.__name__)
+            return func(*args)
+
+        return wrapper
+
+    def test_spool_written_without_lock(self):
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh'}]
+        self.held = []
+        self.called = []
+
+        ex = self.get_executor()
+        ex.spool.record = self.assert_unlocked(ex, ex.spool.record)
+        ex.spool.complete = self.assert_unlocked(ex, ex.spool.complete)
+
+        self.push(config=self.config, status=202)
+        self.popen.release.set()
+        self.assertTrue(ex.join(10))
+
+        self.assertEqual(['record', 'complete'], self.called)
+        self.assertEqual([], self.held)
+
+    def test_rejected_jobs_discarded(self):
+        self.get_executor().workers = 0
+        self.handlers = [{'repo': self.REPO_NAME, 'action': './slow.sh %d' % i}
+                         for i in range(3)]
+
+        ex = self.get_executor()
+        record = ex.spool.record
+
+        def fill(*args):
+            # another request fills the queue while this one is recorded
+            ex.spool.record = record
+            self.push(config=self.config, status=202)
+            return record(*args)
+
+        ex.spool.record = fill
+        self.push(config=self.config, status=503)
+
+        self.assertEqual(3, len(ex.spool.pending()))
+
+    def test_coalesced_jobs_completed(self):
+        self.get_executor().workers = 1
+        self.handlers = [{'repo': self.REPO_NAME,
+                          'action': './slow.sh',
+                          'coalesce': True}]
+
+        self.push(config=self.config, status=202)
+        self.wait_started(1)
+        self.push(config=self.config, status=202)
+        self.push(config=self.config, status=202)
+
+        self.popen.release.set()
+        self.assertTrue(self.get_executor().join(10))
+
+        self.assertEqual(2, len(self.popen.finished))
+        self.assertEqual([], self.get_executor().spool.pending())
+
+
+class TestReplay(base.TestCase):
+
+    def setUp(self):
+        super(TestReplay, self).setUp()
+        self.tmpdir = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmpdir, 'spool.db')
+        self.fake_popen = self.useFixture(fixtures.FakePopen())
+
+        self.clock = base.FakeClock()
+        self.spool = spool.Spool(self.path, clock=self.clock)
+        self.addCleanup(self.spool.close)
+
+        for i in range(4):
+            ids = self.spool.record('push', _event(), [{'action': 'a %d' % i}])
+            self.clock.now += 10
+
+            if i % 2:
+                self.spool.complete(ids)
+
+    def actions(self):
+        return sorted(' '.join(p._args['args'])
+                      for p in self.fake_popen.procs)
+
+    def test_replay_all(self):
+        replay.main(['--spool', self.path])
+
+        self.assertEqual(['a 0', 'a 1', 'a 2', 'a 3'], self.actions())
+        self.assertEqual(2, len(self.spool.pending()))
+
+    def test_replay_range(self):
+        replay.main(['--spool', self.path, '--since', '1010',
+                     '--until', '1030'])
+
+        self.assertEqual(['a 1', 'a 2'], self.actions())
+
+    def test_replay_pending(self):
+        replay.main(['--spool', self.path, '--pending', '-j', '1'])
+
+        self.assertEqual(['a 0', 'a 2'], self.actions())
+        self.assertEqual([], self.spool.pending())
+
+    def test_parse_time(self):
+        self.assertEqual(1000.5, replay.parse_time('1000.5'))
+        self.assertIsInstance(replay.parse_time('2016-11-24T23:15:06'), float)
+        self.assertRaises(Exception, replay.parse_time, 'yesterday')
@@ -11,8 +11,12 @@
 # under the License.
 
 import contextlib
+import fcntl
 import shutil
 import tempfile
+import threading
+
+_state_lock = threading.Lock()
 
 
 def as_list(value):
@@ -40,6 +44,24 @@ def get_dotted_key(dictionary, key_str, default=None):
     return dictionary.get(key_val, default)
 
 
+def config_state(config, name, factory):
+    """Fetch a long lived object that is stored alongside the config.
+
+    The object is created by calling factory(config) the first time it is
+    requested and the same object is returned for the lifetime of the config.
+    """
+    state = config.get('_state')
+
+    if state is None or name not in state:
+        with _state_lock:
+            state = config.setdefault('_state', {})
+
+            if name not in state:
+                state[name] = factory(config)
+
+    return state[name]
+
+
 @contextlib.contextmanager
 def mkdtemp(*args, **kwargs):
     """Create and then cleanup a temporary directory."""
@@ -49,3 +71,14 @@ def mkdtemp(*args, **kwargs):
         yield dirname
     finally:
         shutil.rmtree(dirname)
+
+
+@contextlib.contextmanager
+def flock(fd, shared=False):
+    """Hold an advisory lock on an open file descriptor."""
+    fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
@@ -0,0 +1,181 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Check out commits of a cache mirror into reusable worktrees.
+
+A worktree shares the objects of the mirror so creating one only writes the
+files of the commit. Worktrees that are released are kept in a pool next to
+the mirror, still checked out, so the next checkout only has to change the
+files that differ between the two commits.
+"""
+
+import contextlib
+import logging
+import os
+import shutil
+import uuid
+
+import git
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 2
+
+
+@contextlib.contextmanager
+def _unlocked():
+    yield
+
+
+def list_worktrees(repo):
+    """Return the paths of the worktrees registered with a repository."""
+    paths = []
+
+    for line in repo.git.worktree('list', '--porcelain').splitlines():
+        if line.startswith('worktree '):
+            paths.append(os.path.realpath(line[len('worktree '):]))
+
+    return paths
+
+
+def sparse_checkout(working_git_repo, sparse):
+    """Limit the checkout to the sparse directories, or all if None."""
+    if sparse:
+        working_git_repo.git.sparse_checkout('set', '--cone', *sparse)
+        return
+
+    try:
+        enabled = working_git_repo.git.config('--bool', 'core.sparseCheckout')
+    except git.GitCommandError:
+        enabled = 'false'
+
+    if enabled == 'true':
+        working_git_repo.git.sparse_checkout('disable')
+
+
+class WorktreePool(object):
+    """The worktrees of a bare mirror and the spare ones kept for reuse.
+
+    lock is called to guard changes to the worktrees that are registered
+    with the mirror, but not the checkouts within them.
+    """
+
+    def __init__(self, repo, pool_dir, size=DEFAULT_POOL_SIZE, lock=None):
+        self.repo = repo
+        self.pool_dir = pool_dir
+        self.size = size
+        self.lock = lock or _unlocked
+
+    @classmethod
+    def for_mirror(cls, cache, size=DEFAULT_POOL_SIZE):
+        """The pool of a mirror.Mirror, guarded by its lock."""
+        return cls(cache.repo, cache.worktrees_dir, size=size, lock=cache.lock)
+
+    def _own_config(self, path):
+        # a sparse checkout is configured per worktree. git would do that by
+        # moving core.bare out of the config of the mirror, which then looks
+        # like it isn't bare, so the worktrees override it instead.
+        self.repo.git.config('extensions.worktreeConfig', 'true')
+        git.Git(path).config('--worktree', 'core.bare', 'false')
+
+    def spares(self):
+        """Return the paths of the worktrees waiting in the pool."""
+        pool_dir = os.path.realpath(self.pool_dir)
+        return [path for path in list_worktrees(self.repo)
+                if os.path.dirname(path) == pool_dir]
+
+    def checkout(self, output_dir, commit, sparse=None):
+        """Check out commit into output_dir and return the worktree.
+
+        output_dir is reused if it is already a worktree of the mirror,
+        otherwise a spare worktree is moved there or a new one is added.
+        Only the sparse directories are checked out if they are given.
+        """
+        output_dir = os.path.realpath(output_dir)
+
+        with self.lock():
+            if output_dir not in list_worktrees(self.repo):
+                if os.path.isdir(output_dir) and not os.listdir(output_dir):
+                    os.rmdir(output_dir)
+
+                spares = self.spares()
+
+                if spares:
+                    LOG.info('Reusing worktree %s for %s',
+                             spares[0], output_dir)
+                    self.repo.git.worktree('move', spares[0], output_dir)
+                else:
+                    # checked out below, once the lock is released
+                    self.repo.git.worktree('add', '--detach', '--no-checkout',
+                                           output_dir, commit)
+
+            self._own_config(output_dir)
+
+        working_git_repo = git.Repo(output_dir)
+        sparse_checkout(working_git_repo, sparse)
+        working_git_repo.git.checkout('--detach', '--force', commit)
+        working_git_repo.git.clean('-ffdx')
+
+        return working_git_repo
+
+    def release(self, output_dir):
+        """Return a worktree to the pool, or remove it if the pool is full."""
+        output_dir = os.path.realpath(output_dir)
+
+        with self.lock():
+            if output_dir not in list_worktrees(self.repo):
+                raise ValueError('%s is not a worktree of %s' %
+                                 (output_dir, self.repo.git_dir))
+
+            if len(self.spares()) < self.size:
+                if not os.path.isdir(self.pool_dir):
+                    os.makedirs(self.pool_dir)
+
+                spare = os.path.join(self.pool_dir, uuid.uuid4().hex)
+                self.repo.git.worktree('move', output_dir, spare)
+            else:
+                self.repo.git.worktree('remove', '--force', output_dir)
+
+    def fill(self, commit):
+        """Add spare worktrees checked out at commit until the pool is full."""
+        with self.lock():
+            for _ in range(self.size - len(self.spares())):
+                spare = os.path.join(self.pool_dir, uuid.uuid4().hex)
+                self.repo.git.worktree('add', '--detach', '--no-checkout',
+                                       spare, commit)
+                self._own_config(spare)
+                git.Git(spare).checkout('--detach', '--force', commit)
+
+    def prune(self):
+        """Forget worktrees that were deleted and shrink the pool to size.
+
+        Only worktrees whose directories are gone are forgotten, so a
+        checkout that is still in use is never touched.
+        """
+        with self.lock():
+            self.repo.git.worktree('prune')
+
+            spares = self.spares()
+
+            for spare in spares[self.size:]:
+                self.repo.git.worktree('remove', '--force', spare)
+
+            # directories of spares that were never registered, from a crash
+            if os.path.isdir(self.pool_dir):
+                registered = set(spares)
+
+                for name in os.listdir(self.pool_dir):
+                    path = os.path.realpath(os.path.join(self.pool_dir,
+                                                         name))
+
+                    if path not in registered:
+                        shutil.rmtree(path, ignore_errors=True)